@@ -0,0 +1,247 @@
+"""
+JSON API on the Dash Flask server, for scripts and LIMS integrations that need calculated
+patterns without the UI.
+
+    POST /api/cifs      register CIFs, returns their cache IDs and cell parameters
+    POST /api/patterns  peak lists or broadened profiles for one or many phases
+    POST /api/search    best combinations of candidate phases for a measured pattern
+
+Phases are computed through the same shared cache and phase pool as the plot callbacks.
+"""
+import base64
+import io
+import json
+import numpy as np
+from flask import Response, jsonify, request
+from cache import shared_cache, content_hash
+from layout import app
+from preprocess import WAVELENGTHS, FULL_TWO_THETA_RANGE, phase_pattern, gaussian_profile, load_compact_structure, warm_cif
+from search import search_phases
+from workers import map_ordered
+
+server = app.server
+
+# Request limits.
+MAX_PHASES = 64
+MAX_PROFILE_POINTS = 200000
+MAX_SEARCH_PHASES = 4
+# Numeric wavelengths accepted, in angstroms: Ag Kα (0.56) to Cr Kα (2.29) with some margin.
+# Shorter ones put so many reflections below 120° that one request could hold a worker.
+MIN_WAVELENGTH = 0.5
+MAX_WAVELENGTH = 3.0
+
+class ApiError(ValueError):
+    pass
+
+@server.errorhandler(ApiError)
+def _api_error(e):
+    return jsonify({"error": str(e)}), 400
+
+def _body():
+    body = request.get_json(silent=True)
+    if not isinstance(body, dict):
+        raise ApiError("Expected a JSON object body")
+    return body
+
+def _register(cif_text):
+    """
+    Store CIF text as an upload-style data URL under its hash. Returns (cif_id, contents).
+    """
+    contents = "data:chemical/x-cif;base64," + base64.b64encode(cif_text.encode("utf-8")).decode("ascii")
+    cif_id = content_hash(contents)
+    if shared_cache.get("cif", cif_id) is None:
+        shared_cache.set("cif", cif_id, contents)
+    return cif_id, contents
+
+def _resolve(phase):
+    if not isinstance(phase, dict):
+        raise ApiError("Each phase must be an object")
+    if "cif" in phase:
+        if not isinstance(phase["cif"], str):
+            raise ApiError("'cif' must be the CIF text as a string")
+        return _register(phase["cif"])
+    if "cif_id" in phase:
+        if not isinstance(phase["cif_id"], str):
+            raise ApiError("'cif_id' must be a string")
+        contents = shared_cache.get("cif", phase["cif_id"])
+        if contents is None:
+            raise ApiError(f"Unknown cif_id {phase['cif_id']}; register the CIF again")
+        return phase["cif_id"], contents
+    raise ApiError("Each phase needs 'cif' or 'cif_id'")
+
+def _wavelength(body):
+    wavelength = body.get("wavelength", "CuKa")
+    if isinstance(wavelength, str) and wavelength in WAVELENGTHS:
+        return wavelength
+    if isinstance(wavelength, (int, float)) and not isinstance(wavelength, bool) and MIN_WAVELENGTH <= wavelength <= MAX_WAVELENGTH:
+        return float(wavelength)
+    raise ApiError(f"wavelength must be one of {sorted(WAVELENGTHS)} or a number of angstroms "
+                   f"from {MIN_WAVELENGTH} to {MAX_WAVELENGTH}")
+
+def _two_theta_range(body):
+    try:
+        lo, hi = (float(v) for v in body.get("two_theta_range", FULL_TWO_THETA_RANGE))
+    except (TypeError, ValueError):
+        raise ApiError("two_theta_range must be [min, max]")
+    if not 0 <= lo < hi <= 180:
+        raise ApiError("two_theta_range must satisfy 0 <= min < max <= 180")
+    return lo, hi
+
+def _lattice(phase):
+    lattice = phase.get("lattice")
+    if lattice is None:
+        return None
+    try:
+        lattice = tuple(float(v) for v in lattice)
+    except (TypeError, ValueError):
+        lattice = ()
+    if len(lattice) != 6:
+        raise ApiError("lattice must be [a, b, c, alpha, beta, gamma]")
+    lengths, angles = np.array(lattice[:3]), np.radians(lattice[3:])
+    if not (np.isfinite(lattice).all() and (lengths > 0).all() and ((angles > 0) & (angles < np.pi)).all()):
+        raise ApiError("lattice lengths must be positive and angles between 0 and 180 degrees")
+    cos_a, cos_b, cos_g = np.cos(angles)
+    if 1 - cos_a ** 2 - cos_b ** 2 - cos_g ** 2 + 2 * cos_a * cos_b * cos_g <= 1e-8:
+        raise ApiError("lattice angles do not form a cell with positive volume")
+    return lattice
+
+@server.route("/api/cifs", methods=["POST"])
+def register_cifs():
+    """
+    Body: {"cifs": [{"name": ..., "cif": "<CIF text>"}, ...]}. Parses and warms the cache for
+    every CIF; returns its cif_id and cell parameters, or its parse error.
+    """
+    cifs = _body().get("cifs")
+    if not isinstance(cifs, list) or not 0 < len(cifs) <= MAX_PHASES:
+        raise ApiError(f"cifs must be a list of 1 to {MAX_PHASES} objects")
+    registered = [_resolve(entry) for entry in cifs]
+    results = map_ordered(warm_cif, [(contents,) for _, contents in registered])
+
+    out = []
+    for entry, (cif_id, contents), (_, error) in zip(cifs, registered, results):
+        item = {"name": entry.get("name"), "cif_id": cif_id}
+        if error is not None:
+            item["error"] = str(error)
+        else:
+            item["lattice"] = list(load_compact_structure(contents).parameters)
+        out.append(item)
+    return jsonify({"cifs": out})
+
+@server.route("/api/patterns", methods=["POST"])
+def calculate_patterns():
+    """
+    Body: {"phases": [{"cif": ... or "cif_id": ..., "lattice": [a, b, c, alpha, beta, gamma],
+    "name": ...}, ...], "two_theta_range": [min, max], "wavelength": "CuKa" or angstroms,
+    "normalization": "window" or "global", "profile": {"step": 0.02, "fwhm": 0.1},
+    "format": "json" or "npz"}.
+
+    Without "profile" every phase comes back as a peak list (2θ, intensity scaled to 100,
+    d spacing, hkl families); with it, as intensities on a common 2θ grid. "npz" returns
+    the same arrays as a NumPy .npz archive, with the per-phase metadata as JSON in "meta".
+    """
+    body = _body()
+    phases = body.get("phases")
+    if not isinstance(phases, list) or not 0 < len(phases) <= MAX_PHASES:
+        raise ApiError(f"phases must be a list of 1 to {MAX_PHASES} objects")
+    two_theta_range = _two_theta_range(body)
+    wavelength = _wavelength(body)
+    normalization = body.get("normalization", "window")
+    if normalization not in ("window", "global"):
+        raise ApiError("normalization must be 'window' or 'global'")
+    output_format = body.get("format", "json")
+    if output_format not in ("json", "npz"):
+        raise ApiError("format must be 'json' or 'npz'")
+
+    grid = None
+    profile = body.get("profile")
+    if profile is not None:
+        try:
+            step = float(profile.get("step", 0.02))
+            fwhm = float(profile.get("fwhm", 0.1))
+        except (AttributeError, TypeError, ValueError):
+            raise ApiError("profile must be {\"step\": ..., \"fwhm\": ...}")
+        if step <= 0 or fwhm <= 0 or (two_theta_range[1] - two_theta_range[0]) / step > MAX_PROFILE_POINTS:
+            raise ApiError(f"profile step and fwhm must be positive, with at most {MAX_PROFILE_POINTS} points")
+        grid = np.arange(two_theta_range[0], two_theta_range[1] + step / 2, step)
+
+    resolved = [_resolve(phase) for phase in phases]
+    lattices = [_lattice(phase) for phase in phases]
+    results = map_ordered(phase_pattern, [
+        (contents, lattice, two_theta_range, normalization, False, wavelength)
+        for (_, contents), lattice in zip(resolved, lattices)
+    ])
+
+    meta, arrays = [], {}
+    for index, (phase, (cif_id, _), (result, error)) in enumerate(zip(phases, resolved, results)):
+        item = {"name": phase.get("name"), "cif_id": cif_id}
+        if error is not None:
+            item["error"] = str(error)
+        elif grid is not None:
+            arrays[f"{index}_intensity"] = gaussian_profile(grid, result[0].x, result[0].y, fwhm)
+        else:
+            pattern = result[0]
+            arrays[f"{index}_two_theta"] = np.asarray(pattern.x, dtype=float)
+            arrays[f"{index}_intensity"] = np.asarray(pattern.y, dtype=float)
+            arrays[f"{index}_d_spacing"] = np.asarray(pattern.d_hkls, dtype=float)
+            item["hkls"] = [[{"hkl": list(fam["hkl"]), "multiplicity": fam["multiplicity"]} for fam in fams]
+                            for fams in pattern.hkls]
+        meta.append(item)
+
+    if output_format == "npz":
+        buf = io.BytesIO()
+        if grid is not None:
+            arrays["two_theta"] = grid
+        np.savez_compressed(buf, meta=np.array(json.dumps(meta)), **arrays)
+        return Response(buf.getvalue(), mimetype="application/octet-stream",
+                        headers={"Content-Disposition": "attachment; filename=patterns.npz"})
+
+    for index, item in enumerate(meta):
+        for key in ("two_theta", "intensity", "d_spacing"):
+            if f"{index}_{key}" in arrays:
+                item[key] = arrays[f"{index}_{key}"].tolist()
+    response = {"phases": meta}
+    if grid is not None:
+        response["two_theta"] = grid.tolist()
+    return jsonify(response)
+
+@server.route("/api/search", methods=["POST"])
+def search_combinations():
+    """
+    Body: {"phases": [{"cif": ... or "cif_id": ..., "lattice": [...], "name": ...}, ...],
+    "experimental": {"two_theta": [...], "intensity": [...]}, "max_phases": 3, "top": 10,
+    "fwhm": 0.1, "wavelength": "CuKa" or angstroms}.
+
+    Returns, for every number of phases from 1 to max_phases, the best combinations ranked by
+    residual (an R-factor in %), with their non-negative scale factors and background level.
+    """
+    body = _body()
+    phases = body.get("phases")
+    if not isinstance(phases, list) or not 0 < len(phases) <= MAX_PHASES:
+        raise ApiError(f"phases must be a list of 1 to {MAX_PHASES} objects")
+    experimental = body.get("experimental")
+    try:
+        two_theta = np.asarray(experimental["two_theta"], dtype=float)
+        intensity = np.asarray(experimental["intensity"], dtype=float)
+    except (KeyError, TypeError, ValueError):
+        raise ApiError("experimental must be {\"two_theta\": [...], \"intensity\": [...]}")
+    if two_theta.ndim != 1 or two_theta.shape != intensity.shape or not 0 < len(two_theta) <= MAX_PROFILE_POINTS:
+        raise ApiError(f"experimental two_theta and intensity must be equal-length lists of at most {MAX_PROFILE_POINTS} points")
+    try:
+        max_phases = int(body.get("max_phases", 3))
+        top = int(body.get("top", 10))
+        fwhm = float(body.get("fwhm", 0.1))
+    except (TypeError, ValueError):
+        raise ApiError("max_phases and top must be integers, fwhm a number")
+    if not 1 <= max_phases <= MAX_SEARCH_PHASES or top < 1 or fwhm <= 0:
+        raise ApiError(f"max_phases must be 1 to {MAX_SEARCH_PHASES}, top positive and fwhm positive")
+
+    resolved = [_resolve(phase) for phase in phases]
+    ranked, errors = search_phases(two_theta, intensity, [contents for _, contents in resolved], max_phases, top,
+                                   fwhm, _wavelength(body), [_lattice(phase) for phase in phases])
+    meta = []
+    for index, (phase, (cif_id, _)) in enumerate(zip(phases, resolved)):
+        item = {"name": phase.get("name"), "cif_id": cif_id}
+        if index in errors:
+            item["error"] = str(errors[index])
+        meta.append(item)
+    return jsonify({"phases": meta, "combinations": {str(k): combinations for k, combinations in ranked.items()}})
@@ -1,7 +1,25 @@
 from layout import app
 import callbacks  
+import api  # noqa: F401  (JSON endpoints on the same server)
+import scheduler  # noqa: F401  (admission control of heavy callbacks)
+import instrument  # noqa: F401  (memory and payload accounting)
+import preprocess
+from config import PRELOAD
 
 server = app.server  
 
+def preload():
+    """
+    Import the heavy modules and load lookup tables up front. Under `gunicorn --preload` this
+    runs once in the master, and forked workers share the memory copy-on-write.
+    """
+    import plotly.io as pio
+
+    preprocess.preload()
+    pio.templates["plotly_white"]
+
+if PRELOAD:
+    preload()
+
 if __name__ == "__main__":
     app.run(debug=True, port=8050)
@@ -0,0 +1,206 @@
+"""
+Cache shared by all worker processes on a dyno, backed by a local SQLite file.
+
+Entries are keyed by namespace and a content hash, stored as zlib-compressed pickles and
+evicted least-recently-used once the file grows past its size limit. WAL mode lets any
+number of readers run alongside one writer, so every gunicorn worker sees the same entries.
+
+Since entries are unpickled, the cache is only used in a directory owned by this user and
+not writable by anyone else (created with mode 0700 if missing), on a file owned by this user.
+"""
+import hashlib
+import os
+import pickle
+import sqlite3
+import stat
+import threading
+import time
+import zlib
+from config import CACHE_PATH, CACHE_MAX_MB
+
+# Hits refresh the LRU timestamp at most this often, to keep reads from turning into writes.
+_TOUCH_INTERVAL = 30.0
+# Bytes a process writes, as a fraction of the size limit, before it sums the file's entries
+# again; each worker can overshoot the limit by about this much between checks.
+_EVICT_CHECK_FRACTION = 0.05
+
+def private_dir(path):
+    """
+    Create a directory with mode 0700, or check that an existing one belongs to this user and
+    is not writable by group or others. Missing parents are created the same way. Raises
+    PermissionError otherwise.
+    """
+    parent = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(parent):
+        private_dir(parent)
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    if not hasattr(os, "getuid"):
+        return path
+    info = os.stat(path)
+    if info.st_uid != os.getuid() or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH):
+        raise PermissionError(f"{path} is not a private directory of this user")
+    return path
+
+def content_hash(*parts):
+    """
+    Stable hex digest of strings, bytes and plain values (numbers, tuples, None).
+    """
+    digest = hashlib.sha1()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        elif not isinstance(part, (bytes, bytearray, memoryview)):
+            part = repr(part).encode("utf-8")
+        digest.update(part)
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+class SharedCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=int(CACHE_MAX_MB * 1024 * 1024)):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._counts = {}
+        self._verified = False
+        self._unchecked_bytes = 0
+
+    @property
+    def enabled(self):
+        if self.path and not self._verified:
+            self._verify()
+        return bool(self.path)
+
+    def _verify(self):
+        # Disable the cache rather than unpickle from a file another user could have written.
+        with self._lock:
+            if self._verified:
+                return
+            try:
+                private_dir(os.path.dirname(os.path.abspath(self.path)))
+                if hasattr(os, "getuid") and os.path.exists(self.path) and os.stat(self.path).st_uid != os.getuid():
+                    raise PermissionError(f"{self.path} belongs to another user")
+            except OSError as e:
+                print("Shared cache disabled:", e)
+                self.path = ""
+            self._verified = True
+
+    def _conn(self):
+        # One connection per thread and process; a connection must not cross a fork.
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries ("
+            "key TEXT PRIMARY KEY, namespace TEXT, value BLOB, size INTEGER, accessed REAL)"
+        )
+        conn.execute("CREATE INDEX IF NOT EXISTS entries_accessed ON entries (accessed)")
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, namespace, outcome):
+        with self._lock:
+            counts = self._counts.setdefault(namespace, {"hits": 0, "misses": 0})
+            counts[outcome] += 1
+
+    def get(self, namespace, key, default=None):
+        if not self.enabled:
+            return default
+        try:
+            conn = self._conn()
+            row = conn.execute(
+                "SELECT value, accessed FROM entries WHERE key = ?", (f"{namespace}:{key}",)
+            ).fetchone()
+            if row is None:
+                self._count(namespace, "misses")
+                return default
+            now = time.time()
+            if now - row[1] > _TOUCH_INTERVAL:
+                conn.execute("UPDATE entries SET accessed = ? WHERE key = ?", (now, f"{namespace}:{key}"))
+            value = pickle.loads(zlib.decompress(row[0]))
+        except Exception as e:
+            print("Cache read error:", e)
+            return default
+        self._count(namespace, "hits")
+        return value
+
+    def set(self, namespace, key, value):
+        if not self.enabled:
+            return
+        try:
+            blob = zlib.compress(pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), 1)
+            conn = self._conn()
+            conn.execute(
+                "INSERT OR REPLACE INTO entries (key, namespace, value, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                (f"{namespace}:{key}", namespace, blob, len(blob), time.time())
+            )
+            with self._lock:
+                self._unchecked_bytes += len(blob)
+                check = self._unchecked_bytes >= _EVICT_CHECK_FRACTION * self.max_bytes
+                if check:
+                    self._unchecked_bytes = 0
+            if check:
+                self._evict(conn)
+        except Exception as e:
+            print("Cache write error:", e)
+
+    def get_or_compute(self, namespace, key, compute):
+        """
+        Return the cached value, or compute, store and return it.
+        """
+        missing = object()
+        value = self.get(namespace, key, missing)
+        if value is missing:
+            value = compute()
+            self.set(namespace, key, value)
+        return value
+
+    def _evict(self, conn):
+        # Called every _EVICT_CHECK_FRACTION of the limit written, not on every write.
+        total = conn.execute("SELECT COALESCE(SUM(size), 0) FROM entries").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        # Drop the least recently used entries until the cache is back under 90 % of its limit.
+        target = total - int(0.9 * self.max_bytes)
+        freed = 0
+        doomed = []
+        for key, size in conn.execute("SELECT key, size FROM entries ORDER BY accessed"):
+            doomed.append((key,))
+            freed += size
+            if freed >= target:
+                break
+        conn.executemany("DELETE FROM entries WHERE key = ?", doomed)
+
+    def stats(self):
+        """
+        Entry counts and sizes per namespace (shared), plus this process's hits and misses.
+        """
+        if not self.enabled:
+            return {"enabled": False}
+        rows = self._conn().execute(
+            "SELECT namespace, COUNT(*), COALESCE(SUM(size), 0) FROM entries GROUP BY namespace"
+        ).fetchall()
+        with self._lock:
+            counts = {ns: dict(c) for ns, c in self._counts.items()}
+        namespaces = {}
+        for namespace, entries, size in rows:
+            namespaces[namespace] = dict(counts.pop(namespace, {"hits": 0, "misses": 0}), entries=entries, bytes=size)
+        for namespace, c in counts.items():
+            namespaces[namespace] = dict(c, entries=0, bytes=0)
+        return {
+            "enabled": True,
+            "path": self.path,
+            "max_bytes": self.max_bytes,
+            "bytes": sum(ns["bytes"] for ns in namespaces.values()),
+            "namespaces": namespaces,
+        }
+
+    def clear(self):
+        if self.enabled:
+            self._conn().execute("DELETE FROM entries")
+
+shared_cache = SharedCache()
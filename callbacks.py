@@ -1,15 +1,19 @@
 import base64
 import os
-import pandas as pd
-from dash import Input, Output, State, callback_context, no_update
+import time
+import numpy as np
+from dash import Input, Output, Patch, State, callback_context, html, no_update
 import plotly.graph_objects as go
-from layout import app
-from preprocess import parse_xy, parse_cif, XRDCalculator #, normalize_structure
-from plot import plot_xrd
-from pymatgen.core import Structure
-from pymatgen.io.cif import CifParser
-import plotly.io as pio
-import io
+from layout import app, REFLECTION_PAGE_SIZE
+from preprocess import parse_xy, load_compact_structure, load_solid_solution, phase_pattern, provisional_pattern, solid_solution_pattern, stored_pattern, warm_cif, XY_EXTENSIONS #, normalize_structure
+from config import PROGRESSIVE, PLOT_BUDGET_MS
+from plot import plot_xrd, plot_series, minmax_decimate, trace_array, highlight_shape, phase_trace_xy
+from series import create_series, series_frame, series_tile
+from pawley import build_pawley_content, phase_entry
+from instrument import stage
+from search import search_phases
+from experimental import processed_scan, processing_params
+from workers import map_ordered
 import json
 
 # ------------------------------------------------------------------
@@ -37,26 +41,55 @@ def update_cif_status(contents_list):
 # Store Uploaded Files Callbacks
 # ------------------------------------------------------------------
 @app.callback(
-    Output("xy-store", "data"),
+    [Output("xy-store", "data"),
+     Output("series-store", "data", allow_duplicate=True)],
     Input("upload-xy", "contents"),
-    State("upload-xy", "filename")
+    State("upload-xy", "filename"),
+    prevent_initial_call=True
 )
 def store_xy_file(contents, filename):
     if contents is not None:
         try:
-            df = parse_xy(contents)
+            start = time.perf_counter()
+            with stage("upload.xy"):
+                df = parse_xy(contents)
+            print(f"Parsed {filename}: {len(df)} points in {(time.perf_counter() - start) * 1000:.1f} ms")
             max_intensity = df['intensity'].max()
             df['intensity'] = (df['intensity'] / max_intensity) * 100
-            return df.to_json(date_format='iso', orient='split')
+            # A single scan replaces any loaded series as the experimental data.
+            return df.to_json(date_format='iso', orient='split'), None
         except Exception as e:
             print("Error processing XY file:", e)
-            return no_update
-    return no_update
+            return no_update, no_update
+    return no_update, no_update
+
+@app.callback(
+    [Output("series-store", "data"),
+     Output("series-frame-slider", "max"),
+     Output("series-frame-slider", "value"),
+     Output("series-frame-slider", "marks"),
+     Output("series-upload-status", "children")],
+    Input("upload-series", "contents"),
+    State("upload-series", "filename"),
+    prevent_initial_call=True
+)
+def store_series_files(contents_list, filenames):
+    if not contents_list:
+        return no_update, no_update, no_update, no_update, no_update
+    try:
+        meta = create_series(contents_list, filenames)
+    except Exception as e:
+        print("Error processing series:", e)
+        return no_update, no_update, no_update, no_update, ""
+    n = meta["n_scans"]
+    marks = {i: str(i) for i in range(0, n, max(1, n // 10))}
+    return meta, n - 1, 0, marks, "✓"
 
 @app.callback(
     [Output("cif-store", "data"),
      Output("cif-order-store", "data"),
-     Output("cif-visibility-store", "data", allow_duplicate=True)],
+     Output("cif-visibility-store", "data", allow_duplicate=True),
+     Output("cif-upload-errors", "children")],
     Input("upload-cif", "contents"),
     State("upload-cif", "filename"),
     State("cif-store", "data"),
@@ -66,19 +99,27 @@ def store_xy_file(contents, filename):
 )
 def store_cif_files(contents_list, filenames, existing_data, existing_order, visibility_state):
     if contents_list is None:
-        return existing_data if existing_data is not None else no_update, existing_order if existing_order is not None else no_update, no_update
+        return existing_data if existing_data is not None else no_update, existing_order if existing_order is not None else no_update, no_update, no_update
 
     cif_data = existing_data.copy() if existing_data else {}
     cif_order = existing_order.copy() if existing_order else []
     visibility = visibility_state.copy() if visibility_state else {}
 
-    for contents, name in zip(contents_list, filenames):
+    # Parse and validate the files in parallel, warming the cache for their first plot.
+    with stage("upload.cif"):
+        results = map_ordered(warm_cif, [(contents,) for contents in contents_list])
+    errors = []
+    for contents, name, (_, error) in zip(contents_list, filenames, results):
+        if error is not None:
+            print("Error parsing CIF", name, ":", error)
+            errors.append(html.Div(f"{name}: {str(error).splitlines()[0] if str(error) else type(error).__name__}"))
+            continue
         if name not in cif_order:
             cif_order.append(name)
             visibility[name] = True  # New CIFs are visible by default
         cif_data[name] = contents
 
-    return cif_data, cif_order, visibility
+    return cif_data, cif_order, visibility, errors
 
 # ------------------------------------------------------------------
 # Lattice Parameter Blocks Update Callback
@@ -129,9 +170,7 @@ def update_lattice_params_blocks(cif_data, cif_order,
     for i in range(6):
         if i < num_files:
             try:
-                structure = parse_cif(cif_data[file_names[i]])
-                # structure = normalize_structure(structure)
-                lattice = structure.lattice
+                a, b, c, alpha, beta, gamma = load_compact_structure(cif_data[file_names[i]]).parameters
                 # Set style so that visible blocks are inline-block and 50% wide.
                 style_outputs.append({
                     "display": "inline-block",
@@ -145,27 +184,27 @@ def update_lattice_params_blocks(cif_data, cif_order,
                 })
                 header_outputs.append(file_names[i])
                 if current_a[i] is None:
-                    a_outputs.append(round(lattice.a, 4))
+                    a_outputs.append(round(a, 4))
                 else:
                     a_outputs.append(current_a[i])
                 if current_b[i] is None:
-                    b_outputs.append(round(lattice.b, 4))
+                    b_outputs.append(round(b, 4))
                 else:
                     b_outputs.append(current_b[i])
                 if current_c[i] is None:
-                    c_outputs.append(round(lattice.c, 4))
+                    c_outputs.append(round(c, 4))
                 else:
                     c_outputs.append(current_c[i])
                 if current_alpha[i] is None:
-                    alpha_outputs.append(round(lattice.alpha, 4))
+                    alpha_outputs.append(round(alpha, 4))
                 else:
                     alpha_outputs.append(current_alpha[i])
                 if current_beta[i] is None:
-                    beta_outputs.append(round(lattice.beta, 4))
+                    beta_outputs.append(round(beta, 4))
                 else:
                     beta_outputs.append(current_beta[i])
                 if current_gamma[i] is None:
-                    gamma_outputs.append(round(lattice.gamma, 4))
+                    gamma_outputs.append(round(gamma, 4))
                 else:
                     gamma_outputs.append(current_gamma[i])
             except Exception as e:
@@ -214,9 +253,7 @@ def make_reset_callback(i):
         if not cif_data or not file_name:
             return no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update, no_update
         try:
-            structure = parse_cif(cif_data[file_name])
-            # structure = normalize_structure(structure)
-            lattice = structure.lattice
+            a, b, c, alpha, beta, gamma = load_compact_structure(cif_data[file_name]).parameters
             
             # Default style (no blue color)
             default_style = {
@@ -226,12 +263,12 @@ def make_reset_callback(i):
                 "margin": "15px"
             }
             
-            return (round(lattice.a, 4),
-                    round(lattice.b, 4),
-                    round(lattice.c, 4),
-                    round(lattice.alpha, 4),
-                    round(lattice.beta, 4),
-                    round(lattice.gamma, 4),
+            return (round(a, 4),
+                    round(b, 4),
+                    round(c, 4),
+                    round(alpha, 4),
+                    round(beta, 4),
+                    round(gamma, 4),
                     0,  # Reset shift slider to 0
                     default_style,
                     default_style,
@@ -264,16 +301,15 @@ def make_shift_callback(i):
         if not cif_data or not file_name or scale_value is None:
             return no_update, no_update, no_update, no_update, no_update, no_update
         try:
-            structure = parse_cif(cif_data[file_name])
-            lattice = structure.lattice
+            a, b, c = load_compact_structure(cif_data[file_name]).abc
             
             # Calculate scale factor
             scale_factor = 1 + (scale_value / 100)
             
             # Calculate new values
-            new_a = round(lattice.a * scale_factor, 4)
-            new_b = round(lattice.b * scale_factor, 4)
-            new_c = round(lattice.c * scale_factor, 4)
+            new_a = round(a * scale_factor, 4)
+            new_b = round(b * scale_factor, 4)
+            new_c = round(c * scale_factor, 4)
             
             # Determine style based on whether shifted
             if scale_value != 0:
@@ -381,112 +417,132 @@ for i in range(1, 7):
 # ------------------------------------------------------------------
 # XRD Plot Callback (Using Dynamic Lattice Parameters and per-CIF intensity/background)
 # ------------------------------------------------------------------
+def _xy_columns(xy_data):
+    """
+    Unprocessed (2θ, intensity) arrays of the scan in xy-store.
+    """
+    values = np.asarray(json.loads(xy_data)['data'], dtype=float)
+    return values[:, 0], values[:, 1]
+
+def _load_experimental(xy_data, exp_intensity, xrange, series_meta=None, frame=None, processing=None):
+    """
+    Rebuild the experimental DataFrame, scaled and cut to the 2θ range. The selected frame
+    of a loaded series takes precedence over xy-store. With a processing parameter set (see
+    processing_params), the whole scan is preprocessed first, or taken from the cache.
+    """
+    if not xy_data and not series_meta:
+        return None
+    import pandas as pd
+
+    if series_meta:
+        try:
+            if processing:
+                series_id, index = series_meta["id"], frame or 0
+                x, y = processed_scan(("series", series_id, index), lambda: series_frame(series_id, index), processing)
+                inside = (x >= min(xrange)) & (x <= max(xrange))
+                x, y = x[inside], y[inside]
+            else:
+                x, y = series_frame(series_meta["id"], frame or 0, xrange)
+        except (OSError, IndexError, ValueError) as e:
+            print("Error reading series frame:", e)
+            return None
+        scale = exp_intensity / 100 if exp_intensity is not None else 1
+        return pd.DataFrame({'2_theta': x, 'intensity': y * scale})
+
+    xrange_min, xrange_max = xrange
+    try:
+        if processing:
+            x, y = processed_scan(xy_data, lambda: _xy_columns(xy_data), processing)
+            exp_data = pd.DataFrame({'2_theta': x, 'intensity': y})
+        else:
+            # Manually parse the JSON string
+            parsed_data = json.loads(xy_data)
+
+            # Create DataFrame from the parsed data
+            exp_data = pd.DataFrame(parsed_data['data'], columns=parsed_data['columns'], index=parsed_data['index'])
+        # Scale experimental intensity
+        if exp_intensity is not None:
+            exp_data['intensity'] = exp_data['intensity'] * (exp_intensity / 100)
+
+        # Filter experimental data based on xrange
+        col_candidates = ['two_theta', 'x', 'angle']
+        col = next((c for c in col_candidates if c in exp_data.columns), exp_data.columns[0])
+        return exp_data[(exp_data[col] >= xrange_min) & (exp_data[col] <= xrange_max)]
+    except ValueError:
+        return None
+
+def _scale_pattern(pattern, intensity, background):
+    """
+    Apply a phase block's intensity scale and background offset to its pattern, in place.
+    """
+    # Work on a fresh copy of the original intensities
+    new_y = np.array(pattern.y, dtype=float)
+    # Apply intensity scaling (per CIF)
+    if intensity is not None and intensity != 100:
+        new_y *= intensity / 100
+    # Add the background offset (non-cumulatively)
+    if background is not None and background > 0:
+        new_y += background
+    pattern.y = new_y
+    return pattern
+
+# Arguments of update_xrd_plot, in order. refine_xrd_plot receives the same values as States.
+XRD_PLOT_INPUTS = (
+    [("xy-store", "data"), ("opacity-slider", "value"), ("exp-intensity-slider", "value"), ("xrange-slider", "value"),
+     ("normalization-mode", "value")] +
+    # Lattice parameter inputs for blocks 1 to 6.
+    [(f"lattice-{i}-{param}", "value") for param in ("a", "b", "c", "alpha", "beta", "gamma") for i in range(1, 7)] +
+    [(f"intensity-{i}", "value") for i in range(1, 7)] +
+    [(f"background-{i}", "value") for i in range(1, 7)] +
+    [("cif-visibility-store", "data"), ("series-store", "data"), ("series-frame-slider", "value"),
+     ("solution-store", "data"), ("solution-slider", "value")] +
+    # Experimental preprocessing steps and their parameters.
+    [("xy-processing", "value"), ("smooth-window", "value"), ("background-width", "value")]
+)
+XRD_PLOT_STATES = [("cif-store", "data"), ("cif-order-store", "data"), ("upload-xy", "filename")]
+
 @app.callback(
-    Output("xrd-plot", "figure"),
-    [
-        Input("xy-store", "data"),
-        Input("opacity-slider", "value"),
-        Input("exp-intensity-slider", "value"),  
-        Input("xrange-slider", "value"),
-        # Lattice parameter inputs for blocks 1 to 6.
-        Input("lattice-1-a", "value"),
-        Input("lattice-2-a", "value"),
-        Input("lattice-3-a", "value"),
-        Input("lattice-4-a", "value"),
-        Input("lattice-5-a", "value"),
-        Input("lattice-6-a", "value"),
-        Input("lattice-1-b", "value"),
-        Input("lattice-2-b", "value"),
-        Input("lattice-3-b", "value"),
-        Input("lattice-4-b", "value"),
-        Input("lattice-5-b", "value"),
-        Input("lattice-6-b", "value"),
-        Input("lattice-1-c", "value"),
-        Input("lattice-2-c", "value"),
-        Input("lattice-3-c", "value"),
-        Input("lattice-4-c", "value"),
-        Input("lattice-5-c", "value"),
-        Input("lattice-6-c", "value"),
-        Input("lattice-1-alpha", "value"),
-        Input("lattice-2-alpha", "value"),
-        Input("lattice-3-alpha", "value"),
-        Input("lattice-4-alpha", "value"),
-        Input("lattice-5-alpha", "value"),
-        Input("lattice-6-alpha", "value"),
-        Input("lattice-1-beta", "value"),
-        Input("lattice-2-beta", "value"),
-        Input("lattice-3-beta", "value"),
-        Input("lattice-4-beta", "value"),
-        Input("lattice-5-beta", "value"),
-        Input("lattice-6-beta", "value"),
-        Input("lattice-1-gamma", "value"),
-        Input("lattice-2-gamma", "value"),
-        Input("lattice-3-gamma", "value"),
-        Input("lattice-4-gamma", "value"),
-        Input("lattice-5-gamma", "value"),
-        Input("lattice-6-gamma", "value"),
-        Input("lattice-scale-1", "value"),
-        Input("lattice-scale-2", "value"),
-        Input("lattice-scale-3", "value"),
-        Input("lattice-scale-4", "value"),
-        Input("lattice-scale-5", "value"),
-        Input("lattice-scale-6", "value"),
-        Input("intensity-1", "value"),
-        Input("intensity-2", "value"),
-        Input("intensity-3", "value"),
-        Input("intensity-4", "value"),
-        Input("intensity-5", "value"),
-        Input("intensity-6", "value"),
-        Input("background-1", "value"),
-        Input("background-2", "value"),
-        Input("background-3", "value"),
-        Input("background-4", "value"),
-        Input("background-5", "value"),
-        Input("background-6", "value"),
-        Input("cif-visibility-store", "data")
-    ],
-    State("cif-store", "data"),
-    State("cif-order-store", "data"),
-    State("upload-xy", "filename")
+    [Output("xrd-plot", "figure"),
+     Output("plot-refine-store", "data"),
+     Output("plot-phases-store", "data")],
+    [Input(*dep) for dep in XRD_PLOT_INPUTS],
+    [State(*dep) for dep in XRD_PLOT_STATES]
 )
-def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
+def update_xrd_plot(xy_data, opacity, exp_intensity, xrange, normalization,
                     a1, a2, a3, a4, a5, a6,
                     b1, b2, b3, b4, b5, b6,
                     c1, c2, c3, c4, c5, c6,
                     alpha1, alpha2, alpha3, alpha4, alpha5, alpha6,
                     beta1, beta2, beta3, beta4, beta5, beta6,
                     gamma1, gamma2, gamma3, gamma4, gamma5, gamma6,
-                    scale1, scale2, scale3, scale4, scale5, scale6,
                     intensity1, intensity2, intensity3, intensity4, intensity5, intensity6,
                     background1, background2, background3, background4, background5, background6,
-                    visibility_state,
-                    cif_data, cif_order, xy_filename):
+                    visibility_state, series_meta, series_frame_index, solution_meta, solution_index,
+                    processing_steps, smooth_window, background_width,
+                    cif_data, cif_order, xy_filename, progressive=PROGRESSIVE):
+    # While a lattice value is being edited, phases without a stored pattern are drawn from
+    # their hkl table on the new cell first; refine_xrd_plot follows with exact intensities.
+    # Phases still calculating when the time budget runs out are drawn provisionally from
+    # cached data, or as an empty trace until then, and followed up the same way.
+    deadline = time.monotonic() + PLOT_BUDGET_MS / 1000
+    progressive = progressive and any(
+        t["prop_id"].startswith("lattice-") for t in callback_context.triggered
+    )
+    # Phases to refine, by file name: [trace index, phase block index].
+    pending = {}
+    # Phases drawn from their exact pattern, with the cell they were drawn on, so the
+    # reflection table can look the same pattern up in the cache.
+    drawn = {}
 
     file_names = cif_order if cif_order else []
     
     # Parse experimental data first (before checking cif_data)
-    exp_data = None  # Default to None if xy_data is not provided
     xrange_min, xrange_max = xrange
-    
-    # Check if xy_data is not None or empty
-    if xy_data:
-        try:
-            # Manually parse the JSON string
-            parsed_data = json.loads(xy_data)
-
-            # Create DataFrame from the parsed data
-            exp_data = pd.DataFrame(parsed_data['data'], columns=parsed_data['columns'], index=parsed_data['index'])
-            # Scale experimental intensity
-            if exp_intensity is not None and exp_data is not None:
-                exp_data['intensity'] = exp_data['intensity'] * (exp_intensity / 100)
-
-            # Filter experimental data based on xrange
-            col_candidates = ['two_theta', 'x', 'angle']
-            col = next((c for c in col_candidates if c in exp_data.columns), exp_data.columns[0])
-            exp_data = exp_data[(exp_data[col] >= xrange_min) & (exp_data[col] <= xrange_max)]
-
-        except ValueError as e:
-            exp_data = None
+    processing = processing_params(processing_steps, smooth_window, background_width)
+    with stage("plot.experimental"):
+        exp_data = _load_experimental(xy_data, exp_intensity, xrange, series_meta, series_frame_index, processing)
+    if series_meta:
+        xy_filename = series_meta["filenames"][series_frame_index or 0]
 
     # If no CIF data, but we have experimental data, plot just that
     if cif_data is None or len(file_names) == 0:
@@ -500,9 +556,9 @@ def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
                 ),
                 legend=dict(borderwidth=0)
             )
-            return fig
+            return fig, None, None
         else:
-            return {}
+            return {}, None, None
     
     patterns = []
     titles = []
@@ -513,10 +569,11 @@ def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
     alpha_vals = [alpha1, alpha2, alpha3, alpha4, alpha5, alpha6]
     beta_vals = [beta1, beta2, beta3, beta4, beta5, beta6]
     gamma_vals = [gamma1, gamma2, gamma3, gamma4, gamma5, gamma6]
-    scale_vals = [scale1, scale2, scale3, scale4, scale5, scale6]
     intensity_vals = [intensity1, intensity2, intensity3, intensity4, intensity5, intensity6]
     background_vals = [background1, background2, background3, background4, background5, background6]
 
+    # Phases are independent: compute them on the shared pool and collect them in order.
+    jobs = []
     for i in range(num_files):
         file_name = file_names[i]
         
@@ -525,54 +582,50 @@ def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
             continue
         
         try:
-            structure = parse_cif(cif_data[file_name])
-            # structure = normalize_structure(structure)
-        except Exception as e:
-            print("Error parsing CIF for", file_name, ":", e)
-            continue
-        try:
-            scale_factor = 1 + (scale_vals[i] / 100) if scale_vals[i] is not None else 1
-            new_a = a_vals[i] * scale_factor
-            new_b = b_vals[i] * scale_factor
-            new_c = c_vals[i] * scale_factor
-            new_alpha = alpha_vals[i]
-            new_beta = beta_vals[i]
-            new_gamma = gamma_vals[i]
-            new_lattice = structure.lattice.from_parameters(new_a, new_b, new_c, new_alpha, new_beta, new_gamma)
-            # Rebuild structure preserving all site occupancies
-            new_structure = Structure(
-                new_lattice,
-                [site.species for site in structure.sites],
-                [site.frac_coords for site in structure.sites],
-                coords_are_cartesian=False
-            )
+            # The shift slider writes the scaled a, b, c into the inputs, so they are used as is.
+            lattice_params = (a_vals[i], b_vals[i], c_vals[i], alpha_vals[i], beta_vals[i], gamma_vals[i])
+            if None in lattice_params:
+                raise ValueError("missing lattice parameter")
         except Exception as e:
             print("Error updating lattice for", file_name, ":", e)
-            new_structure = structure
+            lattice_params = None
+        jobs.append((i, file_name, lattice_params))
 
-        calculator = XRDCalculator(wavelength="CuKa")
-        try:
-            pattern = calculator.get_pattern(new_structure, two_theta_range=(xrange_min, xrange_max))
-        except Exception as e:
-            print("Error in XRD calculation for", file_name, ":", e)
-            continue
+    with stage("plot.phases"):
+        results = map_ordered(phase_pattern, [
+            (cif_data[file_name], lattice_params, (xrange_min, xrange_max), normalization, progressive)
+            for _, file_name, lattice_params in jobs
+        ], timeout=max(0.0, deadline - time.monotonic()) if PLOT_BUDGET_MS else None)
 
-        # Work on a fresh copy of the original intensities
-        orig_y = list(pattern.y)
-        # Apply intensity scaling (per CIF)
-        if intensity_vals[i] is not None and intensity_vals[i] != 100:
-            scaled_y = [val * (intensity_vals[i] / 100) for val in orig_y]
-        else:
-            scaled_y = orig_y
-        # Add the background offset (non-cumulatively)
-        if background_vals[i] is not None and background_vals[i] > 0:
-            new_y = [val + background_vals[i] for val in scaled_y]
+    first_trace = 0 if exp_data is None else 1
+    for (i, file_name, lattice_params), (result, error) in zip(jobs, results):
+        if isinstance(error, TimeoutError):
+            try:
+                result = provisional_pattern(cif_data[file_name], lattice_params, (xrange_min, xrange_max), normalization)
+                error = None
+            except Exception as e:
+                error = e
+        if error is not None:
+            print("Error in XRD calculation for", file_name, ":", error)
+            continue
+        pattern, exact = result
+        if not exact:
+            pending[file_name] = [first_trace + len(patterns), i]
         else:
-            new_y = scaled_y
-        pattern.y = new_y
+            drawn[file_name] = lattice_params
 
-        patterns.append(pattern)
+        patterns.append(None if pattern is None else _scale_pattern(pattern, intensity_vals[i], background_vals[i]))
         titles.append(file_name)
+
+    # The selected composition of a generated solid-solution series, drawn after the phases.
+    if solution_meta and cif_data and solution_meta["start"] in cif_data and solution_meta["end"] in cif_data:
+        try:
+            series = load_solid_solution(cif_data[solution_meta["start"]], cif_data[solution_meta["end"]], solution_meta["n_steps"])
+            index = min(solution_index or 0, solution_meta["n_steps"] - 1)
+            patterns.append(solid_solution_pattern(series, index, (xrange_min, xrange_max), normalization))
+            titles.append(f"x = {series['fractions'][index]:.3f}")
+        except Exception as e:
+            print("Error in solid-solution pattern:", e)
     
     # Prepare intensity values for composition calculation (only for visible CIFs)
     active_intensities = []
@@ -588,9 +641,16 @@ def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
     if not active_intensities:  # If all are None or hidden, use empty list
         active_intensities = []
 
-    fig = plot_xrd(patterns, titles, "CuKa", experimental_data=exp_data, opacity=opacity, exp_filename=xy_filename, intensity_values=active_intensities)
-    
-    max_y_list = [max(pattern.y) for pattern in patterns if pattern.y is not None and len(pattern.y) > 0]
+    with stage("plot.figure"):
+        fig = plot_xrd(patterns, titles, "CuKa", experimental_data=exp_data, opacity=opacity, exp_filename=xy_filename,
+                       intensity_values=active_intensities, two_theta_range=(xrange_min, xrange_max))
+    # Hover names mark the phases that are not exact yet.
+    for file_name, (trace, _) in pending.items():
+        state = "provisional" if patterns[trace - first_trace] is not None else "calculating"
+        fig.data[trace].name = f"{file_name} ({state})"
+
+    max_y_list = [float(np.max(pattern.y)) for pattern in patterns
+                  if pattern is not None and pattern.y is not None and len(pattern.y) > 0]
     max_y = max(max_y_list) if max_y_list else 100
     fig.update_layout(
         yaxis=dict(
@@ -600,7 +660,392 @@ def update_xrd_plot(xy_data, opacity, exp_intensity, xrange,
         ),
         legend=dict(borderwidth=0)
     )
-    return fig
+    # What refine_xrd_plot needs to patch the pending traces, with the time of this update,
+    # so it waits until the inputs have stopped changing.
+    refine = {
+        "pending": pending, "round": 0, "stamp": time.time(),
+        "x_range": [float(v) for v in fig.layout.xaxis.range], "max_y": max_y,
+    } if pending else None
+    return (fig, refine,
+            {"two_theta_range": [xrange_min, xrange_max], "normalization": normalization, "phases": drawn})
+
+# Follow-up rounds after an update, each within the time budget, before phases that are
+# still calculating are left provisional.
+MAX_REFINE_ROUNDS = 30
+# Refining starts once the plot inputs have not changed for this long, so typing a lattice
+# value only previews it.
+REFINE_SETTLE_S = 0.5
+
+@app.callback(
+    [Output("xrd-plot", "figure", allow_duplicate=True),
+     Output("plot-refine-store", "data", allow_duplicate=True),
+     Output("plot-phases-store", "data", allow_duplicate=True),
+     Output("plot-refine-timer", "disabled")],
+    [Input("plot-refine-store", "data"),
+     Input("plot-refine-timer", "n_intervals")],
+    [State(*dep) for dep in XRD_PLOT_INPUTS + XRD_PLOT_STATES],
+    prevent_initial_call=True
+)
+def refine_xrd_plot(refine, n_intervals, *args):
+    """
+    Exact patterns for the phases the last update only previewed or ran out of time on.
+    Only those phases are calculated, and only their traces are patched into the figure.
+    While some are still calculating, the timer repeats the round.
+    """
+    if not refine or refine["round"] >= MAX_REFINE_ROUNDS:
+        return no_update, no_update, no_update, True
+    if time.time() - refine["stamp"] < REFINE_SETTLE_S:
+        return no_update, no_update, no_update, False
+    values = dict(zip(XRD_PLOT_INPUTS + XRD_PLOT_STATES, args))
+    cif_data = values[("cif-store", "data")]
+    two_theta_range = tuple(values[("xrange-slider", "value")])
+    normalization = values[("normalization-mode", "value")]
+
+    def lattice(i):
+        params = tuple(values[(f"lattice-{i + 1}-{param}", "value")]
+                       for param in ("a", "b", "c", "alpha", "beta", "gamma"))
+        return None if None in params else params
+
+    jobs = [(file_name, trace, i) for file_name, (trace, i) in refine["pending"].items()
+            if cif_data and file_name in cif_data]
+    with stage("plot.refine"):
+        results = map_ordered(phase_pattern, [
+            (cif_data[file_name], lattice(i), two_theta_range, normalization)
+            for file_name, _, i in jobs
+        ], timeout=PLOT_BUDGET_MS / 1000 if PLOT_BUDGET_MS else None)
+
+    fig, phases = Patch(), Patch()
+    pending = {}
+    max_y = refine["max_y"]
+    for (file_name, trace, i), (result, error) in zip(jobs, results):
+        if isinstance(error, TimeoutError):
+            pending[file_name] = [trace, i]
+            continue
+        if error is not None:
+            print("Error in XRD calculation for", file_name, ":", error)
+            continue
+        pattern = _scale_pattern(result[0], values[(f"intensity-{i + 1}", "value")],
+                                 values[(f"background-{i + 1}", "value")])
+        x, y = phase_trace_xy(pattern, *refine["x_range"])
+        fig["data"][trace]["x"] = x
+        fig["data"][trace]["y"] = y
+        fig["data"][trace]["name"] = file_name
+        phases["phases"][file_name] = lattice(i)
+        if len(pattern.y):
+            max_y = max(max_y, float(np.max(pattern.y)))
+    fig["layout"]["yaxis"]["range"] = [0, max(105, max_y + 5)]
+
+    if pending:
+        return fig, dict(refine, pending=pending, round=refine["round"] + 1, max_y=max_y), phases, False
+    return fig, None, phases, True
+
+# ------------------------------------------------------------------
+# Reflection Table (one page at a time, from the cached pattern)
+# ------------------------------------------------------------------
+def _reflection_columns(pattern):
+    """
+    Column arrays of the reflection table, one entry per peak.
+    """
+    return {
+        "two_theta": np.asarray(pattern.x, dtype=float),
+        "d_spacing": np.asarray(pattern.d_hkls, dtype=float),
+        "hkl": np.array([", ".join("(" + " ".join(str(v) for v in family["hkl"]) + ")" for family in families)
+                         for families in pattern.hkls]),
+        "multiplicity": np.array([sum(family["multiplicity"] for family in families) for families in pattern.hkls]),
+        "intensity": np.asarray(pattern.y, dtype=float),
+    }
+
+@app.callback(
+    [Output("reflection-phase", "options"),
+     Output("reflection-phase", "value")],
+    Input("cif-order-store", "data"),
+    State("reflection-phase", "value")
+)
+def update_reflection_options(cif_order, current):
+    names = cif_order or []
+    return [{"label": name, "value": name} for name in names], (current if current in names else (names[0] if names else None))
+
+@app.callback(
+    [Output("reflection-table", "data"),
+     Output("reflection-table", "page_count"),
+     Output("reflection-table", "page_current"),
+     Output("reflection-status", "children"),
+     Output("reflection-view-store", "data")],
+    [Input("reflection-phase", "value"),
+     Input("plot-phases-store", "data"),
+     Input("reflection-table", "page_current"),
+     Input("reflection-table", "page_size"),
+     Input("reflection-table", "sort_by")],
+    [State("cif-store", "data"),
+     State("reflection-view-store", "data")]
+)
+def update_reflection_table(phase, drawn, page, page_size, sort_by, cif_data, shown):
+    """
+    One page of the phase's reflections as the plot shows them, sorted on the server. Only
+    the cache is read: a phase the plot has not drawn exactly yet shows a note instead.
+    """
+    if not phase or not cif_data or phase not in cif_data:
+        return [], 0, 0, "", None
+    if not drawn or phase not in drawn["phases"]:
+        return [], 0, 0, "Shown once the phase is drawn.", None
+    lattice_params = drawn["phases"][phase]
+    pattern = stored_pattern(cif_data[phase], tuple(lattice_params) if lattice_params else None,
+                             tuple(drawn["two_theta_range"]), normalization=drawn["normalization"])
+    if pattern is None:
+        return [], 0, 0, "Shown once the phase is drawn.", None
+
+    columns = _reflection_columns(pattern)
+    n = len(columns["two_theta"])
+    order = np.arange(n)
+    if sort_by and sort_by[0]["column_id"] in columns:
+        order = np.argsort(columns[sort_by[0]["column_id"]], kind="stable")
+        if sort_by[0]["direction"] == "desc":
+            order = order[::-1]
+    # A new phase, cell, range or normalization starts on the first page; plot updates that
+    # leave the shown entry as it was keep the page.
+    view = {"phase": phase, "lattice": lattice_params, "two_theta_range": drawn["two_theta_range"],
+            "normalization": drawn["normalization"]}
+    if view != shown:
+        page = 0
+    page_size = page_size or REFLECTION_PAGE_SIZE
+    page_count = max(1, -(-n // page_size))
+    page = min(page or 0, page_count - 1)
+    rows = order[page * page_size:(page + 1) * page_size]
+    data = [{
+        "id": int(row),
+        "two_theta": round(float(columns["two_theta"][row]), 4),
+        "d_spacing": round(float(columns["d_spacing"][row]), 5),
+        "hkl": str(columns["hkl"][row]),
+        "multiplicity": int(columns["multiplicity"][row]),
+        "intensity": round(float(columns["intensity"][row]), 2),
+    } for row in rows]
+    return data, page_count, page, f"{n} reflections in {drawn['two_theta_range'][0]:g}–{drawn['two_theta_range'][1]:g}° 2θ", view
+
+@app.callback(
+    Output("xrd-plot", "figure", allow_duplicate=True),
+    Input("reflection-table", "active_cell"),
+    State("reflection-table", "data"),
+    prevent_initial_call=True
+)
+def highlight_reflection(active_cell, rows):
+    """
+    Mark the reflection of the clicked row in the plot by patching the reserved shape.
+    """
+    if not active_cell or not rows or active_cell["row"] >= len(rows):
+        return no_update
+    patched = Patch()
+    patched["layout"]["shapes"][0] = highlight_shape(rows[active_cell["row"]]["two_theta"])
+    return patched
+
+# ------------------------------------------------------------------
+# Solid-Solution Series
+# ------------------------------------------------------------------
+@app.callback(
+    [Output("solution-start", "options"),
+     Output("solution-end", "options")],
+    Input("cif-order-store", "data")
+)
+def update_solution_options(cif_order):
+    options = [{"label": name, "value": name} for name in (cif_order or [])]
+    return options, options
+
+@app.callback(
+    [Output("solution-store", "data"),
+     Output("solution-slider", "max"),
+     Output("solution-slider", "value"),
+     Output("solution-slider", "marks"),
+     Output("solution-controls", "style"),
+     Output("solution-status", "children")],
+    Input("solution-btn", "n_clicks"),
+    [State("solution-start", "value"),
+     State("solution-end", "value"),
+     State("solution-steps", "value"),
+     State("cif-store", "data")],
+    prevent_initial_call=True
+)
+def generate_solid_solution(n_clicks, start, end, n_steps, cif_data):
+    """
+    Compute the whole series in one engine call (cached) and show its composition slider.
+    """
+    hidden = {"display": "none"}
+    if not n_clicks:
+        return no_update, no_update, no_update, no_update, no_update, no_update
+    if not cif_data or start not in cif_data or end not in cif_data or start == end:
+        return None, 0, 0, {}, hidden, "Choose two different uploaded CIFs."
+    n_steps = max(2, min(int(n_steps or 21), 201))
+    try:
+        with stage("solid_solution"):
+            series = load_solid_solution(cif_data[start], cif_data[end], n_steps)
+    except Exception as e:
+        print("Error generating solid solution:", e)
+        return None, 0, 0, {}, hidden, str(e)
+    fractions = series["fractions"]
+    marks = {i: f"{fractions[i]:.2f}" for i in range(0, n_steps, max(1, (n_steps - 1) // 10))}
+    marks[n_steps - 1] = f"{fractions[-1]:.2f}"
+    meta = {"start": start, "end": end, "n_steps": n_steps}
+    return meta, n_steps - 1, 0, marks, {"display": "block", "fontSize": "18px"}, ""
+
+# ------------------------------------------------------------------
+# Phase Combination Search
+# ------------------------------------------------------------------
+# Ranked combinations shown per number of phases.
+SEARCH_ROWS = 3
+
+@app.callback(
+    Output("search-results", "children"),
+    Input("search-btn", "n_clicks"),
+    [State("search-max-phases", "value"),
+     State("xy-store", "data"),
+     State("series-store", "data"),
+     State("series-frame-slider", "value"),
+     State("xrange-slider", "value"),
+     State("cif-store", "data"),
+     State("cif-order-store", "data"),
+     State("xy-processing", "value"),
+     State("smooth-window", "value"),
+     State("background-width", "value")],
+    prevent_initial_call=True
+)
+def search_phase_combinations(n_clicks, max_phases, xy_data, series_meta, frame, xrange, cif_data, cif_order,
+                              processing_steps, smooth_window, background_width):
+    """
+    Rank combinations of every uploaded CIF (on its own cell) against the experimental
+    pattern in the 2θ range.
+    """
+    if not n_clicks:
+        return no_update
+    exp_data = _load_experimental(xy_data, 100, xrange, series_meta, frame,
+                                  processing_params(processing_steps, smooth_window, background_width))
+    if exp_data is None or len(exp_data) == 0:
+        return "Upload an experimental pattern first."
+    file_names = [name for name in (cif_order or []) if cif_data and name in cif_data]
+    if not file_names:
+        return "Upload candidate CIFs first."
+
+    with stage("search"):
+        ranked, errors = search_phases(exp_data['2_theta'].to_numpy(), exp_data['intensity'].to_numpy(),
+                                       [cif_data[name] for name in file_names], int(max_phases or 1), SEARCH_ROWS)
+    for index, error in errors.items():
+        print("Error calculating", file_names[index], "for the phase search:", error)
+
+    header = html.Tr([html.Th(text, style={"textAlign": "left", "paddingRight": "20px"})
+                      for text in ("Phases", "Combination (scale factor)", "Background", "Residual (%)")])
+    rows = []
+    for k, combinations in ranked.items():
+        for combination in combinations:
+            rows.append(html.Tr([
+                html.Td(k),
+                html.Td(", ".join(f"{file_names[index]} ({scale:.3g})"
+                                  for index, scale in zip(combination["phases"], combination["scales"]))),
+                html.Td(f"{combination['background']:.3g}"),
+                html.Td(f"{combination['residual']:.2f}")
+            ]))
+    skipped = [html.Div(f"Skipped {file_names[index]}: {error}", style={"color": "red"}) for index, error in errors.items()]
+    return [html.Table([header] + rows)] + skipped
+
+# ------------------------------------------------------------------
+# Zoom Callback (Full-resolution experimental trace for the visible window)
+# ------------------------------------------------------------------
+def _relayout_range(relayout_data, axis):
+    if f"{axis}.range[0]" in relayout_data and f"{axis}.range[1]" in relayout_data:
+        return [relayout_data[f"{axis}.range[0]"], relayout_data[f"{axis}.range[1]"]]
+    if f"{axis}.range" in relayout_data:
+        return list(relayout_data[f"{axis}.range"])
+    return None
+
+@app.callback(
+    Output("xrd-plot", "figure", allow_duplicate=True),
+    Input("xrd-plot", "relayoutData"),
+    State("xy-store", "data"),
+    State("exp-intensity-slider", "value"),
+    State("xrange-slider", "value"),
+    State("series-store", "data"),
+    State("series-frame-slider", "value"),
+    State("xy-processing", "value"),
+    State("smooth-window", "value"),
+    State("background-width", "value"),
+    prevent_initial_call=True
+)
+def refine_experimental_trace(relayout_data, xy_data, exp_intensity, xrange, series_meta, series_frame_index,
+                              processing_steps, smooth_window, background_width):
+    if not relayout_data or not (xy_data or series_meta):
+        return no_update
+    x_window = _relayout_range(relayout_data, "xaxis")
+    if x_window is None and not relayout_data.get("xaxis.autorange"):
+        return no_update
+
+    exp_data = _load_experimental(xy_data, exp_intensity, xrange, series_meta, series_frame_index,
+                                  processing_params(processing_steps, smooth_window, background_width))
+    if exp_data is None or exp_data.empty:
+        return no_update
+    x = exp_data['2_theta'].to_numpy()
+    y = exp_data['intensity'].to_numpy()
+    if x_window is None:
+        x_window = [float(x.min()), float(x.max())]
+    else:
+        # Keep one point beyond each edge so the line runs to the plot border.
+        lo = max(np.searchsorted(x, min(x_window), side="left") - 1, 0)
+        hi = np.searchsorted(x, max(x_window), side="right") + 1
+        x, y = x[lo:hi], y[lo:hi]
+    x, y = minmax_decimate(x, y)
+
+    # The experimental trace is always the first trace plot_xrd adds. The axis ranges are
+    # patched too, so the figure update keeps the user's zoom instead of resetting it.
+    patched = Patch()
+    patched["data"][0]["x"] = trace_array(x)
+    patched["data"][0]["y"] = trace_array(y)
+    patched["layout"]["xaxis"]["range"] = x_window
+    y_window = _relayout_range(relayout_data, "yaxis")
+    if y_window is not None:
+        patched["layout"]["yaxis"]["range"] = y_window
+    return patched
+
+# ------------------------------------------------------------------
+# Series View Callbacks (Heatmap/waterfall of the loaded series)
+# ------------------------------------------------------------------
+@app.callback(
+    [Output("series-plot", "figure"),
+     Output("series-controls", "style")],
+    Input("series-store", "data"),
+    Input("series-view", "value"),
+    Input("series-frame-slider", "value"),
+    Input("xrange-slider", "value"),
+    Input("series-plot", "relayoutData")
+)
+def update_series_plot(series_meta, view, frame, xrange, relayout_data):
+    if not series_meta:
+        return {}, {"display": "none"}
+    x_window, frame_window = xrange, None
+    # On zoom, fetch a new tile for the visible window instead of stretching the overview.
+    triggered = [t["prop_id"] for t in callback_context.triggered]
+    if "series-plot.relayoutData" in triggered and relayout_data:
+        x_window = _relayout_range(relayout_data, "xaxis") or xrange
+        frame_window = _relayout_range(relayout_data, "yaxis") if view == "heatmap" else None
+    try:
+        two_theta, frames, z = series_tile(
+            series_meta["id"], x_window, frame_window,
+            max_frames=40 if view == "waterfall" else 200
+        )
+    except (OSError, IndexError, ValueError) as e:
+        print("Error reading series:", e)
+        return {}, {"display": "block"}
+    fig = plot_series(two_theta, frames, z.round(2), series_meta["filenames"], view=view, selected=frame)
+    fig.update_layout(xaxis=dict(range=[float(min(x_window)), float(max(x_window))]))
+    if frame_window is not None:
+        fig.update_layout(yaxis=dict(range=frame_window))
+    return fig, {"display": "block"}
+
+@app.callback(
+    Output("series-frame-slider", "value", allow_duplicate=True),
+    Input("series-plot", "clickData"),
+    State("series-view", "value"),
+    prevent_initial_call=True
+)
+def select_series_frame(click_data, view):
+    # Heatmap rows are frame indices, so a click selects that frame.
+    if not click_data or view != "heatmap":
+        return no_update
+    return int(click_data["points"][0]["y"])
 
 # ------------------------------------------------------------------
 # Legend Click Callback (Toggle trace visibility)
@@ -652,13 +1097,20 @@ def update_download_link(figure, xy_filename):
     download_name = "xrd_pattern.png"
     if xy_filename:
         stem, ext = os.path.splitext(os.path.basename(xy_filename))
-        if stem and ext.lower() == ".xy":
+        if stem and ext.lower() in XY_EXTENSIONS:
             download_name = f"{stem}_xrd.png"
 
     if not figure:
         return "", download_name
     try:
-        
+        # Kaleido has no reliable WebGL context, so export WebGL traces as SVG scatter traces.
+        # The coordinates come back from the browser as lists; as arrays they skip per-element
+        # validation and encode in one pass on the way to Kaleido.
+        figure = dict(figure, data=[
+            dict(trace, **({"type": "scatter"} if trace.get("type") == "scattergl" else {}),
+                 **{axis: trace_array(trace[axis]) for axis in ("x", "y") if isinstance(trace.get(axis), list)})
+            for trace in figure.get("data", [])
+        ])
         fig = go.Figure(figure)
         fig.update_layout(
             width=1800,
@@ -670,6 +1122,8 @@ def update_download_link(figure, xy_filename):
             showlegend=True,
             legend=dict(borderwidth=0)
         )
+        import plotly.io as pio
+
         pio.kaleido.scope.mathjax = None
         img_bytes = pio.to_image(
             fig,
@@ -690,109 +1144,6 @@ def update_download_link(figure, xy_filename):
 # ------------------------------------------------------------------
 # Pawley .inp Generation & Clipboard Copy
 # ------------------------------------------------------------------
-def _extract_space_group(cif_contents, structure=None):
-    try:
-        content_type, content_string = cif_contents.split(',')
-        decoded = base64.b64decode(content_string).decode('utf-8', errors='ignore')
-        parser = CifParser(io.StringIO(decoded))
-        cif_dict = parser.as_dict()
-        if cif_dict:
-            first_key = list(cif_dict.keys())[0]
-            data = cif_dict[first_key]
-            for key in data.keys():
-                if key.lower() in ("_space_group_name_h-m_alt", "_symmetry_space_group_name_h-m"):
-                    value = data[key]
-                    if isinstance(value, list):
-                        value = value[0]
-                    value = value.strip().strip("'").strip('"')
-                    return "".join(value.split())
-    except Exception as e:
-        print("Error extracting space group:", e)
-    if structure is not None:
-        try:
-            from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
-            sg = SpacegroupAnalyzer(structure).get_space_group_symbol()
-            return "".join(sg.split())
-        except Exception as e:
-            print("Fallback space group error:", e)
-    return ""
-
-def _format_lattice_line(param, value, use_lpa):
-    tag = "lpa" if use_lpa else "@"
-    return f"\t\t{param} {tag}  {value:.6f}"
-
-def _lpa_equal(v1, v2, decimals=4):
-    return round(float(v1), decimals) == round(float(v2), decimals)
-
-def _build_pawley_content(xy_filename, cif_entries):
-    lines = []
-    lines.append("r_wp 0 r_exp 0 r_p 0 r_wp_dash 0 r_p_dash 0 r_exp_dash 0 weighted_Durbin_Watson 0 gof 0")
-    lines.append("")
-    lines.append("iters 100000")
-    lines.append("chi2_convergence_criteria 0.001")
-    lines.append("do_errors")
-    lines.append("")
-    lines.append(f"xdd {xy_filename}")
-    lines.append("\tx_calculation_step = Yobs_dx_at(Xo); convolution_step 4")
-    lines.append("\tbkg @ 0 0 0 0 0 0")
-    lines.append("")
-    lines.append("\tlam")
-    lines.append("\t\tymin_on_ymax 0.0001")
-    lines.append("\t\tla 0.653817 lo 1.540596  lh 0.501844")
-    lines.append("\t\tla 0.346183 lo 1.544493  lh 0.626579")
-    lines.append("")
-    lines.append("\t'Zero_Error(zero,0)")
-    lines.append("")
-
-    lpa_used = False
-    for idx, entry in enumerate(cif_entries):
-        suffix = "" if idx == 0 else str(idx)
-        pku = f"pku{suffix}"
-        pkv = f"pkv{suffix}"
-        pkw = f"pkw{suffix}"
-        pkx = f"pkx{suffix}"
-        pky = f"pky{suffix}"
-        pkz = f"pkz{suffix}"
-        axial = f"axial{suffix}"
-
-        a = entry["a"]
-        b = entry["b"]
-        c = entry["c"]
-        al = entry["alpha"]
-        be = entry["beta"]
-        ga = entry["gamma"]
-        phase_name = entry["phase_name"]
-        space_group = entry["space_group"]
-
-        ab_equal = _lpa_equal(a, b)
-        ac_equal = _lpa_equal(a, c)
-        bc_equal = _lpa_equal(b, c)
-        can_use_lpa = (ab_equal or ac_equal or bc_equal) and not lpa_used
-        if can_use_lpa:
-            lpa_used = True
-
-        lines.append("\thkl_Is")
-        lines.append(
-            f"\t\tTCHZ_Peak_Type({pku}, 0.00039,{pkv}, -0.00221,{pkw}, -0.00146,!{pkx}, 0.0000,{pky}, 0.00957,!{pkz}, 0.0000)"
-        )
-        lines.append(f"\t\tSimple_Axial_Model(!{axial},10)")
-        lines.append("")
-        use_lpa_a = can_use_lpa and (ab_equal or ac_equal)
-        use_lpa_b = can_use_lpa and (ab_equal or bc_equal)
-        use_lpa_c = can_use_lpa and (ac_equal or bc_equal)
-        lines.append(_format_lattice_line("a", a, use_lpa_a))
-        lines.append(_format_lattice_line("b", b, use_lpa_b))
-        lines.append(_format_lattice_line("c", c, use_lpa_c))
-        lines.append(f"\t\tal {al:.6f}")
-        lines.append(f"\t\tbe {be:.6f}")
-        lines.append(f"\t\tga {ga:.6f}")
-        lines.append(f"\t\tCreate_2Th_Ip_file({phase_name}-hkl)")
-        lines.append(f"\t\tphase_name \"{phase_name}\"")
-        lines.append(f"\t\tspace_group \"{space_group}\"")
-        lines.append("")
-
-    return "\n".join(lines).strip() + "\n"
-
 @app.callback(
     Output("pawley-content-store", "data"),
     Input("generate-pawley-btn", "n_clicks"),
@@ -866,35 +1217,11 @@ def generate_pawley_inp(n_clicks, xy_filename, cif_data, cif_order, visibility_s
             continue
         if a_vals[i] is None or b_vals[i] is None or c_vals[i] is None:
             continue
-        try:
-            structure = parse_cif(cif_data[file_name])
-            space_group = _extract_space_group(cif_data[file_name], structure)
-        except Exception as e:
-            print("Error parsing CIF for Pawley:", e)
-            space_group = ""
-
-        phase_name = file_name[:-4] if file_name.lower().endswith('.cif') else file_name
-        cif_entries.append({
-            "a": float(a_vals[i]),
-            "b": float(b_vals[i]),
-            "c": float(c_vals[i]),
-            "alpha": float(alpha_vals[i]) if alpha_vals[i] is not None else 90.0,
-            "beta": float(beta_vals[i]) if beta_vals[i] is not None else 90.0,
-            "gamma": float(gamma_vals[i]) if gamma_vals[i] is not None else 90.0,
-            "phase_name": phase_name,
-            "space_group": space_group
-        })
-
-    content = _build_pawley_content(xy_name, cif_entries)
-
-    try:
-        output_path = os.path.join(os.getcwd(), "pawley.inp")
-        with open(output_path, "w", encoding="utf-8") as f:
-            f.write(content)
-    except Exception as e:
-        print("Error saving pawley.inp:", e)
+        lattice_params = (a_vals[i], b_vals[i], c_vals[i], alpha_vals[i], beta_vals[i], gamma_vals[i])
+        cif_entries.append(phase_entry(cif_data[file_name], file_name, lattice_params))
 
-    return content
+    # Built in memory only: the content goes to the browser, nothing is written on the server.
+    return build_pawley_content(xy_name, cif_entries)
 
 @app.callback(
     Output("pawley-download", "data"),
@@ -909,7 +1236,7 @@ def download_pawley_inp(content, xy_filename):
     download_name = "pawley.inp"
     if xy_filename:
         stem, ext = os.path.splitext(os.path.basename(xy_filename))
-        if stem and ext.lower() == ".xy":
+        if stem and ext.lower() in XY_EXTENSIONS:
             download_name = f"{stem}_pawley.inp"
 
     return {
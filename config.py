@@ -0,0 +1,71 @@
+"""
+Runtime settings. Each one can be overridden with an environment variable, e.g. in the Procfile
+or the dyno config.
+"""
+import os
+import tempfile
+
+# Figure rendering: "svg" (Scatter + Bar traces, tick marks as shapes) or
+# "webgl" (Scattergl + NaN-separated stick traces, native minor ticks).
+RENDER_MODE = os.environ.get("XRD_RENDER_MODE", "svg").lower()
+
+# JSON encoder of figure responses: "orjson" (writes NumPy trace arrays directly, as float32)
+# or "json" (standard library, float64 digits).
+JSON_ENGINE = os.environ.get("XRD_JSON_ENGINE", "orjson").lower()
+
+# Startup: by default only the layout and callback registration load at import and the heavy
+# modules load on first use. XRD_PRELOAD=1 loads everything at import, which combined with
+# `gunicorn --preload` happens once in the master process.
+PRELOAD = os.environ.get("XRD_PRELOAD", "0") == "1"
+
+# Private directory (mode 0700) of this user for the cache and server-side datasets. Cache
+# entries are unpickled, so nothing in it may be writable by other users.
+RUNTIME_DIR = os.path.join(tempfile.gettempdir(), f"xrd-match-{os.getuid()}" if hasattr(os, "getuid") else "xrd-match")
+
+# Shared cache for parsed structures and computed patterns: a local SQLite file that all
+# workers on the dyno use. It is only opened in a directory no other user can write to.
+# An empty XRD_CACHE_PATH disables it.
+CACHE_PATH = os.environ.get("XRD_CACHE_PATH", os.path.join(RUNTIME_DIR, "cache.sqlite"))
+CACHE_MAX_MB = float(os.environ.get("XRD_CACHE_MAX_MB", "256"))
+
+# Directory for server-side datasets, e.g. memory-mapped in-situ/time series stacks, created
+# private like the cache's. Series beyond DATA_MAX_MB are removed least recently used first.
+DATA_DIR = os.environ.get("XRD_DATA_DIR", os.path.join(RUNTIME_DIR, "data"))
+DATA_MAX_MB = float(os.environ.get("XRD_DATA_MAX_MB", "1024"))
+
+# Precompute, when a CIF is loaded, its pattern for every step of the "Shift unit cell" slider
+# (one vectorized batch), so dragging the slider becomes a cache lookup.
+LATTICE_SCAN = os.environ.get("XRD_LATTICE_SCAN", "1") == "1"
+
+# Progressive rendering: while lattice values are edited, first draw peaks moved to the new
+# cell with the unshifted intensities, then follow with the exact pattern in a second update.
+PROGRESSIVE = os.environ.get("XRD_PROGRESSIVE", "1") == "1"
+
+# Pattern engine: memory budget for the blocked structure-factor sums, which keeps peak memory
+# flat for cells with thousands of atoms, and the precision of their trigonometric part
+# ("float32" is roughly twice as fast with phase errors around 1e-6).
+ENGINE_MEMORY_MB = float(os.environ.get("XRD_ENGINE_MEMORY_MB", "64"))
+ENGINE_PRECISION = os.environ.get("XRD_ENGINE_PRECISION", "float64")
+
+# Per-phase work of a plot update runs on a pool shared by the requests of a worker:
+# "thread" (default, suits gthread gunicorn workers), "process", or "off" to run phases in turn.
+PHASE_POOL = os.environ.get("XRD_PHASE_POOL", "thread").lower()
+PHASE_WORKERS = int(os.environ.get("XRD_PHASE_WORKERS", str(min(6, os.cpu_count() or 1))))
+
+# Time budget of a plot update, in milliseconds. Phases still calculating when it runs out are
+# drawn provisionally (lattice-scan preview, last pattern of the CIF, or bare peak positions)
+# and replaced by follow-up updates once they finish; 0 waits for every phase.
+PLOT_BUDGET_MS = float(os.environ.get("XRD_PLOT_BUDGET_MS", "2000"))
+
+# Admission control of heavy callbacks (pattern updates, uploads, searches, image export), per
+# worker process: concurrent heavy jobs in total and per browser session, and the longest a
+# request waits in the queue before it is dropped.
+COMPUTE_CONCURRENCY = int(os.environ.get("XRD_COMPUTE_CONCURRENCY", "4"))
+SESSION_CONCURRENCY = int(os.environ.get("XRD_SESSION_CONCURRENCY", "2"))
+QUEUE_TIMEOUT_S = float(os.environ.get("XRD_QUEUE_TIMEOUT_S", "30"))
+
+# Memory and payload accounting: "off", "sizes" (request, response and store sizes per
+# callback and session) or "memory" (also tracemalloc peaks per callback and stage, which
+# slows every allocation). Sessions whose stores exceed SESSION_BUDGET_MB are logged.
+INSTRUMENT = os.environ.get("XRD_INSTRUMENT", "off").lower()
+SESSION_BUDGET_MB = float(os.environ.get("XRD_SESSION_BUDGET_MB", "20"))
@@ -0,0 +1,118 @@
+"""
+Preprocessing of experimental scans: Savitzky-Golay smoothing, Kα2 stripping and SNIP
+background subtraction, each a handful of whole-array NumPy passes.
+
+Results are cached in the shared cache under the content hash of the scan and the parameter
+set, so replotting, or switching a step off and on again, does not reprocess the scan.
+"""
+import numpy as np
+from cache import shared_cache, content_hash
+
+# Steps in the order they are applied.
+STEPS = ("smooth", "kalpha2", "background")
+# Kα1 and Kα2 wavelengths in angstroms and the Kα2/Kα1 intensity ratio.
+KALPHA_DOUBLETS = {
+    "CuKa": (1.540562, 1.544390, 0.5),
+}
+# SNIP clipping passes run on a grid coarse enough for at most this many; the background is
+# smooth on that scale, so it is interpolated back to the scan.
+SNIP_MAX_PASSES = 32
+
+def savitzky_golay(y, window=11, order=3):
+    """
+    Savitzky-Golay smoothing: a least-squares polynomial of the given order over a sliding
+    window of points (made odd), as one convolution. The ends are padded with the edge value.
+    """
+    y = np.asarray(y, dtype=float)
+    half = max(window // 2, 1)
+    order = min(order, 2 * half)
+    offsets = np.arange(-half, half + 1, dtype=float)
+    kernel = np.linalg.pinv(np.vander(offsets, order + 1, increasing=True))[0]
+    return np.convolve(np.pad(y, half, mode="edge"), kernel[::-1], mode="valid")
+
+def strip_kalpha2(two_theta, y, wavelength="CuKa"):
+    """
+    Rachinger correction: subtract from each point the Kα2 intensity of the Kα1 signal at the
+    lower angle whose Kα2 line falls there. That signal is itself corrected, so the scan is
+    processed in blocks whose sources all lie in earlier, finished blocks; the blocks are
+    short at low angles, where the doublet is narrow, and long at high ones.
+    """
+    lambda1, lambda2, ratio = KALPHA_DOUBLETS[wavelength]
+    two_theta = np.asarray(two_theta, dtype=float)
+    y = np.array(y, dtype=float)
+    source = np.degrees(2 * np.arcsin(lambda1 / lambda2 * np.sin(np.radians(two_theta / 2))))
+    # Points whose Kα1 source lies before the scan keep their intensity.
+    start = max(int(np.searchsorted(source, two_theta[0], side="left")), 1)
+    while start < len(y):
+        end = max(int(np.searchsorted(source, two_theta[start - 1], side="right")), start + 1)
+        lo = max(int(np.searchsorted(two_theta, source[start], side="right")) - 1, 0)
+        y[start:end] -= ratio * np.interp(source[start:end], two_theta[lo:start], y[lo:start])
+        start = end
+    return y
+
+def snip_background(y, half_width):
+    """
+    SNIP background estimate: clip every point to the mean of its neighbours at distances
+    1 to half_width points, on log-log-square-root intensities so weak and strong peaks are
+    clipped alike. Wide windows run on a minimum-pooled copy of the scan.
+    """
+    y = np.asarray(y, dtype=float)
+    n = len(y)
+    factor = max(1, -(-int(half_width) // SNIP_MAX_PASSES))
+    n_full = n // factor * factor
+    pooled = y[:n_full].reshape(-1, factor).min(axis=1)
+    if n_full < n:
+        pooled = np.append(pooled, y[n_full:].min())
+    offset = pooled.min()
+    v = np.log(np.log(np.sqrt(pooled - offset + 1) + 1) + 1)
+    for p in range(1, min(int(half_width) // factor, (len(v) - 1) // 2) + 1):
+        v[p:-p] = np.minimum(v[p:-p], (v[:-2 * p] + v[2 * p:]) / 2)
+    background = (np.exp(np.exp(v) - 1) - 1) ** 2 - 1 + offset
+    if factor == 1:
+        return background
+    centers = np.minimum(np.arange(len(background)) * factor + (factor - 1) / 2, n - 1)
+    return np.interp(np.arange(n), centers, background)
+
+def process_scan(two_theta, intensity, steps, smooth_window=11, background_width=1.0, wavelength="CuKa"):
+    """
+    Apply the selected steps to a scan sorted by 2θ and scale the result to a maximum of 100.
+    background_width is the SNIP half-width in degrees 2θ, at least the widest peak's.
+    """
+    two_theta = np.asarray(two_theta, dtype=float)
+    y = np.asarray(intensity, dtype=float)
+    if "smooth" in steps:
+        y = savitzky_golay(y, smooth_window)
+    if "kalpha2" in steps:
+        y = strip_kalpha2(two_theta, y, wavelength)
+    if "background" in steps:
+        step = np.median(np.diff(two_theta)) if len(two_theta) > 1 else 1.0
+        y = y - snip_background(y, max(1, round(background_width / step)))
+    peak = y.max() if len(y) else 0
+    return y / peak * 100 if peak > 0 else y
+
+def processing_params(steps, smooth_window, background_width):
+    """
+    Normalized, hashable parameter set for process_scan, or None if no step is selected.
+    """
+    steps = tuple(step for step in STEPS if step in (steps or []))
+    if not steps:
+        return None
+    return (
+        steps,
+        int(smooth_window) if "smooth" in steps and smooth_window else None,
+        float(background_width) if "background" in steps and background_width else None,
+    )
+
+def processed_scan(scan_key, load, params, wavelength="CuKa"):
+    """
+    (two_theta, intensity) of a processed scan, cached per scan and parameter set. load() is
+    only called on a cache miss and returns the unprocessed (two_theta, intensity).
+    """
+    def compute():
+        two_theta, intensity = load()
+        steps, smooth_window, background_width = params
+        processed = process_scan(two_theta, intensity, steps, smooth_window or 11,
+                                 background_width or 1.0, wavelength)
+        return np.asarray(two_theta, dtype=float), processed
+
+    return shared_cache.get_or_compute("experimental", content_hash(scan_key, params, wavelength), compute)
@@ -0,0 +1,65 @@
+"""
+Measure how long `import app` takes, so startup regressions are visible.
+
+Runs `python -X importtime -c "import app"` in fresh interpreters, once in the default lazy
+mode and once with XRD_PRELOAD=1, and prints the total plus the slowest modules.
+
+Usage:
+    python import_report.py
+    python import_report.py --top 30 --max-ms 1500   # exits non-zero above the budget
+"""
+import argparse
+import os
+import subprocess
+import sys
+import time
+
+def measure(preload, repeat=3):
+    """
+    Return (best wall time in s, {module: (self_us, cumulative_us)}) for a cold `import app`.
+    """
+    env = dict(os.environ, XRD_PRELOAD="1" if preload else "0", PYTHONWARNINGS="ignore")
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    modules = {}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", "import app"],
+            cwd=cwd, env=env, capture_output=True, text=True, check=True
+        )
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+            modules = {}
+            for line in result.stderr.splitlines():
+                if not line.startswith("import time:") or "self [us]" in line:
+                    continue
+                self_us, cumulative_us, name = line[len("import time:"):].split("|")
+                modules[name.strip()] = (int(self_us), int(cumulative_us))
+    return best, modules
+
+def print_mode(label, wall_time, modules, top):
+    total_ms = modules.get("app", (0, 0))[1] / 1000
+    print(f"\n{label}: import app {total_ms:.0f} ms ({wall_time * 1000:.0f} ms interpreter wall time)")
+    print(f"  {'module':<48}{'cumulative ms':>14}{'self ms':>10}")
+    for name, (self_us, cumulative_us) in sorted(modules.items(), key=lambda kv: -kv[1][1])[:top]:
+        print(f"  {name[:47]:<48}{cumulative_us / 1000:>14.1f}{self_us / 1000:>10.1f}")
+    return total_ms
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Report import time of the app in lazy and preload modes.")
+    parser.add_argument("--top", type=int, default=15, help="Number of modules to list per mode.")
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per mode; the fastest is reported.")
+    parser.add_argument("--max-ms", type=float, help="Fail if the lazy-mode `import app` exceeds this many ms.")
+    args = parser.parse_args(argv)
+
+    lazy_ms = print_mode("lazy", *measure(False, args.repeat), args.top)
+    print_mode("preload", *measure(True, args.repeat), args.top)
+
+    if args.max_ms is not None and lazy_ms > args.max_ms:
+        print(f"\nImport time {lazy_ms:.0f} ms exceeds the {args.max_ms:.0f} ms budget.")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
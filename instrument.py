@@ -0,0 +1,193 @@
+"""
+Memory and payload accounting, for sizing dynos and finding the callbacks behind
+out-of-memory restarts.
+
+With XRD_INSTRUMENT=sizes every Dash callback request records its request and response size
+under its outputs, plus the size of each dcc.Store it carries. The latest store sizes are
+kept per session, and a session whose stores add up to more than SESSION_BUDGET_MB is logged.
+With "memory", tracemalloc also records the peak of traced memory over each callback and
+over the stages marked with stage(). That peak is process-wide, so under concurrent requests
+it is an upper bound for each of them.
+
+    GET /api/memory  per-callback and per-stage figures, largest sessions, RSS and cache sizes
+"""
+import collections
+import contextlib
+import json
+import os
+import threading
+import time
+import tracemalloc
+from flask import g, jsonify, request
+from cache import shared_cache, content_hash
+from config import INSTRUMENT, SESSION_BUDGET_MB
+from layout import app
+from scheduler import SESSION_COOKIE
+
+server = app.server
+
+# Sessions remembered for the report, least recently seen dropped first.
+MAX_SESSIONS = 1000
+# Sessions listed in the report, largest first.
+REPORT_SESSIONS = 20
+
+_lock = threading.Lock()
+_callbacks = collections.defaultdict(dict)
+_stages = collections.defaultdict(dict)
+_sessions = collections.OrderedDict()
+
+def _record(table, key, **values):
+    # Count, total and maximum of every value, under the lock.
+    with _lock:
+        entry = table[key]
+        entry["calls"] = entry.get("calls", 0) + 1
+        for name, value in values.items():
+            entry[f"{name}_total"] = entry.get(f"{name}_total", 0) + value
+            entry[f"{name}_max"] = max(entry.get(f"{name}_max", 0), value)
+
+def _summary(table):
+    with _lock:
+        rows = {key: dict(entry) for key, entry in table.items()}
+    for entry in rows.values():
+        for name in [k[:-6] for k in entry if k.endswith("_total")]:
+            entry[f"{name}_mean"] = entry.pop(f"{name}_total") / entry["calls"]
+    return rows
+
+def _label(output):
+    # "..a.b...c.d.." for several outputs; allow_duplicate outputs end in "@<hash>".
+    keys = [part.strip(".") for part in output.split("...")] if output.startswith("..") else [output]
+    return " ".join(key.split("@")[0] for key in keys if key)
+
+def _store_sizes(body):
+    sizes = {}
+    for dep in (body.get("inputs") or []) + (body.get("state") or []):
+        if isinstance(dep, dict) and isinstance(dep.get("id"), str) and dep["id"].endswith("-store"):
+            sizes[dep["id"]] = len(json.dumps(dep.get("value"), separators=(",", ":")))
+    return sizes
+
+def _update_session(session, sizes):
+    with _lock:
+        entry = _sessions.pop(session, None) or {"stores": {}, "over_budget": False}
+        entry["stores"].update(sizes)
+        entry["seen"] = time.time()
+        _sessions[session] = entry
+        while len(_sessions) > MAX_SESSIONS:
+            _sessions.popitem(last=False)
+        total = sum(entry["stores"].values())
+        warn = total > SESSION_BUDGET_MB * 2 ** 20 and not entry["over_budget"]
+        entry["over_budget"] = total > SESSION_BUDGET_MB * 2 ** 20
+    if warn:
+        largest = max(entry["stores"], key=entry["stores"].get)
+        print(f"Session {content_hash(session)[:8]} carries {total / 2 ** 20:.1f} MB in stores "
+              f"(budget {SESSION_BUDGET_MB:g} MB, largest {largest})")
+
+# Open measurements of this thread (the callback and the stages inside it), innermost last.
+_active = threading.local()
+
+def _open_measurements():
+    if not hasattr(_active, "stack"):
+        _active.stack = []
+    return _active.stack
+
+def _start_trace():
+    """
+    Start measuring the traced memory peak. tracemalloc has one peak, which is reset here, so
+    the peak so far is first carried into the running maximum of every open measurement.
+    """
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    current, peak = tracemalloc.get_traced_memory()
+    stack = _open_measurements()
+    for measurement in stack:
+        measurement["peak"] = max(measurement["peak"], peak)
+    tracemalloc.reset_peak()
+    measurement = {"start": current, "peak": 0}
+    stack.append(measurement)
+    return measurement
+
+def _peak_since(measurement):
+    _active.stack = [m for m in _open_measurements() if m is not measurement]
+    return max(0, max(measurement["peak"], tracemalloc.get_traced_memory()[1]) - measurement["start"])
+
+@contextlib.contextmanager
+def stage(name):
+    """
+    Record the duration and, with XRD_INSTRUMENT=memory, the traced memory peak of a block.
+    """
+    if INSTRUMENT == "off":
+        yield
+        return
+    start_time = time.perf_counter()
+    start_memory = _start_trace() if INSTRUMENT == "memory" else None
+    try:
+        yield
+    finally:
+        values = {"seconds": time.perf_counter() - start_time}
+        if start_memory is not None:
+            values["peak_bytes"] = _peak_since(start_memory)
+        _record(_stages, name, **values)
+
+@server.before_request
+def _before():
+    if INSTRUMENT == "off" or not request.path.endswith("/_dash-update-component"):
+        return None
+    body = request.get_json(silent=True) or {}
+    # Measurements left open by an earlier request on this thread are finished.
+    _active.stack = []
+    g.instrument = {
+        "label": _label(body.get("output", "")),
+        "request_bytes": request.content_length or len(request.get_data()),
+        "memory": _start_trace() if INSTRUMENT == "memory" else None,
+    }
+    _update_session(request.cookies.get(SESSION_COOKIE) or request.remote_addr or "", _store_sizes(body))
+    return None
+
+@server.after_request
+def _after(response):
+    info = g.pop("instrument", None)
+    if info is None:
+        return response
+    values = {
+        "request_bytes": info["request_bytes"],
+        "response_bytes": 0 if response.is_streamed else len(response.get_data()),
+    }
+    if info["memory"] is not None:
+        values["peak_bytes"] = _peak_since(info["memory"])
+    _record(_callbacks, info["label"], **values)
+    return response
+
+def _rss():
+    # Current and peak resident set size of this process, in bytes, where the OS reports them.
+    current = peak = None
+    try:
+        with open("/proc/self/statm") as f:
+            current = int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import resource
+
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        pass
+    return current, peak
+
+@server.route("/api/memory", methods=["GET"])
+def memory_report():
+    rss, max_rss = _rss()
+    with _lock:
+        sessions = [(session, dict(entry["stores"])) for session, entry in _sessions.items()]
+    sessions.sort(key=lambda item: sum(item[1].values()), reverse=True)
+    return jsonify({
+        "mode": INSTRUMENT,
+        "pid": os.getpid(),
+        "rss_bytes": rss,
+        "max_rss_bytes": max_rss,
+        "traced_bytes": tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else None,
+        "session_budget_bytes": int(SESSION_BUDGET_MB * 2 ** 20),
+        "callbacks": _summary(_callbacks),
+        "stages": _summary(_stages),
+        "sessions": [{"session": content_hash(session)[:8], "store_bytes": sum(stores.values()), "stores": stores}
+                     for session, stores in sessions[:REPORT_SESSIONS]],
+        "cache": shared_cache.stats(),
+    })
@@ -1,5 +1,5 @@
 import dash
-from dash import html, dcc
+from dash import html, dcc, dash_table
 
 # Initialize the Dash app.
 app = dash.Dash(__name__)
@@ -24,6 +24,8 @@ upload_style = {
 # Predefine lattice parameter blocks for up to 6 CIF files.
 # Each block is initially hidden (display: none).
 max_files = 6
+# Rows per page of the reflection table; pages are fetched from the server one at a time.
+REFLECTION_PAGE_SIZE = 25
 lattice_params_blocks = []
 for i in range(1, max_files + 1):
     block = html.Div(
@@ -223,9 +225,9 @@ app.layout = html.Div(
                 html.Div(
                     dcc.Upload(
                         id="upload-xy",
-                        children=html.Div("Drop an .xy file or click to select"),
+                        children=html.Div("Drop an .xy, .xye, .csv or .dat file or click to select"),
                         multiple=False,
-                        accept=".xy",
+                        accept=".xy,.xye,.csv,.dat",
                         style=upload_style
                     ),
                     style={"width": "90%", "display": "inline-block", "verticalAlign": "top"}
@@ -303,7 +305,9 @@ app.layout = html.Div(
                     }
                 ),
                 style={"width": "10%", "display": "inline-block", "verticalAlign": "middle"}
-            )
+            ),
+            # Files that could not be parsed, one line each.
+            html.Div(id="cif-upload-errors", style={"color": "red", "fontSize": "16px", "marginTop": "5px"})
         ], style={"width": "50%", "display": "inline-block"}),
         
         # Lattice Parameters Container (predefined blocks).
@@ -348,9 +352,57 @@ app.layout = html.Div(
                     marks={i: str(i) for i in range(0, 121, 10)},
                     tooltip={"placement": "bottom", "always_visible": True}
                 )
-            ], style={"fontSize": "18px", "width": "14.3%", "display": "inline-block", "verticalAlign": "middle"})
+            ], style={"fontSize": "18px", "width": "14.3%", "display": "inline-block", "verticalAlign": "middle"}),
+
+            html.Div([
+                html.Label("Scale phases to the highest peak in:"),
+                dcc.RadioItems(
+                    id="normalization-mode",
+                    options=[{"label": "2θ range", "value": "window"}, {"label": "Full pattern", "value": "global"}],
+                    value="window",
+                    inline=True
+                )
+            ], style={"fontSize": "18px", "width": "14.3%", "marginLeft": "21px", "display": "inline-block", "verticalAlign": "middle"})
         ], style={"marginTop": "10px", "marginBottom": "10px", "width": "100%", "display": "flex", "alignItems": "center"}),
 
+        # Experimental preprocessing, applied in the listed order before plotting and searching.
+        html.Div([
+            html.Label("Experimental preprocessing:"),
+            dcc.Checklist(
+                id="xy-processing",
+                options=[
+                    {"label": "Smooth", "value": "smooth"},
+                    {"label": "Strip Kα2", "value": "kalpha2"},
+                    {"label": "Subtract background", "value": "background"}
+                ],
+                value=[],
+                inline=True,
+                inputStyle={"marginLeft": "12px", "marginRight": "4px"}
+            ),
+            html.Label("Smoothing window (points):", style={"marginLeft": "24px"}),
+            dcc.Input(
+                id="smooth-window",
+                type="number",
+                min=5,
+                max=101,
+                step=2,
+                value=11,
+                debounce=True,
+                style={"width": "60px", "marginLeft": "8px"}
+            ),
+            html.Label("Background width (°2θ):", style={"marginLeft": "24px"}),
+            dcc.Input(
+                id="background-width",
+                type="number",
+                min=0.1,
+                max=20,
+                step=0.1,
+                value=1.0,
+                debounce=True,
+                style={"width": "60px", "marginLeft": "8px"}
+            )
+        ], style={"display": "flex", "alignItems": "center", "fontSize": "18px", "marginLeft": "21px", "marginTop": "10px"}),
+
         # Download Plot button.
         html.Div([
             html.A(
@@ -375,6 +427,165 @@ app.layout = html.Div(
         html.Div([
             dcc.Graph(id="xrd-plot")
         ], id="plot-container", style={"width": "100%", "height": "1000px"}),
+
+        # Reflections of one phase, paged and sorted on the server; a row click marks the peak.
+        html.Div([
+            html.Label("Reflections of"),
+            dcc.Dropdown(id="reflection-phase", options=[], style={"width": "250px", "marginLeft": "8px", "marginRight": "8px"}),
+            html.Span(id="reflection-status", style={"marginLeft": "12px", "fontSize": "16px"})
+        ], style={"display": "flex", "alignItems": "center", "fontSize": "18px", "marginTop": "10px"}),
+        dash_table.DataTable(
+            id="reflection-table",
+            columns=[
+                {"name": "2θ (°)", "id": "two_theta", "type": "numeric"},
+                {"name": "d (Å)", "id": "d_spacing", "type": "numeric"},
+                {"name": "hkl", "id": "hkl"},
+                {"name": "Multiplicity", "id": "multiplicity", "type": "numeric"},
+                {"name": "Intensity", "id": "intensity", "type": "numeric"}
+            ],
+            data=[],
+            page_action="custom",
+            page_current=0,
+            page_size=REFLECTION_PAGE_SIZE,
+            page_count=0,
+            sort_action="custom",
+            sort_mode="single",
+            sort_by=[],
+            style_table={"width": "700px", "marginTop": "8px"},
+            style_cell={"fontFamily": "Microsoft Sans Serif", "fontSize": "16px", "padding": "4px 10px"},
+            style_header={"fontWeight": "bold"}
+        ),
+
+        # Phase combination search over all uploaded CIFs.
+        html.Div([
+            html.Label("Find the best combination of up to"),
+            dcc.Input(
+                id="search-max-phases",
+                type="number",
+                min=1,
+                max=4,
+                step=1,
+                value=2,
+                style={"width": "50px", "marginLeft": "8px", "marginRight": "8px"}
+            ),
+            html.Label("uploaded phases for the experimental pattern"),
+            html.Button(
+                "Search",
+                id="search-btn",
+                n_clicks=0,
+                style={
+                    "marginLeft": "12px",
+                    "padding": "6px 10px",
+                    "backgroundColor": "#4CAF50",
+                    "color": "white",
+                    "border": "none",
+                    "borderRadius": "4px",
+                    "cursor": "pointer",
+                    "fontSize": "14px",
+                    "height": "32px"
+                }
+            )
+        ], style={"display": "flex", "alignItems": "center", "fontSize": "18px", "marginTop": "10px"}),
+        dcc.Loading(html.Div(id="search-results", style={"fontSize": "16px", "marginTop": "10px", "marginBottom": "10px"})),
+
+        # Solid-solution series between two uploaded end members (Vegard's law).
+        html.Div([
+            html.Label("Solid solution from"),
+            dcc.Dropdown(id="solution-start", options=[], style={"width": "250px", "marginLeft": "8px", "marginRight": "8px"}),
+            html.Label("to"),
+            dcc.Dropdown(id="solution-end", options=[], style={"width": "250px", "marginLeft": "8px", "marginRight": "8px"}),
+            html.Label("in"),
+            dcc.Input(
+                id="solution-steps",
+                type="number",
+                min=2,
+                max=201,
+                step=1,
+                value=21,
+                style={"width": "60px", "marginLeft": "8px", "marginRight": "8px"}
+            ),
+            html.Label("steps"),
+            html.Button(
+                "Generate",
+                id="solution-btn",
+                n_clicks=0,
+                style={
+                    "marginLeft": "12px",
+                    "padding": "6px 10px",
+                    "backgroundColor": "#4CAF50",
+                    "color": "white",
+                    "border": "none",
+                    "borderRadius": "4px",
+                    "cursor": "pointer",
+                    "fontSize": "14px",
+                    "height": "32px"
+                }
+            ),
+            html.Span(id="solution-status", style={"marginLeft": "12px", "color": "red", "fontSize": "16px"})
+        ], style={"display": "flex", "alignItems": "center", "fontSize": "18px", "marginTop": "10px"}),
+        html.Div(id="solution-controls", style={"display": "none"}, children=[
+            html.Label("Composition (fraction of the second end member):"),
+            dcc.Slider(
+                id="solution-slider",
+                min=0,
+                max=0,
+                step=1,
+                value=0,
+                tooltip={"placement": "bottom", "always_visible": False}
+            )
+        ]),
+
+        # In-situ / time-series upload and view.
+        html.Div([
+            html.Div(
+                dcc.Upload(
+                    id="upload-series",
+                    children=html.Div("Drop a series of scans (in-situ / time series) or click to select"),
+                    multiple=True,
+                    accept=".xy,.xye,.csv,.dat",
+                    style=upload_style
+                ),
+                style={"width": "90%", "display": "inline-block", "verticalAlign": "top"}
+            ),
+            html.Div(
+                html.Span(
+                    id="series-upload-status",
+                    style={
+                        "margin-left": "10px",
+                        "color": "green",
+                        "fontSize": "24px",
+                        "position": "relative",
+                        "textAlign": "center",
+                        "left": "20px",
+                        "top": "20px"
+                    }
+                ),
+                style={"width": "10%", "display": "inline-block", "verticalAlign": "middle"}
+            )
+        ], style={"width": "50%", "display": "inline-block"}),
+        html.Div(id="series-controls", style={"display": "none"}, children=[
+            html.Div([
+                dcc.RadioItems(
+                    id="series-view",
+                    options=[{"label": "Heatmap", "value": "heatmap"}, {"label": "Waterfall", "value": "waterfall"}],
+                    value="heatmap",
+                    inline=True,
+                    style={"marginRight": "20px"}
+                ),
+                html.Div([
+                    html.Label("Frame compared with the calculated phases:"),
+                    dcc.Slider(
+                        id="series-frame-slider",
+                        min=0,
+                        max=0,
+                        step=1,
+                        value=0,
+                        tooltip={"placement": "bottom", "always_visible": True}
+                    )
+                ], style={"flex": "1 1 300px"})
+            ], style={"display": "flex", "alignItems": "center", "fontSize": "18px"}),
+            dcc.Graph(id="series-plot")
+        ]),
         
         # Hidden stores.
         dcc.Store(id="cif-store"),
@@ -382,6 +593,12 @@ app.layout = html.Div(
         dcc.Store(id="cif-order-store"),
         dcc.Store(id="cif-visibility-store", data={}),
         dcc.Store(id="pawley-content-store"),
+        dcc.Store(id="series-store"),
+        dcc.Store(id="plot-refine-store"),
+        dcc.Store(id="plot-phases-store"),
+        dcc.Store(id="reflection-view-store"),
+        dcc.Interval(id="plot-refine-timer", interval=500, disabled=True),
+        dcc.Store(id="solution-store"),
         dcc.Download(id="pawley-download")
     ]
 )
@@ -0,0 +1,377 @@
+"""
+Local load test for the Dash callback endpoints.
+
+Each simulated session behaves like a browser tab: it loads the page, uploads an
+.xy file and 3-6 CIFs, drags lattice sliders, toggles phase visibility and
+experimental preprocessing, pages the reflection table and generates a Pawley
+file. Callback chains are resolved from `/_dash-dependencies` the same way the
+Dash renderer does, so the tool keeps working when callbacks change. Everything
+runs against localhost.
+
+Usage:
+    python loadtest.py --sessions 40 --concurrency 8
+    python loadtest.py --url http://127.0.0.1:8000 --sessions 100 --concurrency 20
+"""
+import argparse
+import base64
+import http.cookiejar
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+LOCAL_HOSTS = ("127.0.0.1", "localhost", "::1")
+MAX_CHAIN_DEPTH = 10
+
+# ------------------------------------------------------------------
+# Test Data
+# ------------------------------------------------------------------
+def _builtin_cifs():
+    """
+    Build a small library of CIFs covering cubic, tetragonal and hexagonal cells.
+    """
+    from pymatgen.core import Lattice, Structure
+    from pymatgen.io.cif import CifWriter
+
+    structures = {
+        "NaCl.cif": Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.64), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        "Si.cif": Structure.from_spacegroup("Fd-3m", Lattice.cubic(5.431), ["Si"], [[0, 0, 0]]),
+        "CsCl.cif": Structure.from_spacegroup("Pm-3m", Lattice.cubic(4.12), ["Cs", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+        "Cu.cif": Structure.from_spacegroup("Fm-3m", Lattice.cubic(3.615), ["Cu"], [[0, 0, 0]]),
+        "TiO2.cif": Structure.from_spacegroup("P4_2/mnm", Lattice.tetragonal(4.594, 2.959), ["Ti", "O"], [[0, 0, 0], [0.3048, 0.3048, 0]]),
+        "ZnO.cif": Structure.from_spacegroup("P6_3mc", Lattice.hexagonal(3.25, 5.207), ["Zn", "O"], [[1 / 3, 2 / 3, 0], [1 / 3, 2 / 3, 0.382]]),
+    }
+    return {name: str(CifWriter(structure, symprec=0.01)) for name, structure in structures.items()}
+
+def _synthetic_xy(n_points=11500, seed=0):
+    """
+    Generate a noisy powder pattern with a few dozen Gaussian peaks.
+    """
+    import numpy as np
+
+    rng = np.random.default_rng(seed)
+    two_theta = np.linspace(5, 120, n_points)
+    intensity = 20 + 5 * rng.random(n_points)
+    for center, height in zip(rng.uniform(10, 115, 40), rng.uniform(10, 1000, 40)):
+        intensity += height * np.exp(-0.5 * ((two_theta - center) / 0.05) ** 2)
+    return "\n".join(f"{x:.4f} {y:.2f}" for x, y in zip(two_theta, intensity))
+
+def _data_url(text):
+    return "data:application/octet-stream;base64," + base64.b64encode(text.encode("utf-8")).decode("ascii")
+
+def load_files(xy_path=None, cif_dir=None):
+    """
+    Return (xy_name, xy_url, {cif_name: cif_url}) for the session script.
+    """
+    if xy_path:
+        with open(xy_path, encoding="utf-8", errors="ignore") as f:
+            xy_name, xy_text = os.path.basename(xy_path), f.read()
+    else:
+        xy_name, xy_text = "synthetic.xy", _synthetic_xy()
+
+    if cif_dir:
+        cifs = {}
+        for name in sorted(os.listdir(cif_dir)):
+            if name.lower().endswith(".cif"):
+                with open(os.path.join(cif_dir, name), encoding="utf-8", errors="ignore") as f:
+                    cifs[name] = f.read()
+    else:
+        cifs = _builtin_cifs()
+    if len(cifs) < 3:
+        raise SystemExit("At least 3 CIFs are needed for the session script.")
+    return xy_name, _data_url(xy_text), {name: _data_url(text) for name, text in cifs.items()}
+
+# ------------------------------------------------------------------
+# Dash Client
+# ------------------------------------------------------------------
+def _collect_props(node, values):
+    """
+    Walk a serialized Dash layout and record the initial props of every component with an id.
+    """
+    if isinstance(node, list):
+        for child in node:
+            _collect_props(child, values)
+        return
+    if not isinstance(node, dict) or "props" not in node:
+        return
+    props = node["props"]
+    component_id = props.get("id")
+    for prop, value in props.items():
+        if prop == "children" and isinstance(value, (dict, list)):
+            _collect_props(value, values)
+        elif isinstance(component_id, str) and prop != "id":
+            values[f"{component_id}.{prop}"] = value
+
+def _callback_label(output):
+    """
+    Short, block-independent label for a callback output key.
+    """
+    parts = [p for p in output.split("...") if p.strip(".")] if output.startswith("..") else [output]
+    first = re.sub(r"@[0-9a-f]+", "", parts[0].strip("."))
+    first = re.sub(r"-\d+(?=[-.])", "-{i}", first)
+    return first if len(parts) == 1 else f"{first} (+{len(parts) - 1})"
+
+class DashClient:
+    """
+    Minimal stand-in for the Dash renderer: keeps component state and resolves callback chains.
+    """
+
+    def __init__(self, base_url, dependencies, initial_values, stats):
+        self.base_url = base_url.rstrip("/")
+        self.values = dict(initial_values)
+        self.stats = stats
+        # Keeps the session cookie, so the server schedules each simulated tab separately.
+        self.opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(http.cookiejar.CookieJar()))
+        self.callbacks = [d for d in dependencies if d.get("clientside_function") is None]
+        self.by_input = {}
+        for cb in self.callbacks:
+            for dep in cb["inputs"]:
+                self.by_input.setdefault(f"{dep['id']}.{dep['property']}", []).append(cb)
+
+    def _outputs(self, cb):
+        output = cb["output"]
+        keys = [p.strip(".") for p in output.split("...")] if output.startswith("..") else [output]
+        return [re.sub(r"@[0-9a-f]+$", "", k) for k in keys if k]
+
+    def _call(self, cb, changed):
+        body = {
+            "output": cb["output"],
+            "inputs": [dict(dep, value=self.values.get(f"{dep['id']}.{dep['property']}")) for dep in cb["inputs"]],
+            "state": [dict(dep, value=self.values.get(f"{dep['id']}.{dep['property']}")) for dep in cb["state"]],
+            "changedPropIds": sorted(changed),
+        }
+        data = json.dumps(body).encode("utf-8")
+        request = urllib.request.Request(
+            self.base_url + "/_dash-update-component",
+            data=data,
+            headers={"Content-Type": "application/json"},
+        )
+        start = time.perf_counter()
+        ok = True
+        updated = {}
+        try:
+            with self.opener.open(request, timeout=300) as response:
+                payload = response.read()
+                if response.status == 200 and payload:
+                    for component_id, props in json.loads(payload).get("response", {}).items():
+                        for prop, value in props.items():
+                            updated[f"{component_id}.{prop}"] = value
+        except urllib.error.HTTPError as e:
+            ok = e.code == 204
+        except (urllib.error.URLError, OSError, ValueError):
+            ok = False
+        self.stats.record(_callback_label(cb["output"]), time.perf_counter() - start, ok)
+        return updated
+
+    def trigger(self, changes):
+        """
+        Apply prop changes and run every server-side callback they reach, wave by wave.
+        """
+        self.values.update(changes)
+        changed = set(changes)
+        # Callback that produced each changed prop: like the renderer, a callback is not
+        # triggered again by its own outputs.
+        sources = {}
+        deferred = {}
+        depth = 0
+        while (changed or deferred) and depth < MAX_CHAIN_DEPTH:
+            pending, deferred = deferred, {}
+            for prop in changed:
+                for cb in self.by_input.get(prop, []):
+                    if sources.get(prop) == cb["output"]:
+                        continue
+                    pending.setdefault(cb["output"], (cb, set()))[1].add(prop)
+            # Like the renderer, hold back callbacks whose inputs are still being produced.
+            produced = {key for cb, _ in pending.values() for key in self._outputs(cb)}
+            changed = set()
+            for output, (cb, props) in pending.items():
+                inputs = {f"{dep['id']}.{dep['property']}" for dep in cb["inputs"]}
+                if inputs & (produced - set(self._outputs(cb))):
+                    deferred[output] = (cb, props)
+                    continue
+                updated = self._call(cb, props)
+                self.values.update(updated)
+                changed |= set(updated)
+                sources.update(dict.fromkeys(updated, output))
+            depth += 1
+
+    def initial_load(self):
+        """
+        Fire every callback that runs on page load.
+        """
+        for cb in self.callbacks:
+            if not cb.get("prevent_initial_call"):
+                self.values.update(self._call(cb, set()))
+
+# ------------------------------------------------------------------
+# Statistics
+# ------------------------------------------------------------------
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.errors = {}
+
+    def record(self, label, seconds, ok):
+        with self.lock:
+            self.latencies.setdefault(label, []).append(seconds)
+            if not ok:
+                self.errors[label] = self.errors.get(label, 0) + 1
+
+    def report(self, wall_time, sessions):
+        total = sum(len(v) for v in self.latencies.values())
+        rows = []
+        for label, values in sorted(self.latencies.items(), key=lambda kv: -sum(kv[1])):
+            values = sorted(values)
+            rows.append({
+                "callback": label,
+                "calls": len(values),
+                "errors": self.errors.get(label, 0),
+                "mean_ms": 1000 * sum(values) / len(values),
+                "p50_ms": 1000 * _percentile(values, 50),
+                "p95_ms": 1000 * _percentile(values, 95),
+                "p99_ms": 1000 * _percentile(values, 99),
+                "max_ms": 1000 * values[-1],
+            })
+        return {
+            "sessions": sessions,
+            "requests": total,
+            "wall_time_s": wall_time,
+            "requests_per_s": total / wall_time if wall_time else 0.0,
+            "sessions_per_min": 60 * sessions / wall_time if wall_time else 0.0,
+            "callbacks": rows,
+        }
+
+def _percentile(sorted_values, pct):
+    index = max(0, min(len(sorted_values) - 1, int(round(pct / 100 * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+def print_report(report):
+    print(f"\n{report['sessions']} sessions, {report['requests']} requests in {report['wall_time_s']:.1f} s "
+          f"({report['requests_per_s']:.1f} req/s, {report['sessions_per_min']:.1f} sessions/min)\n")
+    header = f"{'callback':<44}{'calls':>7}{'err':>5}{'mean':>9}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}"
+    print(header)
+    print("-" * len(header))
+    for row in report["callbacks"]:
+        print(f"{row['callback'][:43]:<44}{row['calls']:>7}{row['errors']:>5}"
+              f"{row['mean_ms']:>9.1f}{row['p50_ms']:>9.1f}{row['p95_ms']:>9.1f}{row['p99_ms']:>9.1f}{row['max_ms']:>9.1f}")
+    print("\nLatencies in ms.")
+    scheduler = report.get("scheduler")
+    if scheduler:
+        waits = scheduler["wait_ms"]
+        print(f"Heavy callback queue: {scheduler['counts']}, wait mean {waits['mean']:.1f} ms, "
+              f"p95 {waits['p95']:.1f} ms, max {waits['max']:.1f} ms")
+
+# ------------------------------------------------------------------
+# Session Script
+# ------------------------------------------------------------------
+def run_session(base_url, dependencies, initial_values, files, stats, seed, drags):
+    rng = random.Random(seed)
+    xy_name, xy_url, cifs = files
+    client = DashClient(base_url, dependencies, initial_values, stats)
+    client.initial_load()
+
+    client.trigger({"upload-xy.filename": xy_name, "upload-xy.contents": xy_url})
+
+    names = rng.sample(sorted(cifs), rng.randint(3, min(6, len(cifs))))
+    client.trigger({"upload-cif.filename": names, "upload-cif.contents": [cifs[n] for n in names]})
+
+    # Drag a slider in 0.1 % steps, like a mouse drag does.
+    for _ in range(drags):
+        block = rng.randint(1, len(names))
+        target = round(rng.uniform(-2, 2), 1)
+        current = client.values.get(f"lattice-scale-{block}.value") or 0
+        step = 0.1 if target >= current else -0.1
+        value = current
+        while abs(value - target) > 1e-9:
+            value = round(value + step, 1)
+            client.trigger({f"lattice-scale-{block}.value": value})
+
+    block = rng.randint(1, len(names))
+    for _ in range(2):
+        clicks = (client.values.get(f"toggle-{block}.n_clicks") or 0) + 1
+        client.trigger({f"toggle-{block}.n_clicks": clicks})
+
+    # Page through the reflection table and mark a reflection in the plot.
+    client.trigger({"reflection-table.page_current": 1})
+    client.trigger({"reflection-table.active_cell": {"row": 0, "column": 0}})
+
+    # Switch the experimental preprocessing on step by step and off again; the second pass
+    # is served from the cache.
+    for steps in (["smooth"], ["smooth", "background"], ["smooth", "kalpha2", "background"], [], ["smooth"]):
+        client.trigger({"xy-processing.value": steps})
+
+    clicks = (client.values.get("generate-pawley-btn.n_clicks") or 0) + 1
+    client.trigger({"generate-pawley-btn.n_clicks": clicks})
+
+def _start_local_server():
+    """
+    Serve app.server on a free localhost port in a background thread.
+    """
+    from werkzeug.serving import make_server
+    import app
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    httpd = make_server("127.0.0.1", 0, app.server, threaded=True)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{httpd.server_port}", httpd
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Drive the Dash callbacks with concurrent simulated sessions.")
+    parser.add_argument("--url", help="Base URL of a running server (localhost only). Starts an in-process server if omitted.")
+    parser.add_argument("--sessions", type=int, default=20, help="Total number of sessions to run.")
+    parser.add_argument("--concurrency", type=int, default=4, help="Number of sessions running at the same time.")
+    parser.add_argument("--drags", type=int, default=3, help="Slider drags per session.")
+    parser.add_argument("--xy", help="Experimental file to upload (default: synthetic 11.5k-point pattern).")
+    parser.add_argument("--cif-dir", help="Directory of CIFs to sample from (default: built-in phases).")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--json", dest="json_path", help="Also write the report to this JSON file.")
+    args = parser.parse_args(argv)
+
+    httpd = None
+    if args.url:
+        if urlparse(args.url).hostname not in LOCAL_HOSTS:
+            raise SystemExit("Refusing to load-test a non-local host.")
+        base_url = args.url
+    else:
+        base_url, httpd = _start_local_server()
+
+    files = load_files(args.xy, args.cif_dir)
+    with urllib.request.urlopen(base_url.rstrip("/") + "/_dash-dependencies") as response:
+        dependencies = json.loads(response.read())
+    with urllib.request.urlopen(base_url.rstrip("/") + "/_dash-layout") as response:
+        initial_values = {}
+        _collect_props(json.loads(response.read()), initial_values)
+
+    stats = Stats()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        futures = [
+            pool.submit(run_session, base_url, dependencies, initial_values, files, stats, args.seed + n, args.drags)
+            for n in range(args.sessions)
+        ]
+        for future in futures:
+            future.result()
+    report = stats.report(time.perf_counter() - start, args.sessions)
+    try:
+        with urllib.request.urlopen(base_url.rstrip("/") + "/api/scheduler") as response:
+            report["scheduler"] = json.loads(response.read())
+    except (urllib.error.URLError, OSError, ValueError):
+        pass
+
+    print_report(report)
+    if args.json_path:
+        with open(args.json_path, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if httpd is not None:
+        httpd.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Pawley refinement input (.inp) generation, in memory.
+
+Also usable as a batch tool that writes one .inp per scan in a directory, all against the
+same phase set:
+    python pawley.py SCAN_DIR PHASE1.cif PHASE2.cif ... [--out OUT_DIR]
+"""
+import argparse
+import base64
+import os
+import re
+import sys
+from cache import shared_cache, content_hash
+from preprocess import load_structure, XY_EXTENSIONS
+
+_SPACE_GROUP_TAG = re.compile(
+    r"^[ \t]*_(?:space_group_name_h-m_alt|symmetry_space_group_name_h-m)[ \t]*(.*)$",
+    re.IGNORECASE | re.MULTILINE
+)
+# A CIF value: quoted, or bare up to a trailing comment.
+_CIF_VALUE = re.compile(r"""'([^']*)'|"([^"]*)"|([^#]*)""")
+
+def _space_group_from_text(text):
+    """
+    Read the H-M symbol straight from the CIF text, without building a CifParser.
+    """
+    match = _SPACE_GROUP_TAG.search(text)
+    if not match:
+        return ""
+    value = match.group(1).strip()
+    if not value or value.startswith("#"):
+        # The value may sit on the following line.
+        rest = text[match.end():].lstrip("\r\n")
+        value = rest.splitlines()[0].strip() if rest else ""
+        if value.startswith(("_", "loop_")):
+            return ""
+    value = next(group for group in _CIF_VALUE.match(value).groups() if group is not None)
+    return "".join(value.split())
+
+def space_group_symbol(cif_contents):
+    """
+    Space group symbol for a CIF upload, cached per CIF hash. Falls back to SpacegroupAnalyzer
+    when the CIF does not state the symbol.
+    """
+    def compute():
+        try:
+            content_type, content_string = cif_contents.split(',')
+            symbol = _space_group_from_text(base64.b64decode(content_string).decode('utf-8', errors='ignore'))
+            if symbol:
+                return symbol
+        except Exception as e:
+            print("Error extracting space group:", e)
+        try:
+            from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
+            sg = SpacegroupAnalyzer(load_structure(cif_contents)).get_space_group_symbol()
+            return "".join(sg.split())
+        except Exception as e:
+            print("Fallback space group error:", e)
+        return ""
+
+    return shared_cache.get_or_compute("spacegroup", content_hash(cif_contents), compute)
+
+def phase_entry(cif_contents, file_name, lattice_params=None):
+    """
+    Phase block data for build_pawley_content. lattice_params (a, b, c, alpha, beta, gamma)
+    default to the CIF's own cell; missing angles default to 90°.
+    """
+    if lattice_params is None:
+        lattice = load_structure(cif_contents).lattice
+        lattice_params = lattice.abc + lattice.angles
+    a, b, c, alpha, beta, gamma = lattice_params
+    phase_name = file_name[:-4] if file_name.lower().endswith('.cif') else file_name
+    return {
+        "a": float(a),
+        "b": float(b),
+        "c": float(c),
+        "alpha": float(alpha) if alpha is not None else 90.0,
+        "beta": float(beta) if beta is not None else 90.0,
+        "gamma": float(gamma) if gamma is not None else 90.0,
+        "phase_name": phase_name,
+        "space_group": space_group_symbol(cif_contents)
+    }
+
+def _format_lattice_line(param, value, use_lpa):
+    tag = "lpa" if use_lpa else "@"
+    return f"\t\t{param} {tag}  {value:.6f}"
+
+def _lpa_equal(v1, v2, decimals=4):
+    return round(float(v1), decimals) == round(float(v2), decimals)
+
+def build_pawley_content(xy_filename, cif_entries):
+    lines = []
+    lines.append("r_wp 0 r_exp 0 r_p 0 r_wp_dash 0 r_p_dash 0 r_exp_dash 0 weighted_Durbin_Watson 0 gof 0")
+    lines.append("")
+    lines.append("iters 100000")
+    lines.append("chi2_convergence_criteria 0.001")
+    lines.append("do_errors")
+    lines.append("")
+    lines.append(f"xdd {xy_filename}")
+    lines.append("\tx_calculation_step = Yobs_dx_at(Xo); convolution_step 4")
+    lines.append("\tbkg @ 0 0 0 0 0 0")
+    lines.append("")
+    lines.append("\tlam")
+    lines.append("\t\tymin_on_ymax 0.0001")
+    lines.append("\t\tla 0.653817 lo 1.540596  lh 0.501844")
+    lines.append("\t\tla 0.346183 lo 1.544493  lh 0.626579")
+    lines.append("")
+    lines.append("\t'Zero_Error(zero,0)")
+    lines.append("")
+
+    lpa_used = False
+    for idx, entry in enumerate(cif_entries):
+        suffix = "" if idx == 0 else str(idx)
+        pku = f"pku{suffix}"
+        pkv = f"pkv{suffix}"
+        pkw = f"pkw{suffix}"
+        pkx = f"pkx{suffix}"
+        pky = f"pky{suffix}"
+        pkz = f"pkz{suffix}"
+        axial = f"axial{suffix}"
+
+        a = entry["a"]
+        b = entry["b"]
+        c = entry["c"]
+        al = entry["alpha"]
+        be = entry["beta"]
+        ga = entry["gamma"]
+        phase_name = entry["phase_name"]
+        space_group = entry["space_group"]
+
+        ab_equal = _lpa_equal(a, b)
+        ac_equal = _lpa_equal(a, c)
+        bc_equal = _lpa_equal(b, c)
+        can_use_lpa = (ab_equal or ac_equal or bc_equal) and not lpa_used
+        if can_use_lpa:
+            lpa_used = True
+
+        lines.append("\thkl_Is")
+        lines.append(
+            f"\t\tTCHZ_Peak_Type({pku}, 0.00039,{pkv}, -0.00221,{pkw}, -0.00146,!{pkx}, 0.0000,{pky}, 0.00957,!{pkz}, 0.0000)"
+        )
+        lines.append(f"\t\tSimple_Axial_Model(!{axial},10)")
+        lines.append("")
+        use_lpa_a = can_use_lpa and (ab_equal or ac_equal)
+        use_lpa_b = can_use_lpa and (ab_equal or bc_equal)
+        use_lpa_c = can_use_lpa and (ac_equal or bc_equal)
+        lines.append(_format_lattice_line("a", a, use_lpa_a))
+        lines.append(_format_lattice_line("b", b, use_lpa_b))
+        lines.append(_format_lattice_line("c", c, use_lpa_c))
+        lines.append(f"\t\tal {al:.6f}")
+        lines.append(f"\t\tbe {be:.6f}")
+        lines.append(f"\t\tga {ga:.6f}")
+        lines.append(f"\t\tCreate_2Th_Ip_file({phase_name}-hkl)")
+        lines.append(f"\t\tphase_name \"{phase_name}\"")
+        lines.append(f"\t\tspace_group \"{space_group}\"")
+        lines.append("")
+
+    return "\n".join(lines).strip() + "\n"
+
+def _file_data_url(path):
+    with open(path, "rb") as f:
+        return "data:application/octet-stream;base64," + base64.b64encode(f.read()).decode("ascii")
+
+def generate_pawley_batch(scan_dir, cif_paths, out_dir=None):
+    """
+    Write <scan>_pawley.inp for every experimental file in scan_dir against the same phases.
+    The phases are resolved once; returns the written paths.
+    """
+    out_dir = out_dir or scan_dir
+    os.makedirs(out_dir, exist_ok=True)
+    cif_entries = [phase_entry(_file_data_url(path), os.path.basename(path)) for path in cif_paths]
+    written = []
+    for name in sorted(os.listdir(scan_dir)):
+        stem, ext = os.path.splitext(name)
+        if ext.lower() not in XY_EXTENSIONS:
+            continue
+        out_path = os.path.join(out_dir, f"{stem}_pawley.inp")
+        with open(out_path, "w", encoding="utf-8") as f:
+            f.write(build_pawley_content(name, cif_entries))
+        written.append(out_path)
+    return written
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Generate Pawley .inp files for every scan in a directory.")
+    parser.add_argument("scan_dir", help="Directory of .xy/.xye/.csv/.dat scans.")
+    parser.add_argument("cifs", nargs="+", help="CIF files of the phase set.")
+    parser.add_argument("--out", help="Output directory (default: the scan directory).")
+    args = parser.parse_args(argv)
+
+    written = generate_pawley_batch(args.scan_dir, args.cifs, args.out)
+    print(f"Wrote {len(written)} .inp files")
+    return 0 if written else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,50 +1,87 @@
 import math
+from functools import lru_cache
+import numpy as np
 import plotly.graph_objects as go
 import plotly.io as pio
+from config import RENDER_MODE, JSON_ENGINE
 
-def plot_xrd(patterns, titles, wavelength, experimental_data=None, opacity=0.9, exp_filename=None, intensity_values=None):
+def set_json_engine(engine=JSON_ENGINE):
     """
-    Generate a Plotly figure of XRD patterns.
+    Select the JSON encoder Plotly and Dash use for figures. orjson writes NumPy arrays
+    directly instead of going through Python floats; without it, the standard library is used.
     """
-    
-    def extract_xy(pattern):
-        try:
-            return pattern.x, pattern.y
-        except AttributeError:
-            x_vals = [row[0] for row in pattern]
-            y_vals = [row[1] for row in pattern]
-            return x_vals, y_vals
+    try:
+        pio.json.config.default_engine = engine
+    except ValueError as e:
+        print("JSON engine", engine, "unavailable, using json:", e)
+        pio.json.config.default_engine = "json"
 
-    fig = go.Figure()
+set_json_engine()
 
-    # Determine the x-axis range.
-    if experimental_data is not None:
-        x_min = experimental_data['2_theta'].min()
-        x_max = experimental_data['2_theta'].max()
-        fig.add_trace(go.Scatter(
-            x=experimental_data['2_theta'], 
-            y=experimental_data['intensity'],
-            mode='lines', 
-            name=exp_filename if exp_filename else 'Experimental data',
-            line=dict(color='black', width=1),
-            showlegend=False
-        ))
-    else:
-        x_min = min(min(extract_xy(pattern)[0]) for pattern in patterns)
-        x_max = max(max(extract_xy(pattern)[0]) for pattern in patterns)
+def trace_array(values):
+    """
+    Trace coordinates as a NumPy array for the figure JSON. With orjson they are float32, which
+    it writes with the shortest exact float32 digits (about half the characters of float64,
+    well below screen resolution); the standard encoder would widen float32 again, so there
+    they stay float64.
+    """
+    dtype = np.float32 if pio.json.config.default_engine == "orjson" else float
+    return np.asarray(values, dtype=dtype)
 
-    for pattern, title in zip(patterns, titles):
-        x_vals, y_vals = extract_xy(pattern)
-        valid_indices = [i for i, x_val in enumerate(x_vals) if x_min <= x_val <= x_max]
-        fig.add_trace(go.Bar(
-            x=[x_vals[i] for i in valid_indices],
-            y=[y_vals[i] for i in valid_indices],
-            name=title,
-            width=0.15,
-            opacity=opacity,
-            showlegend=False
-        ))
+# The plot is at most ~1800 px wide, so 1800 min/max bins keep every visible peak.
+EXP_TRACE_BINS = 1800
+
+def minmax_decimate(x, y, n_bins=EXP_TRACE_BINS):
+    """
+    Reduce a trace to the minimum and maximum point of each of n_bins equal-count bins.
+    Points stay in x order, so peak heights and shapes are preserved at screen resolution.
+    """
+    x = np.asarray(x)
+    y = np.asarray(y)
+    n = len(y)
+    if n <= 2 * n_bins:
+        return x, y
+    size = -(-n // n_bins)
+    n_full = (n // size) * size
+    blocks = y[:n_full].reshape(-1, size)
+    offsets = np.arange(0, n_full, size)
+    keep = [offsets + blocks.argmin(axis=1), offsets + blocks.argmax(axis=1), [0, n - 1]]
+    if n_full < n:
+        tail = y[n_full:]
+        keep.append([n_full + tail.argmin(), n_full + tail.argmax()])
+    idx = np.unique(np.concatenate(keep))
+    return x[idx], y[idx]
+
+def stick_xy(x, y, base=0.0):
+    """
+    Turn peak positions and heights into one NaN-separated line trace of vertical sticks.
+    """
+    x = np.asarray(x, dtype=float)
+    stick_x = np.repeat(x, 3)
+    stick_x[2::3] = np.nan
+    stick_y = np.empty(3 * len(x))
+    stick_y[0::3] = base
+    stick_y[1::3] = y
+    stick_y[2::3] = np.nan
+    return stick_x, stick_y
+
+def highlight_shape(two_theta=None, width=0.3):
+    """
+    Band marking one reflection, hidden without a position. plot_xrd reserves
+    layout.shapes[0] for it, so a selection only patches that shape.
+    """
+    center = 0.0 if two_theta is None else float(two_theta)
+    return dict(
+        type="rect", xref="x", yref="paper",
+        x0=center - width / 2, x1=center + width / 2, y0=0, y1=1,
+        fillcolor="rgba(255, 165, 0, 0.35)", line=dict(width=0), layer="below",
+        visible=two_theta is not None
+    )
 
+def _svg_layout(x_min, x_max):
+    """
+    Layout for the classic SVG figure: labels every 10°, custom tick marks drawn as shapes.
+    """
     x_lower = int(math.floor(x_min))
     x_upper = int(math.ceil(x_max))
     big_ticks = [x for x in range(x_lower, x_upper + 1) if x % 10 == 0]
@@ -74,7 +111,7 @@ def plot_xrd(patterns, titles, wavelength, experimental_data=None, opacity=0.9,
         )
 
     # Explicitly set the font to "Microsoft Sans Serif" and apply it throughout
-    fig.update_layout(
+    return dict(
         title=dict(
             text=f"",
             font=dict(family="Microsoft Sans Serif", size=30, color="black")
@@ -96,12 +133,128 @@ def plot_xrd(patterns, titles, wavelength, experimental_data=None, opacity=0.9,
             showgrid=False,
             tickfont=dict(family="Microsoft Sans Serif", size=24)
         ),
-        shapes=tick_shapes,
+        shapes=[highlight_shape()] + tick_shapes,
         template="plotly_white",
         barmode='overlay',
         plot_bgcolor='white',
         legend=dict(borderwidth=0)
     )
+
+@lru_cache(maxsize=None)
+def _webgl_layout():
+    """
+    WebGL layout, built on first use and reused. Tick marks are native axis ticks (major every
+    10°, minor every 1°) instead of ~110 layout shapes, which are slow for Plotly.js to relayout.
+    """
+    return go.Layout(
+        title=dict(
+            text="",
+            font=dict(family="Microsoft Sans Serif", size=30, color="black")
+        ),
+        font=dict(family="Microsoft Sans Serif", size=24, color="black"),
+        xaxis=dict(
+            title=dict(text="diffraction angle, 2<i>θ</i>", font=dict(family="Microsoft Sans Serif", size=24)),
+            tickmode='linear',
+            tick0=0,
+            dtick=10,
+            ticks="inside",
+            ticklen=14,
+            tickwidth=2,
+            tickcolor='black',
+            minor=dict(dtick=1, ticks="inside", ticklen=7, tickwidth=1, tickcolor='grey', showgrid=False),
+            showgrid=False,
+            zeroline=False
+        ),
+        yaxis=dict(
+            title=dict(text="intensity, a.u.", font=dict(family="Microsoft Sans Serif", size=24)),
+            range=[0, 105],
+            showgrid=False,
+            tickfont=dict(family="Microsoft Sans Serif", size=24)
+        ),
+        shapes=[highlight_shape()],
+        template="plotly_white",
+        plot_bgcolor='white',
+        legend=dict(borderwidth=0)
+    )
+
+def _extract_xy(pattern):
+    try:
+        return np.asarray(pattern.x, dtype=float), np.asarray(pattern.y, dtype=float)
+    except AttributeError:
+        arr = np.asarray(pattern, dtype=float)
+        return arr[:, 0], arr[:, 1]
+
+def phase_trace_xy(pattern, x_min, x_max, render_mode=RENDER_MODE):
+    """
+    Coordinates of a pattern's trace in a plot_xrd figure spanning x_min to x_max: its peaks,
+    as NaN-separated sticks in webgl mode. A missing pattern gives an empty trace.
+    """
+    if pattern is None:
+        return trace_array([]), trace_array([])
+    x_vals, y_vals = _extract_xy(pattern)
+    mask = (x_vals >= x_min) & (x_vals <= x_max)
+    if render_mode == "webgl":
+        return tuple(trace_array(v) for v in stick_xy(x_vals[mask], y_vals[mask]))
+    return trace_array(x_vals[mask]), trace_array(y_vals[mask])
+
+def plot_xrd(patterns, titles, wavelength, experimental_data=None, opacity=0.9, exp_filename=None, intensity_values=None,
+             exp_bins=EXP_TRACE_BINS, render_mode=RENDER_MODE, two_theta_range=(0, 90)):
+    """
+    Generate a Plotly figure of XRD patterns.
+    The experimental trace is min/max-decimated to exp_bins bins. render_mode "webgl" draws
+    with Scattergl and one stick trace per pattern instead of Scatter and Bar traces.
+    A None pattern keeps its place as an empty trace, to be filled in later; until then the
+    axis spans two_theta_range, unless the experimental data sets it.
+    """
+    webgl = render_mode == "webgl"
+    fig = go.Figure(layout=_webgl_layout()) if webgl else go.Figure()
+    scatter = go.Scattergl if webgl else go.Scatter
+
+    # Determine the x-axis range.
+    if experimental_data is not None:
+        x_min = experimental_data['2_theta'].min()
+        x_max = experimental_data['2_theta'].max()
+        exp_x, exp_y = minmax_decimate(experimental_data['2_theta'].to_numpy(), experimental_data['intensity'].to_numpy(), exp_bins)
+        fig.add_trace(scatter(
+            x=trace_array(exp_x),
+            y=trace_array(exp_y),
+            mode='lines', 
+            name=exp_filename if exp_filename else 'Experimental data',
+            line=dict(color='black', width=1),
+            showlegend=False
+        ))
+    elif not patterns or any(pattern is None for pattern in patterns):
+        x_min, x_max = min(two_theta_range), max(two_theta_range)
+    else:
+        x_min = min(_extract_xy(pattern)[0].min() for pattern in patterns)
+        x_max = max(_extract_xy(pattern)[0].max() for pattern in patterns)
+
+    for pattern, title in zip(patterns, titles):
+        x_vals, y_vals = phase_trace_xy(pattern, x_min, x_max, render_mode)
+        if webgl:
+            fig.add_trace(go.Scattergl(
+                x=x_vals,
+                y=y_vals,
+                mode='lines',
+                name=title,
+                line=dict(width=2),
+                opacity=opacity,
+                showlegend=False
+            ))
+        else:
+            fig.add_trace(go.Bar(
+                x=x_vals,
+                y=y_vals,
+                name=title,
+                width=0.15,
+                opacity=opacity,
+                showlegend=False
+            ))
+
+    if webgl:
+        fig.update_xaxes(range=[x_min, x_max])
+    else:
+        fig.update_layout(_svg_layout(x_min, x_max))
     
     # Add phase composition annotation if intensity values are provided
     if intensity_values and len(intensity_values) > 0 and len(titles) > 0:
@@ -151,4 +304,44 @@ def plot_xrd(patterns, titles, wavelength, experimental_data=None, opacity=0.9,
                 align="left"
             )
     
-    return fig
\ No newline at end of file
+    return fig
+
+def plot_series(two_theta, frames, z, filenames, view="heatmap", selected=None):
+    """
+    Generate a heatmap or waterfall figure of a downsampled series tile.
+    """
+    fig = go.Figure()
+    font = dict(family="Microsoft Sans Serif", size=18, color="black")
+    if view == "waterfall":
+        offset = 100 / max(1, min(len(frames), 10))
+        for k, frame in enumerate(frames):
+            fig.add_trace(go.Scattergl(
+                x=two_theta,
+                y=z[k] + k * offset,
+                mode='lines',
+                name=filenames[frame],
+                line=dict(color='red' if frame == selected else 'black', width=2 if frame == selected else 1),
+                showlegend=False
+            ))
+        yaxis = dict(title=dict(text="intensity + offset", font=font), showticklabels=False, showgrid=False)
+    else:
+        fig.add_trace(go.Heatmap(
+            x=two_theta,
+            y=frames,
+            z=z,
+            colorscale="Viridis",
+            colorbar=dict(title="intensity"),
+            hovertemplate="2θ %{x:.3f}<br>frame %{y}<br>intensity %{z:.1f}<extra></extra>"
+        ))
+        if selected is not None:
+            fig.add_hline(y=selected, line=dict(color="red", width=1))
+        yaxis = dict(title=dict(text="frame", font=font), showgrid=False)
+    fig.update_layout(
+        font=font,
+        xaxis=dict(title=dict(text="diffraction angle, 2<i>θ</i>", font=font), showgrid=False, zeroline=False),
+        yaxis=yaxis,
+        template="plotly_white",
+        plot_bgcolor='white',
+        margin=dict(t=30)
+    )
+    return fig
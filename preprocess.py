@@ -1,14 +1,17 @@
 import os
 import json
 import base64
+import codecs
+import re
 import numpy as np
-import pandas as pd
+from functools import lru_cache
 from math import sin, radians, asin, degrees, pi, cos
 from io import StringIO
-from pymatgen.core import Structure, Lattice
-from pymatgen.io.cif import CifParser
-from pymatgen.analysis.diffraction.core import AbstractDiffractionPatternCalculator, DiffractionPattern, get_unique_families
-from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+from cache import shared_cache, content_hash
+from config import LATTICE_SCAN, ENGINE_MEMORY_MB, ENGINE_PRECISION
+
+# pandas and pymatgen are imported inside the functions that need them, so importing this
+# module (and with it the callbacks) stays fast. Call preload() to import them eagerly.
 
 # XRD wavelengths in angstroms.
 WAVELENGTHS = {
@@ -17,17 +20,178 @@ WAVELENGTHS = {
 }
 selected_wavelength = "CuKa"
 
-# Load atomic scattering parameters from JSON.
-atomic_scattering_params_path = "atomic_scattering_params.json"
-if not os.path.exists(atomic_scattering_params_path):
-    raise FileNotFoundError("Required file 'atomic_scattering_params.json' not found.")
-with open(atomic_scattering_params_path) as file:
-    ATOMIC_SCATTERING_PARAMS = json.load(file)
+# Widest 2θ window the UI can ask for (the limits of xrange-slider).
+FULL_TWO_THETA_RANGE = (0, 120)
+# Isotropic cell changes offered by the "Shift unit cell" slider, in percent.
+LATTICE_SCAN_PERCENT = np.round(np.linspace(-5, 5, 101), 1)
+
+atomic_scattering_params_path = os.path.join(os.path.dirname(os.path.abspath(__file__)), "atomic_scattering_params.json")
+
+@lru_cache(maxsize=None)
+def atomic_scattering_params():
+    """
+    Load the atomic scattering parameters from JSON on first use.
+    """
+    if not os.path.exists(atomic_scattering_params_path):
+        raise FileNotFoundError("Required file 'atomic_scattering_params.json' not found.")
+    with open(atomic_scattering_params_path) as file:
+        return json.load(file)
+
+def preload():
+    """
+    Import the heavy dependencies and load the lookup tables now rather than on first use.
+    """
+    import pandas  # noqa: F401
+    import pymatgen.core  # noqa: F401
+    import pymatgen.io.cif  # noqa: F401
+    import pymatgen.symmetry.analyzer  # noqa: F401
+    import pymatgen.analysis.diffraction.core  # noqa: F401
+    atomic_scattering_params()
+
+def lattice_matrix(a, b, c, alpha, beta, gamma):
+    """
+    Row-vector lattice matrix for cell parameters, in pymatgen's Lattice.from_parameters setting.
+    """
+    alpha_r, beta_r, gamma_r = np.radians([alpha, beta, gamma])
+    val = (np.cos(alpha_r) * np.cos(beta_r) - np.cos(gamma_r)) / (np.sin(alpha_r) * np.sin(beta_r))
+    gamma_star = np.arccos(np.clip(val, -1, 1))
+    return np.array([
+        [a * np.sin(beta_r), 0.0, a * np.cos(beta_r)],
+        [-b * np.sin(alpha_r) * np.cos(gamma_star), b * np.sin(alpha_r) * np.sin(gamma_star), b * np.cos(alpha_r)],
+        [0.0, 0.0, float(c)],
+    ])
+
+class CompactStructure:
+    """
+    Immutable, array-backed structure for the pattern engine.
+
+    Species are grouped by site: distinct fractional coordinates (sites, 3) and an occupancy
+    matrix (sites, elements), whose columns index the element symbols, atomic numbers,
+    scattering coefficients and Debye-Waller factors. Built once from a parsed Structure;
+    with_lattice() returns a copy on another cell that shares every site array.
+    """
+    __slots__ = ("lattice", "parameters", "frac_coords", "elements", "zs", "coeffs", "occupancy", "debye_waller")
+
+    def __init__(self, lattice, parameters, frac_coords, elements, zs, coeffs, occupancy, debye_waller):
+        for name, value in zip(self.__slots__, (lattice, parameters, frac_coords, elements, zs, coeffs, occupancy, debye_waller)):
+            if isinstance(value, np.ndarray):
+                value.flags.writeable = False
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("CompactStructure is immutable")
+
+    def __reduce__(self):
+        return (CompactStructure, tuple(getattr(self, name) for name in self.__slots__))
 
-class XRDCalculator(AbstractDiffractionPatternCalculator):
+    @classmethod
+    def from_structure(cls, structure, debye_waller_factors=None):
+        """
+        Build from a pymatgen Structure. Sites sharing coordinates are merged.
+        """
+        scattering_params = atomic_scattering_params()
+        elements = sorted({sp.symbol for site in structure for sp in site.species})
+        column = {el: i for i, el in enumerate(elements)}
+        missing = [el for el in elements if el not in scattering_params]
+        if missing:
+            raise ValueError(f"No scattering coefficients for {missing[0]}")
+
+        coords = np.round(structure.frac_coords, 6) % 1.0
+        _, first, site_index = np.unique(coords, axis=0, return_index=True, return_inverse=True)
+        occupancy = np.zeros((len(first), len(elements)))
+        zs = {}
+        for row, site in zip(site_index.ravel(), structure):
+            for sp, occu in site.species.items():
+                occupancy[row, column[sp.symbol]] += occu
+                zs[sp.symbol] = sp.Z
+
+        debye_waller_factors = debye_waller_factors or {}
+        lattice = structure.lattice
+        return cls(
+            np.array(lattice.matrix, dtype=float),
+            tuple(float(v) for v in lattice.parameters),
+            structure.frac_coords[first],
+            tuple(elements),
+            np.array([zs[el] for el in elements], dtype=float),
+            np.array([scattering_params[el] for el in elements], dtype=float),
+            occupancy,
+            np.array([debye_waller_factors.get(el, 0) for el in elements], dtype=float),
+        )
+
+    def with_lattice(self, a, b, c, alpha, beta, gamma):
+        """
+        The same sites on new lattice parameters.
+        """
+        parameters = tuple(float(v) for v in (a, b, c, alpha, beta, gamma))
+        if not (min(parameters[:3]) > 0 and all(0 < angle < 180 for angle in parameters[3:])):
+            raise ValueError(f"Invalid lattice parameters {parameters}")
+        matrix = lattice_matrix(*parameters)
+        if not np.isfinite(matrix).all() or np.linalg.det(matrix) < 1e-8:
+            raise ValueError(f"Invalid lattice parameters {parameters}")
+        return CompactStructure(matrix, parameters, *(getattr(self, name) for name in self.__slots__[2:]))
+
+    def aligned_with(self, other, tol=0.05):
+        """
+        Restate two end members of a solid solution over the same sites and elements, for
+        interpolating between them. Every site must have a partner in the other structure
+        within `tol` in fractional coordinates; both are put on the mean position. Returns
+        (self, other) re-expressed, each on its own lattice.
+        """
+        if len(self.frac_coords) != len(other.frac_coords):
+            raise ValueError(f"End members have {len(self.frac_coords)} and {len(other.frac_coords)} sites")
+        offsets = other.frac_coords[None, :, :] - self.frac_coords[:, None, :]
+        offsets -= np.rint(offsets)
+        distance = np.linalg.norm(offsets, axis=2)
+        partner = distance.argmin(axis=1)
+        if len(set(partner)) != len(partner) or distance[np.arange(len(partner)), partner].max() > tol:
+            raise ValueError("End members do not share their sites; use two settings of the same structure type")
+        frac_coords = self.frac_coords + offsets[np.arange(len(partner)), partner] / 2
+
+        elements = tuple(sorted(set(self.elements) | set(other.elements)))
+        source = {el: (s, i) for s in (other, self) for i, el in enumerate(s.elements)}
+        zs = np.array([source[el][0].zs[source[el][1]] for el in elements])
+        coeffs = np.array([source[el][0].coeffs[source[el][1]] for el in elements])
+        debye_waller = np.array([source[el][0].debye_waller[source[el][1]] for el in elements])
+
+        def restate(structure, rows):
+            occupancy = np.zeros((len(rows), len(elements)))
+            for i, el in enumerate(structure.elements):
+                occupancy[:, elements.index(el)] = structure.occupancy[rows, i]
+            return CompactStructure(structure.lattice, structure.parameters, frac_coords, elements, zs, coeffs,
+                                    occupancy, debye_waller)
+
+        return restate(self, np.arange(len(partner))), restate(other, partner)
+
+    @property
+    def abc(self):
+        return self.parameters[:3]
+
+    @property
+    def reciprocal_metric(self):
+        """
+        Metric tensor of the crystallographic reciprocal lattice (no 2π).
+        """
+        return np.linalg.inv(self.lattice @ self.lattice.T)
+
+    def is_hexagonal(self, hex_angle_tol=5, hex_length_tol=0.01):
+        # Same test as pymatgen's Lattice.is_hexagonal.
+        lengths, angles = self.parameters[:3], self.parameters[3:]
+        right_angles = [i for i in range(3) if abs(angles[i] - 90) < hex_angle_tol]
+        hex_angles = [i for i in range(3) if abs(angles[i] - 60) < hex_angle_tol or abs(angles[i] - 120) < hex_angle_tol]
+        return (len(right_angles) == 2 and len(hex_angles) == 1
+                and abs(lengths[right_angles[0]] - lengths[right_angles[1]]) < hex_length_tol)
+
+class XRDCalculator:
     AVAILABLE_RADIATION = tuple(WAVELENGTHS)
+    # Same tolerances as pymatgen's AbstractDiffractionPatternCalculator.
+    TWO_THETA_TOL = 1e-5
+    SCALED_INTENSITY_TOL = 1e-3
+    # Largest reciprocal-lattice shell enumerated, estimated from its volume before the walk;
+    # a 50 Å cubic cell over 0-120° 2θ with Cu Kα has about 750,000 reflections.
+    MAX_REFLECTIONS = 2_000_000
 
-    def __init__(self, wavelength="CuKa", symprec: float = 0, debye_waller_factors=None):
+    def __init__(self, wavelength="CuKa", symprec: float = 0, debye_waller_factors=None,
+                 memory_mb=ENGINE_MEMORY_MB, precision=ENGINE_PRECISION):
         if isinstance(wavelength, (float, int)):
             self.wavelength = wavelength
         elif isinstance(wavelength, str):
@@ -37,93 +201,264 @@ class XRDCalculator(AbstractDiffractionPatternCalculator):
             raise TypeError(f"{type(wavelength)=} must be either float, int or str")
         self.symprec = symprec
         self.debye_waller_factors = debye_waller_factors or {}
+        # Budget for the (reflections, sites) temporaries of the structure-factor sums, and the
+        # precision of the trigonometric part ("float64" or "float32").
+        self.memory_mb = memory_mb
+        self.dtype = np.dtype(precision)
 
-    def get_pattern(self, structure: Structure, scaled=True, two_theta_range=(0, 90)):
+    def _reflections(self, structure, two_theta_range, scales=(1.0,)):
+        """
+        Reciprocal lattice points in the 2θ range, sorted by |g| then by -h, -k, -l.
+        With `scales`, covers the range for the lattice scaled by any of them.
+        Returns (hkls, g_hkl) as arrays.
+        """
+        min_r, max_r = (
+            (0, 2 / self.wavelength)
+            if two_theta_range is None
+            else [2 * sin(radians(t / 2)) / self.wavelength for t in two_theta_range]
+        )
+        max_r *= max(scales)
+        min_r *= min(scales)
+        metric = structure.reciprocal_metric
+        # Lattice points in the shell: its volume over the reciprocal cell volume, sqrt(det G*).
+        estimate = 4 / 3 * pi * (max_r ** 3 - min_r ** 3) / np.sqrt(np.linalg.det(metric))
+        if estimate > self.MAX_REFLECTIONS:
+            raise ValueError(f"About {estimate:.3g} reflections in the 2θ range, more than {self.MAX_REFLECTIONS}; "
+                             "use a narrower range or a longer wavelength")
+
+        # |h| <= |g| a for g = h a* + k b* + l c*, which bounds the index box. It is walked one
+        # h plane at a time so only the reflections inside the shell are ever kept.
+        h_max, k_max, l_max = np.floor(max_r * np.array(structure.abc) + 1e-9).astype(int)
+        k, l = np.meshgrid(np.arange(-k_max, k_max + 1), np.arange(-l_max, l_max + 1), indexing="ij")
+        plane = np.column_stack([np.zeros(k.size, dtype=int), k.ravel(), l.ravel()])
+        hkls, g_hkl = [], []
+        for h in range(-h_max, h_max + 1):
+            plane[:, 0] = h
+            g2 = np.einsum("ij,ij->i", plane @ metric, plane)
+            inside = (g2 > 0) & (g2 <= max_r ** 2) & (g2 >= min_r ** 2)
+            hkls.append(plane[inside])
+            g_hkl.append(np.sqrt(g2[inside]))
+        hkls = np.concatenate(hkls)
+        g_hkl = np.concatenate(g_hkl)
+        if not len(g_hkl):
+            raise ValueError("No reflections in the 2θ range")
+        order = np.lexsort((-hkls[:, 2], -hkls[:, 1], -hkls[:, 0], g_hkl))
+        return hkls[order], g_hkl[order]
+
+    def _phase_sums(self, structure, hkls, occupancy=None):
+        """
+        Occupancy-weighted sum of exp(2πi h·x) over the sites, per reflection and element,
+        shape (reflections, elements). Reflections are taken in blocks so that the
+        (block, sites) temporaries stay within the memory budget. `occupancy` replaces the
+        structure's (sites, columns) matrix, e.g. to weight several compositions at once.
+        """
+        frac_coords = structure.frac_coords
+        occupancy = (structure.occupancy if occupancy is None else occupancy).astype(self.dtype)
+        rows = int(self.memory_mb * 2 ** 20 // (len(frac_coords) * (8 + 3 * self.dtype.itemsize)))
+        rows = max(1, rows)
+        sums = np.empty((len(hkls), occupancy.shape[1]), dtype=np.result_type(self.dtype, np.complex64))
+        for start in range(0, len(hkls), rows):
+            arg = hkls[start:start + rows] @ frac_coords.T
+            # Only the fractional part matters; dropping the integer part keeps float32 accurate.
+            arg -= np.rint(arg)
+            arg = (2 * pi * arg).astype(self.dtype, copy=False)
+            sums.real[start:start + rows] = np.cos(arg) @ occupancy
+            sums.imag[start:start + rows] = np.sin(arg) @ occupancy
+        return sums
+
+    def _form_factors(self, structure, s2):
+        """
+        Atomic form factors (reflections, elements) at s² = (g/2)², Debye-Waller corrected.
+        The calculator's Debye-Waller factors take precedence over the structure's.
+        """
+        coeffs = structure.coeffs
+        fs = structure.zs - 41.78214 * s2[:, None] * np.sum(
+            coeffs[None, :, :, 0] * np.exp(-coeffs[None, :, :, 1] * s2[:, None, None]),
+            axis=2
+        )
+        dw_factors = np.array([self.debye_waller_factors.get(el, dw)
+                               for el, dw in zip(structure.elements, structure.debye_waller)])
+        return fs * np.exp(-dw_factors * s2[:, None])
+
+    def _peak_starts(self, two_theta):
+        # Reflections are sorted by |g|, so coincident peaks are neighbours.
+        return np.flatnonzero(np.r_[True, np.diff(two_theta) >= self.TWO_THETA_TOL])
+
+    @staticmethod
+    def _peak_families(hkls, starts, is_hex):
+        from pymatgen.analysis.diffraction.core import get_unique_families
+
+        if is_hex:
+            hkls = np.column_stack([hkls[:, 0], hkls[:, 1], -hkls[:, 0] - hkls[:, 1], hkls[:, 2]])
+        return [
+            [{"hkl": hkl, "multiplicity": mult}
+             for hkl, mult in get_unique_families([tuple(int(v) for v in hkl) for hkl in group]).items()]
+            for group in np.split(hkls, starts[1:])
+        ]
+
+    def _compact(self, structure):
+        if isinstance(structure, CompactStructure):
+            return structure
         if self.symprec:
+            from pymatgen.symmetry.analyzer import SpacegroupAnalyzer
+
             finder = SpacegroupAnalyzer(structure, symprec=self.symprec)
             structure = finder.get_refined_structure()
+        return CompactStructure.from_structure(structure)
 
-        wavelength = self.wavelength
-        lattice = structure.lattice
-        is_hex = lattice.is_hexagonal()
+    def get_pattern(self, structure, scaled=True, two_theta_range=(0, 90)):
+        """
+        Calculate the diffraction pattern of a structure, given as a CompactStructure or a
+        pymatgen Structure (converted first).
+        """
+        from pymatgen.analysis.diffraction.core import DiffractionPattern
 
-        min_r, max_r = (
-            (0, 2 / wavelength)
-            if two_theta_range is None
-            else [2 * sin(radians(t / 2)) / wavelength for t in two_theta_range]
-        )
+        structure = self._compact(structure)
+        hkls, g_hkl = self._reflections(structure, two_theta_range)
 
-        recip_lattice = lattice.reciprocal_lattice_crystallographic
-        recip_pts = recip_lattice.get_points_in_sphere([[0, 0, 0]], [0, 0, 0], max_r)
-        if min_r:
-            recip_pts = [pt for pt in recip_pts if pt[1] >= min_r]
+        # All reflections at once: form factors per element times the occupancy-weighted phase
+        # sums of that element's sites, so the phase term is evaluated once per coordinate.
+        theta = np.arcsin(self.wavelength * g_hkl / 2)
+        fs = self._form_factors(structure, (g_hkl / 2) ** 2)
+        f_hkl = np.sum(fs * self._phase_sums(structure, hkls), axis=1)
+        i_hkl = (f_hkl * f_hkl.conjugate()).real
+        lorentz_factor = (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+        two_theta = np.degrees(2 * theta)
 
-        _zs, _coeffs, _frac_coords, _occus, _dw_factors = [], [], [], [], []
-        for site in structure:
-            for sp, occu in site.species.items():
-                _zs.append(sp.Z)
-                try:
-                    c = ATOMIC_SCATTERING_PARAMS[sp.symbol]
-                except KeyError:
-                    raise ValueError(f"No scattering coefficients for {sp.symbol}")
-                _coeffs.append(c)
-                _dw_factors.append(self.debye_waller_factors.get(sp.symbol, 0))
-                _frac_coords.append(site.frac_coords)
-                _occus.append(occu)
-        zs = np.array(_zs)
-        coeffs = np.array(_coeffs)
-        frac_coords = np.array(_frac_coords)
-        occus = np.array(_occus)
-        dw_factors = np.array(_dw_factors)
-        peaks = {}
-        two_thetas = []
-
-        for hkl, g_hkl, ind, _ in sorted(recip_pts, key=lambda i: (i[1], -i[0][0], -i[0][1], -i[0][2])):
-            hkl = [int(round(i)) for i in hkl]
-            if g_hkl != 0:
-                theta = asin(wavelength * g_hkl / 2)
-                s = g_hkl / 2
-                s2 = s**2
-                g_dot_r = np.dot(frac_coords, np.transpose([hkl])).T[0]
-                fs = zs - 41.78214 * s2 * np.sum(
-                    coeffs[:, :, 0] * np.exp(-coeffs[:, :, 1] * s2),
-                    axis=1
-                )
-                dw_correction = np.exp(-dw_factors * s2)
-                f_hkl = np.sum(fs * occus * np.exp(2j * pi * g_dot_r) * dw_correction)
-                lorentz_factor = (1 + cos(2 * theta) ** 2) / (sin(theta) ** 2 * cos(theta))
-                i_hkl = (f_hkl * f_hkl.conjugate()).real
-                two_theta = degrees(2 * theta)
-                if is_hex:
-                    hkl = (hkl[0], hkl[1], -hkl[0] - hkl[1], hkl[2])
-                ind = np.where(
-                    np.abs(np.subtract(two_thetas, two_theta)) < AbstractDiffractionPatternCalculator.TWO_THETA_TOL
-                )
-                if len(ind[0]) > 0:
-                    peaks[two_thetas[ind[0][0]]][0] += i_hkl * lorentz_factor
-                    peaks[two_thetas[ind[0][0]]][1].append(tuple(hkl))
-                else:
-                    d_hkl = 1 / g_hkl
-                    peaks[two_theta] = [i_hkl * lorentz_factor, [tuple(hkl)], d_hkl]
-                    two_thetas.append(two_theta)
-        max_intensity = max(v[0] for v in peaks.values())
-        x = []
-        y = []
-        hkls = []
-        d_hkls = []
-        for k in sorted(peaks):
-            v = peaks[k]
-            fam = get_unique_families(v[1])
-            if v[0] / max_intensity * 100 > AbstractDiffractionPatternCalculator.SCALED_INTENSITY_TOL:
-                x.append(k)
-                y.append(v[0])
-                hkls.append([{"hkl": hkl, "multiplicity": mult} for hkl, mult in fam.items()])
-                d_hkls.append(v[2])
-        xrd = DiffractionPattern(x, y, hkls, d_hkls)
+        starts = self._peak_starts(two_theta)
+        intensities = np.add.reduceat(i_hkl * lorentz_factor, starts)
+        keep = intensities / intensities.max() * 100 > self.SCALED_INTENSITY_TOL
+        families = self._peak_families(hkls, starts, structure.is_hexagonal())
+        xrd = DiffractionPattern(
+            two_theta[starts][keep],
+            intensities[keep],
+            [fam for fam, k in zip(families, keep) if k],
+            (1 / g_hkl[starts][keep]).tolist()
+        )
         if scaled:
             xrd.normalize(mode="max", value=100)
         return xrd
 
+    def get_lattice_scan(self, structure, percent=LATTICE_SCAN_PERCENT, two_theta_range=FULL_TWO_THETA_RANGE):
+        """
+        Unscaled peak intensities of a structure for every isotropic cell change in `percent`.
+
+        Scaling the cell by k keeps the fractional coordinates, so each reflection keeps its
+        phase term and only moves from |g| to |g|/k. The phases are evaluated once and each
+        scale only re-evaluates the form factors. Returns a dict with the base lattice, the
+        scales, per-peak |g| on the base cell, hkl families, and intensity of shape (scales, peaks).
+        """
+        structure = self._compact(structure)
+        scales = 1 + np.asarray(percent, dtype=float) / 100
+        hkls, g_hkl = self._reflections(structure, two_theta_range, scales)
+
+        # Lattice-independent: structure factor per element, summed over the sites holding it.
+        phase = self._phase_sums(structure, hkls)
+        # Coincidences are decided on the largest cell, where every collected reflection is in range.
+        starts = self._peak_starts(np.degrees(2 * np.arcsin(self.wavelength * g_hkl / (2 * scales.max()))))
+
+        intensity = np.empty((len(scales), len(starts)))
+        for row, scale in enumerate(scales):
+            g = g_hkl / scale
+            theta = np.arcsin(np.minimum(self.wavelength * g / 2, 1))
+            f_hkl = np.sum(self._form_factors(structure, (g / 2) ** 2) * phase, axis=1)
+            lorentz_factor = (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+            intensity[row] = np.add.reduceat((f_hkl * f_hkl.conjugate()).real * lorentz_factor, starts)
+
+        return {
+            "lattice": np.array(structure.parameters),
+            "percent": np.asarray(percent, dtype=float),
+            "scales": scales,
+            "wavelength": self.wavelength,
+            "two_theta_range": tuple(two_theta_range),
+            "g": g_hkl[starts],
+            "hkls": self._peak_families(hkls, starts, structure.is_hexagonal()),
+            "intensity": intensity,
+            # Every reflection and the peak it belongs to, for moving peaks to other cells.
+            "reflections": hkls,
+            "peak_starts": starts,
+            "is_hex": structure.is_hexagonal(),
+        }
+
+    def _solid_solution_peaks(self, hkls, g_hkl, f_hkl, is_hex):
+        # Peak arrays of one composition from its sorted reflections, without the weak peaks
+        # get_pattern leaves out either.
+        theta = np.arcsin(self.wavelength * g_hkl / 2)
+        lorentz_factor = (1 + np.cos(2 * theta) ** 2) / (np.sin(theta) ** 2 * np.cos(theta))
+        two_theta = np.degrees(2 * theta)
+        starts = self._peak_starts(two_theta)
+        intensity = np.add.reduceat((f_hkl * f_hkl.conjugate()).real * lorentz_factor, starts)
+        keep = intensity / intensity.max() * 100 > self.SCALED_INTENSITY_TOL
+        hkl = hkls[starts]
+        if is_hex:
+            hkl = np.column_stack([hkl[:, 0], hkl[:, 1], -hkl[:, 0] - hkl[:, 1], hkl[:, 2]])
+        return {
+            "two_theta": two_theta[starts][keep],
+            "intensity": intensity[keep],
+            "d_hkl": 1 / g_hkl[starts][keep],
+            "hkl": hkl[keep],
+            "multiplicity": np.diff(np.r_[starts, len(g_hkl)])[keep],
+        }
+
+    def get_solid_solution(self, start, end, fractions, two_theta_range=FULL_TWO_THETA_RANGE):
+        """
+        Unscaled peaks of a solid solution between two end members at each fraction of `end`
+        (0 is `start`, 1 is `end`). Lattice parameters follow Vegard's law and site occupancies
+        mix linearly, on the sites the two share (see CompactStructure.aligned_with). The
+        fractions 0 and 1 are the end members' own patterns, as get_pattern gives them.
+
+        The structure factor is linear in the occupancies, so the phase sums of both end
+        members over one shared reflection set are evaluated once, in a single pass over the
+        sites; each composition only moves the reflections to its cell and re-evaluates the
+        form factors. Returns a dict with the fractions, lattice parameters of shape
+        (compositions, 6) and per composition a dict of peak arrays: two_theta, intensity,
+        d_hkl, and the hkl (hkil for hexagonal cells) and number of reflections of every peak.
+        """
+        members = self._compact(start), self._compact(end)
+        start, end = members[0].aligned_with(members[1])
+        fractions = np.asarray(fractions, dtype=float)
+        parameters = np.outer(1 - fractions, start.parameters) + np.outer(fractions, end.parameters)
+        is_hex = start.is_hexagonal() and end.is_hexagonal()
+
+        # Reflections in range on any cell of the series. |g| of a reflection on the end cell
+        # is its |g| on the start cell times a factor between the square roots of the extreme
+        # eigenvalues of inv(G*start) G*end, so the cells in between stay within that margin
+        # around either end member.
+        ratios = np.sqrt(np.abs(np.linalg.eigvals(np.linalg.solve(start.reciprocal_metric, end.reciprocal_metric))))
+        margin = max(ratios.max(), 1 / ratios.min())
+        hkls = np.unique(np.concatenate([
+            self._reflections(member, two_theta_range, (1 / margin, margin))[0] for member in (start, end)
+        ]), axis=0)
+        n_elements = len(start.elements)
+        sums = self._phase_sums(start, hkls, np.hstack([start.occupancy, end.occupancy]))
+        start_sums, delta_sums = sums[:, :n_elements], sums[:, n_elements:] - sums[:, :n_elements]
+        min_r, max_r = [2 * sin(radians(t / 2)) / self.wavelength for t in two_theta_range]
+
+        peaks = []
+        for fraction, params in zip(fractions, parameters):
+            if fraction in (0, 1):
+                member = members[int(fraction)]
+                member_hkls, g_hkl = self._reflections(member, two_theta_range)
+                f_hkl = np.sum(self._form_factors(member, (g_hkl / 2) ** 2) * self._phase_sums(member, member_hkls), axis=1)
+                peaks.append(self._solid_solution_peaks(member_hkls, g_hkl, f_hkl, member.is_hexagonal()))
+                continue
+            matrix = lattice_matrix(*params)
+            g = np.sqrt(np.einsum("ij,ij->i", hkls @ np.linalg.inv(matrix @ matrix.T), hkls))
+            inside = np.flatnonzero((g >= min_r) & (g <= max_r))
+            order = inside[np.lexsort((-hkls[inside, 2], -hkls[inside, 1], -hkls[inside, 0], g[inside]))]
+            g_hkl = g[order]
+            f_hkl = np.sum(self._form_factors(start, (g_hkl / 2) ** 2)
+                           * (start_sums[order] + fraction * delta_sums[order]), axis=1)
+            peaks.append(self._solid_solution_peaks(hkls[order], g_hkl, f_hkl, is_hex))
+
+        return {
+            "fractions": fractions,
+            "lattices": parameters,
+            "wavelength": self.wavelength,
+            "two_theta_range": tuple(two_theta_range),
+            "peaks": peaks,
+        }
+
 # def normalize_structure(structure: Structure) -> Structure:
 #     """
 #     Normalize a structure by setting all site occupancies to 1.
@@ -136,25 +471,378 @@ class XRDCalculator(AbstractDiffractionPatternCalculator):
 #         coords.append(site.frac_coords)
 #     return Structure(structure.lattice, species, coords, coords_are_cartesian=False)
 
+# Experimental pattern formats accepted by the upload.
+XY_EXTENSIONS = (".xy", ".xye", ".csv", ".dat")
+
+_DELIMITERS = bytes.maketrans(b",;\t", b"   ")
+# Semicolon-separated files with commas on the same row use the comma as the decimal mark.
+_DECIMAL_COMMA = bytes.maketrans(b",;\t", b".  ")
+_DECIMAL_COMMA_ROW = re.compile(rb";[^\n]*,|,[^\n]*;")
+_NUMERIC_BYTES = b"0123456789+-.eE \r\n"
+
+def decode_upload(contents):
+    """
+    Decode a Dash upload data URL straight into bytes.
+    """
+    content_type, _, content_string = contents.partition(',')
+    return base64.b64decode(content_string)
+
+def _is_numeric_row(fields):
+    try:
+        for field in fields:
+            float(field)
+    except ValueError:
+        return False
+    return True
+
+def _fields_per_line(body):
+    """
+    Number of whitespace-separated fields on every non-blank line, counted on the raw bytes.
+    """
+    chars = np.frombuffer(body, dtype=np.uint8)
+    if not len(chars):
+        return np.zeros(0, dtype=int)
+    # Only spaces, CR and LF are at or below b" " once the delimiters are translated.
+    blank = chars <= ord(" ")
+    starts = np.flatnonzero(blank[:-1] > blank[1:]) + 1
+    if not blank[0]:
+        starts = np.r_[0, starts]
+    bounds = np.searchsorted(starts, np.flatnonzero(chars == ord("\n")))
+    per_line = np.diff(np.r_[0, bounds, len(starts)])
+    return per_line[per_line > 0]
+
+def read_numeric_columns(buf):
+    """
+    Parse whitespace-, comma- or semicolon-separated numeric columns from raw bytes.
+    Header lines before the data (including a point count on a line of its own) and
+    comment or malformed lines inside it are skipped. Rows of different lengths are cut to
+    the shortest. When a row holds both semicolons and commas, the semicolon separates the
+    columns and the comma is the decimal mark.
+    """
+    buf = buf.translate(_DECIMAL_COMMA if _DECIMAL_COMMA_ROW.search(buf) else _DELIMITERS)
+    if buf.startswith(codecs.BOM_UTF8):
+        buf = buf[len(codecs.BOM_UTF8):]
+
+    # Skip the header: the data starts at the first line of two or more numbers.
+    offset = 0
+    ncols = 0
+    while offset < len(buf):
+        end = buf.find(b"\n", offset)
+        end = len(buf) if end < 0 else end
+        fields = buf[offset:end].split()
+        if len(fields) >= 2 and _is_numeric_row(fields):
+            ncols = len(fields)
+            break
+        offset = end + 1
+    if ncols < 2:
+        raise ValueError("Expected at least two numeric columns")
+    body = buf[offset:] if offset else buf
+
+    # Fast path: one C-level pass over the whole buffer, taken only when every line holds
+    # ncols fields and all of them parsed.
+    values = None
+    if not body.translate(None, _NUMERIC_BYTES):
+        per_line = _fields_per_line(body)
+        if np.all(per_line == ncols):
+            try:
+                values = np.fromstring(body, sep=" ")
+            except ValueError:
+                values = None
+            if values is not None and values.size != len(per_line) * ncols:
+                values = None
+    if values is None:
+        rows = [fields for fields in map(bytes.split, body.splitlines())
+                if len(fields) >= 2 and _is_numeric_row(fields)]
+        ncols = min(len(fields) for fields in rows)
+        values = np.fromstring(b"\n".join(b" ".join(fields[:ncols]) for fields in rows), sep=" ")
+    return values.reshape(-1, ncols)
+
+def ascending_scan(data):
+    """
+    Rows of parsed scan columns sorted by 2θ (the first column), for scans recorded downwards.
+    """
+    if np.any(np.diff(data[:, 0]) < 0):
+        data = data[np.argsort(data[:, 0], kind="stable")]
+    return data
+
 def parse_xy(contents):
     """
-    Parse the contents of an uploaded .xy file.
+    Parse the contents of an uploaded .xy, .xye, .csv or .dat file.
+    Only the first two columns (2θ, intensity) are kept, sorted by 2θ.
     """
-    content_type, content_string = contents.split(',')
-    decoded = base64.b64decode(content_string)
-    s = StringIO(decoded.decode('utf-8'))
-    df = pd.read_csv(s, sep='\s+', header=None)
-    df.columns = ['2_theta', 'intensity']
-    return df
+    import pandas as pd
+
+    data = ascending_scan(read_numeric_columns(decode_upload(contents)))
+    return pd.DataFrame({'2_theta': data[:, 0], 'intensity': data[:, 1]})
 
 def parse_cif(contents):
     """
     Parse the contents of an uploaded .cif file and return a pymatgen Structure object.
     """
+    from pymatgen.io.cif import CifParser
+
     content_type, content_string = contents.split(',')
     decoded = base64.b64decode(content_string)
     s = StringIO(decoded.decode('utf-8'))
     parser = CifParser(s)
     # Use parse_structures instead of the deprecated get_structures
     structures = parser.parse_structures()  # You can pass primitive=True if needed
-    return structures[0]
\ No newline at end of file
+    return structures[0]
+
+def load_structure(contents):
+    """
+    Parse a CIF upload, sharing the resulting Structure across workers through the cache.
+    """
+    return shared_cache.get_or_compute("structure", content_hash(contents), lambda: parse_cif(contents))
+
+def load_compact_structure(contents):
+    """
+    CompactStructure of a CIF upload, shared across workers through the cache. Lattice
+    edits go through with_lattice(), so one entry serves every lattice of the structure.
+    """
+    return shared_cache.get_or_compute(
+        "compact", content_hash(contents), lambda: CompactStructure.from_structure(load_structure(contents))
+    )
+
+def scan_index(scan, lattice_params):
+    """
+    Row of a lattice scan matching lattice parameters as the shift slider writes them
+    (base a, b, c times the scale, rounded to 4 decimals; base angles), or None.
+    None lattice parameters select the unshifted cell.
+    """
+    if lattice_params is None:
+        rows = np.flatnonzero(scan["percent"] == 0)
+    else:
+        base = scan["lattice"]
+        if not np.allclose(lattice_params[3:], np.round(base[3:], 4), rtol=0, atol=1e-9):
+            return None
+        cells = np.round(np.outer(scan["scales"], base[:3]), 4)
+        rows = np.flatnonzero(np.all(np.abs(cells - lattice_params[:3]) < 1e-9, axis=1))
+    return int(rows[0]) if len(rows) else None
+
+def window_pattern(two_theta, intensity, hkls, d_hkls, two_theta_range, normalization="window"):
+    """
+    Cut unscaled peaks, sorted by 2θ, to the 2θ range and scale them to 100 relative to the
+    highest peak in the range ("window", as get_pattern does) or in all of them ("global").
+    Peaks below SCALED_INTENSITY_TOL of that maximum are dropped.
+    """
+    from pymatgen.analysis.diffraction.core import DiffractionPattern
+
+    two_theta = np.asarray(two_theta)
+    intensity = np.asarray(intensity)
+    lo = np.searchsorted(two_theta, min(two_theta_range), side="left")
+    hi = np.searchsorted(two_theta, max(two_theta_range), side="right")
+    if hi <= lo:
+        raise ValueError("No reflections in the 2θ range")
+    peak = intensity.max() if normalization == "global" else intensity[lo:hi].max()
+    scaled = intensity[lo:hi] / peak * 100
+    keep = np.flatnonzero(scaled > XRDCalculator.SCALED_INTENSITY_TOL)
+    return DiffractionPattern(
+        two_theta[lo:hi][keep],
+        scaled[keep],
+        [hkls[lo + i] for i in keep],
+        np.asarray(d_hkls)[lo:hi][keep].tolist()
+    )
+
+def scan_pattern(scan, index, two_theta_range=(0, 90), normalization="window"):
+    """
+    Pattern for one row of a lattice scan, cut to the 2θ range and scaled as in
+    window_pattern. None if the range is outside the scanned one.
+    """
+    lo, hi = two_theta_range
+    if lo < scan["two_theta_range"][0] or hi > scan["two_theta_range"][1]:
+        return None
+    g = scan["g"] / scan["scales"][index]
+    two_theta = np.degrees(2 * np.arcsin(np.minimum(scan["wavelength"] * g / 2, 1)))
+    return window_pattern(two_theta, scan["intensity"][index], scan["hkls"], 1 / g,
+                          two_theta_range, normalization)
+
+def load_lattice_scan(cif_contents, wavelength="CuKa"):
+    """
+    Lattice scan of a CIF upload over the shift slider's range, computed once and shared
+    across workers through the cache.
+    """
+    return shared_cache.get_or_compute(
+        "lattice_scan", content_hash(cif_contents, wavelength),
+        lambda: XRDCalculator(wavelength=wavelength).get_lattice_scan(load_compact_structure(cif_contents))
+    )
+
+def load_solid_solution(start_contents, end_contents, n_steps, wavelength="CuKa"):
+    """
+    Solid-solution series of n_steps compositions between two CIF uploads, computed once
+    and shared across workers through the cache.
+    """
+    return shared_cache.get_or_compute(
+        "solid_solution", content_hash(start_contents, end_contents, n_steps, wavelength),
+        lambda: XRDCalculator(wavelength=wavelength).get_solid_solution(
+            load_compact_structure(start_contents), load_compact_structure(end_contents), np.linspace(0, 1, n_steps))
+    )
+
+def solid_solution_pattern(series, index, two_theta_range=(0, 90), normalization="window"):
+    """
+    Pattern of one composition of a solid-solution series, cut to the 2θ range and scaled
+    as in window_pattern. Peaks are labelled with one hkl and their number of reflections.
+    """
+    peaks = series["peaks"][index]
+    hkls = [[{"hkl": tuple(int(v) for v in hkl), "multiplicity": int(count)}]
+            for hkl, count in zip(peaks["hkl"], peaks["multiplicity"])]
+    return window_pattern(peaks["two_theta"], peaks["intensity"], hkls, peaks["d_hkl"], two_theta_range, normalization)
+
+def _full_range(two_theta_range, wavelength):
+    # Patterns for the named wavelengths are computed once over the widest range and sliced for
+    # narrower ones. Other wavelengths only come from API requests, which get their own window:
+    # at short wavelengths the full range holds far more reflections than the window.
+    if not isinstance(wavelength, str):
+        return tuple(two_theta_range)
+    return (min(FULL_TWO_THETA_RANGE[0], min(two_theta_range)), max(FULL_TWO_THETA_RANGE[1], max(two_theta_range)))
+
+def _pattern_key(cif_contents, lattice_params, two_theta_range, wavelength):
+    if lattice_params is not None:
+        lattice_params = tuple(float(v) for v in lattice_params)
+    return lattice_params, content_hash(cif_contents, lattice_params, _full_range(two_theta_range, wavelength), wavelength)
+
+def _stored_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization, scan):
+    # Cell shifts from the slider are rows of the precomputed lattice scan.
+    if scan is not None:
+        index = scan_index(scan, lattice_params)
+        if index is not None:
+            pattern = scan_pattern(scan, index, two_theta_range, normalization)
+            if pattern is not None:
+                return pattern
+    full = shared_cache.get("full_pattern", _pattern_key(cif_contents, lattice_params, two_theta_range, wavelength)[1])
+    if full is None:
+        return None
+    return window_pattern(full.x, full.y, full.hkls, full.d_hkls, two_theta_range, normalization)
+
+def _stored_scan(cif_contents, wavelength):
+    return shared_cache.get("lattice_scan", content_hash(cif_contents, wavelength)) if LATTICE_SCAN else None
+
+def cached_pattern(cif_contents, lattice_params=None, two_theta_range=(0, 90), wavelength="CuKa", normalization="window"):
+    """
+    Calculate the pattern of a CIF upload, optionally on new lattice parameters
+    (a, b, c, alpha, beta, gamma), cut to the 2θ range and scaled as in window_pattern.
+    The unscaled pattern over the full 2θ range is computed once and shared across workers
+    through the cache, so range changes only slice it; isotropic cell shifts are looked up
+    in the CIF's lattice scan when one has been computed.
+    """
+    pattern = _stored_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization,
+                              _stored_scan(cif_contents, wavelength))
+    if pattern is not None:
+        return pattern
+    lattice_params, key = _pattern_key(cif_contents, lattice_params, two_theta_range, wavelength)
+
+    structure = load_compact_structure(cif_contents)
+    if lattice_params is not None:
+        # Raises on an impossible cell rather than caching the CIF's own pattern under its key.
+        structure = structure.with_lattice(*lattice_params)
+    calculator = XRDCalculator(wavelength=wavelength)
+    # Keep weak peaks: whether they pass the tolerance depends on the window.
+    calculator.SCALED_INTENSITY_TOL = 0
+    full = calculator.get_pattern(structure, scaled=False, two_theta_range=_full_range(two_theta_range, wavelength))
+    shared_cache.set("full_pattern", key, full)
+    shared_cache.set("last_pattern", content_hash(cif_contents, wavelength), full)
+    return window_pattern(full.x, full.y, full.hkls, full.d_hkls, two_theta_range, normalization)
+
+def stored_pattern(cif_contents, lattice_params=None, two_theta_range=(0, 90), wavelength="CuKa", normalization="window"):
+    """
+    The pattern cached_pattern returns, taken only from the cache (full pattern or lattice
+    scan row); None if it has not been calculated.
+    """
+    return _stored_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization,
+                           _stored_scan(cif_contents, wavelength))
+
+def preview_pattern(cif_contents, lattice_params, two_theta_range=(0, 90), wavelength="CuKa", normalization="window"):
+    """
+    Fast stand-in for cached_pattern while lattice parameters are being edited.
+    Returns (pattern, exact): a stored exact pattern when there is one, otherwise the
+    reflections of the lattice scan moved to the new cell through its metric tensor,
+    keeping the unshifted intensities (exact=False). Returns (None, False) without a
+    lattice scan. Peaks are labelled by one hkl each rather than by unique families.
+    """
+    scan = _stored_scan(cif_contents, wavelength)
+    pattern = _stored_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization, scan)
+    if pattern is not None:
+        return pattern, True
+    if scan is None or lattice_params is None:
+        return None, False
+
+    # Equivalent reflections stop coinciding once the cell loses symmetry, so every
+    # reflection is moved on its own with an equal share of its peak's intensity.
+    starts = scan["peak_starts"]
+    sizes = np.diff(np.r_[starts, len(scan["reflections"])])
+    hkls = scan["reflections"]
+    intensity = np.repeat(scan["intensity"][scan_index(scan, None)] / sizes, sizes)
+
+    matrix = lattice_matrix(*lattice_params)
+    metric = np.linalg.inv(matrix @ matrix.T)
+    g = np.sqrt(np.einsum("ij,jk,ik->i", hkls, metric, hkls))
+    two_theta = np.degrees(2 * np.arcsin(np.minimum(scan["wavelength"] * g / 2, 1)))
+    lo, hi = scan["two_theta_range"]
+    in_range = (two_theta >= lo) & (two_theta <= hi)
+    order = np.flatnonzero(in_range)[np.argsort(two_theta[in_range], kind="stable")]
+    if not len(order):
+        raise ValueError("No reflections in the 2θ range")
+    hkls, g, two_theta, intensity = hkls[order], g[order], two_theta[order], intensity[order]
+
+    starts = np.flatnonzero(np.r_[True, np.diff(two_theta) >= XRDCalculator.TWO_THETA_TOL])
+    sizes = np.diff(np.r_[starts, len(two_theta)])
+    if scan["is_hex"]:
+        hkls = np.column_stack([hkls[:, 0], hkls[:, 1], -hkls[:, 0] - hkls[:, 1], hkls[:, 2]])
+    families = [[{"hkl": tuple(int(v) for v in hkls[i]), "multiplicity": int(n)}] for i, n in zip(starts, sizes)]
+    pattern = window_pattern(two_theta[starts], np.add.reduceat(intensity, starts), families, 1 / g[starts],
+                             two_theta_range, normalization)
+    return pattern, False
+
+def phase_pattern(cif_contents, lattice_params=None, two_theta_range=(0, 90), normalization="window", progressive=False,
+                  wavelength="CuKa"):
+    """
+    Per-phase work of a plot update. Returns (pattern, exact): the preview_pattern while
+    lattice values are being edited (progressive) when one is available, else cached_pattern.
+    """
+    if progressive:
+        pattern, exact = preview_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization)
+        if pattern is not None:
+            return pattern, exact
+    return cached_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization), True
+
+def provisional_pattern(cif_contents, lattice_params=None, two_theta_range=(0, 90), normalization="window",
+                        wavelength="CuKa"):
+    """
+    Cheap stand-in for a phase whose calculation ran out of time, from cached data only.
+    Returns (pattern, exact): the preview_pattern when there is one, else the last pattern
+    calculated for the CIF on any cell, else (None, False).
+    """
+    pattern, exact = preview_pattern(cif_contents, lattice_params, two_theta_range, wavelength, normalization)
+    if pattern is not None:
+        return pattern, exact
+    last = shared_cache.get("last_pattern", content_hash(cif_contents, wavelength))
+    if last is not None:
+        return window_pattern(last.x, last.y, last.hkls, last.d_hkls, two_theta_range, normalization), False
+    return None, False
+
+def gaussian_profile(two_theta, peak_two_theta, peak_intensity, fwhm=0.1):
+    """
+    Sum of Gaussian peaks with the given FWHM (degrees) on a 2θ grid. Peaks are added in
+    blocks so the (peaks, grid) temporary stays around 32 MB.
+    """
+    two_theta = np.asarray(two_theta, dtype=float)
+    peak_two_theta = np.asarray(peak_two_theta, dtype=float)
+    peak_intensity = np.asarray(peak_intensity, dtype=float)
+    profile = np.zeros_like(two_theta)
+    width = 4 * np.log(2) / fwhm ** 2
+    block = max(1, 2 ** 22 // max(1, len(two_theta)))
+    for start in range(0, len(peak_two_theta), block):
+        offsets = two_theta[None, :] - peak_two_theta[start:start + block, None]
+        profile += peak_intensity[start:start + block] @ np.exp(-width * offsets ** 2)
+    return profile
+
+def warm_cif(contents, two_theta_range=FULL_TWO_THETA_RANGE, wavelength="CuKa"):
+    """
+    Parse and validate a CIF upload and cache everything its first plot needs: the structure,
+    its compact form, the lattice scan (hkl table) and the pattern on the cell parameters the
+    lattice inputs will show. Raises if the file cannot be used.
+    """
+    compact = load_compact_structure(contents)
+    if LATTICE_SCAN:
+        load_lattice_scan(contents, wavelength)
+    cached_pattern(contents, tuple(round(v, 4) for v in compact.parameters), two_theta_range, wavelength)
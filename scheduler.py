@@ -0,0 +1,205 @@
+"""
+Admission control for heavy callbacks, per worker process.
+
+Callbacks are told apart by name, looked up from the request's output spec: those that
+calculate patterns, parse uploads or render images are heavy, everything else (upload
+checkmarks, block toggles, figure patches for zoom and selection) runs straight away. Heavy requests take one of COMPUTE_CONCURRENCY slots, at most
+SESSION_CONCURRENCY of them per browser session, and wait for one otherwise. Free slots go
+round-robin over the sessions with waiting requests, so one busy session cannot starve the
+others. A waiting request is superseded by a newer one of the same session for the same
+callback (as while dragging a slider) and answered with 204, which Dash treats as
+"no update"; so is a request that waits longer than QUEUE_TIMEOUT_S (503 for the JSON API).
+Uploads are never superseded, since a newer request does not include the older files.
+
+The queue lives in one worker process and only orders requests that process serves at the
+same time, so it needs threaded workers (gunicorn --worker-class gthread, as in the Procfile);
+a sync worker handles one request at a time and never has a choice to make.
+
+    GET /api/scheduler  queue depth, running jobs and wait times of this worker
+"""
+import collections
+import secrets
+import threading
+import time
+from flask import Response, g, jsonify, request
+from config import COMPUTE_CONCURRENCY, SESSION_CONCURRENCY, QUEUE_TIMEOUT_S
+from layout import app
+
+server = app.server
+
+SESSION_COOKIE = "xrd_session"
+# The heavy callbacks, by function name. Callbacks that only patch a figure another one
+# drew (zoom, reflection highlight, trace toggles) write the same outputs but stay light.
+HEAVY_CALLBACKS = {
+    "update_xrd_plot", "refine_xrd_plot", "search_phase_combinations", "generate_solid_solution",
+    "update_series_plot", "store_series_files", "store_xy_file", "store_cif_files",
+    "update_download_link", "generate_pawley_inp",
+}
+# Heavy callbacks where only the latest request of a session matters.
+LATEST_WINS_CALLBACKS = {"update_xrd_plot", "refine_xrd_plot", "update_series_plot", "update_download_link"}
+# JSON API routes that calculate patterns.
+HEAVY_PATHS = {"/api/cifs", "/api/patterns", "/api/search"}
+# Recent waits kept for the percentiles.
+WAIT_SAMPLES = 1000
+
+class _Waiter:
+    __slots__ = ("session", "key", "event", "granted", "superseded")
+
+    def __init__(self, session, key):
+        self.session = session
+        self.key = key
+        self.event = threading.Event()
+        self.granted = False
+        self.superseded = False
+
+class FairScheduler:
+    def __init__(self, limit=COMPUTE_CONCURRENCY, per_session=SESSION_CONCURRENCY):
+        self.limit = max(1, limit)
+        self.per_session = max(1, per_session)
+        self._lock = threading.Lock()
+        self._queues = collections.OrderedDict()  # session -> deque of waiters, in round-robin order
+        self._running = collections.Counter()
+        self._waits = collections.deque(maxlen=WAIT_SAMPLES)
+        self._counts = collections.Counter()
+
+    def acquire(self, session, key=None, timeout=QUEUE_TIMEOUT_S):
+        """
+        Wait for a slot. Returns True once granted; False if superseded or timed out, in
+        which case nothing needs releasing.
+        """
+        start = time.monotonic()
+        waiter = _Waiter(session, key)
+        with self._lock:
+            queue = self._queues.setdefault(session, collections.deque())
+            if key is not None:
+                for other in queue:
+                    if other.key == key and not other.superseded:
+                        other.superseded = True
+                        other.event.set()
+            queue.append(waiter)
+            self._dispatch()
+        waiter.event.wait(timeout)
+
+        with self._lock:
+            if not waiter.granted:
+                self._remove(waiter)
+                self._counts["superseded" if waiter.superseded else "timed_out"] += 1
+                return False
+            self._counts["admitted"] += 1
+            self._waits.append(time.monotonic() - start)
+            return True
+
+    def release(self, session):
+        with self._lock:
+            self._running[session] -= 1
+            if self._running[session] <= 0:
+                del self._running[session]
+            self._dispatch()
+
+    def _remove(self, waiter):
+        queue = self._queues.get(waiter.session)
+        if queue is not None and waiter in queue:
+            queue.remove(waiter)
+            if not queue:
+                del self._queues[waiter.session]
+
+    def _next_session(self):
+        # First session in the rotation with a live waiter and room under its own limit.
+        for session in list(self._queues):
+            queue = self._queues[session]
+            while queue and queue[0].superseded:
+                queue.popleft()
+            if not queue:
+                del self._queues[session]
+            elif self._running[session] < self.per_session:
+                return session
+        return None
+
+    def _dispatch(self):
+        # Called with the lock held: hand free slots to the sessions in turn.
+        while sum(self._running.values()) < self.limit:
+            session = self._next_session()
+            if session is None:
+                return
+            queue = self._queues[session]
+            waiter = queue.popleft()
+            if not queue:
+                del self._queues[session]
+            else:
+                # The session goes to the back of the rotation.
+                self._queues.move_to_end(session)
+            self._running[session] += 1
+            waiter.granted = True
+            waiter.event.set()
+
+    def stats(self):
+        with self._lock:
+            waits = sorted(self._waits)
+            depth = sorted((len(queue) for queue in self._queues.values()), reverse=True)
+            return {
+                "limit": self.limit,
+                "per_session": self.per_session,
+                "running": sum(self._running.values()),
+                "queued": sum(depth),
+                "queued_per_session": depth,
+                "counts": dict(self._counts),
+                "wait_ms": {
+                    "samples": len(waits),
+                    "mean": 1000 * sum(waits) / len(waits) if waits else 0.0,
+                    "p50": 1000 * waits[len(waits) // 2] if waits else 0.0,
+                    "p95": 1000 * waits[int(len(waits) * 0.95)] if waits else 0.0,
+                    "max": 1000 * waits[-1] if waits else 0.0,
+                },
+            }
+
+scheduler = FairScheduler()
+
+def _callback_name(output):
+    # The output spec of a request ("..a.b...c.d.." for several outputs, "@<hash>" on
+    # allow_duplicate ones) is the key Dash registered the callback under.
+    entry = app.callback_map.get(output) or {}
+    return getattr(entry.get("callback"), "__name__", None)
+
+def _classify():
+    """
+    (heavy, key) of the current request; the key identifies requests a newer one supersedes.
+    """
+    if request.path in HEAVY_PATHS:
+        return True, None
+    if request.path.endswith("/_dash-update-component"):
+        body = request.get_json(silent=True) or {}
+        output = body.get("output", "")
+        name = _callback_name(output)
+        if name in HEAVY_CALLBACKS:
+            return True, (output if name in LATEST_WINS_CALLBACKS else None)
+    return False, None
+
+@server.before_request
+def _admit():
+    g.xrd_session = request.cookies.get(SESSION_COOKIE)
+    heavy, key = _classify()
+    if not heavy:
+        return None
+    session = g.xrd_session or request.remote_addr or ""
+    if not scheduler.acquire(session, key):
+        if request.path in HEAVY_PATHS:
+            return jsonify({"error": "Server busy, retry later"}), 503
+        return Response(status=204)
+    g.xrd_slot = session
+    return None
+
+@server.teardown_request
+def _release(exc):
+    session = g.pop("xrd_slot", None)
+    if session is not None:
+        scheduler.release(session)
+
+@server.after_request
+def _session_cookie(response):
+    if not g.get("xrd_session"):
+        response.set_cookie(SESSION_COOKIE, secrets.token_hex(16), httponly=True, samesite="Lax")
+    return response
+
+@server.route("/api/scheduler", methods=["GET"])
+def scheduler_stats():
+    return jsonify(scheduler.stats())
@@ -0,0 +1,146 @@
+"""
+Search for the combination of candidate phases that best explains a measured pattern.
+
+Every candidate is broadened once onto the measured 2θ grid, giving one column of a profile
+matrix. A combination is scored by a non-negative least-squares fit of its columns plus a
+constant background to the measurement. Fits work from the Gram matrix alone, so their cost
+does not depend on the number of grid points. The unconstrained least-squares residual
+bounds the NNLS residual from below and is computed for a whole batch of subsets at once;
+subsets are fitted in order of that bound until no remaining one can enter the ranking.
+Subset sizes with few enough combinations are bounded exhaustively; larger ones are grown
+by beam search from the best subsets one size down. Batches are bounded on the phase pool.
+"""
+import itertools
+import math
+import numpy as np
+from preprocess import FULL_TWO_THETA_RANGE, gaussian_profile, phase_pattern
+from workers import map_ordered
+
+# Subset sizes with at most this many combinations are searched exhaustively.
+MAX_EXHAUSTIVE = 250000
+# Subsets of one size carried over to grow the next when searching by beam.
+BEAM_WIDTH = 24
+# Combinations fitted per pool task.
+BATCH_SIZE = 4096
+
+def profile_matrix(two_theta, patterns, fwhm=0.1):
+    """
+    (points, phases) matrix of each pattern broadened onto the 2θ grid.
+    """
+    return np.column_stack([gaussian_profile(two_theta, pattern.x, pattern.y, fwhm) for pattern in patterns])
+
+def _regularized(gram, columns):
+    g = gram[columns[..., :, None], columns[..., None, :]]
+    # A tiny ridge keeps the factorization defined for duplicate or empty candidates.
+    ridge = 1e-12 * np.trace(g, axis1=-2, axis2=-1)[..., None, None] + 1e-300
+    return g + ridge * np.eye(columns.shape[-1])
+
+def _columns(subsets):
+    subsets = np.asarray(subsets, dtype=int).reshape(len(subsets), -1)
+    return np.hstack([np.zeros((len(subsets), 1), dtype=int), subsets + 1])
+
+def _lower_bounds(gram, projection, total, subsets):
+    """
+    Squared residuals of the unconstrained least-squares fits of a batch of subsets, which
+    bound their NNLS residuals from below.
+    """
+    columns = _columns(subsets)
+    q = projection[columns]
+    return total - np.einsum("ij,ij->i", q, np.linalg.solve(_regularized(gram, columns), q[..., None])[..., 0])
+
+def _fit(gram, projection, total, subset):
+    """
+    NNLS fit of the background plus the subset's columns from the normal equations.
+    Returns (squared residual, coefficients with the background first).
+    """
+    from scipy.linalg import solve_triangular
+    from scipy.optimize import nnls
+
+    columns = _columns([subset])[0]
+    upper = np.linalg.cholesky(_regularized(gram, columns)).T
+    z = solve_triangular(upper, projection[columns], trans="T")
+    coefficients, rnorm = nnls(upper, z)
+    return max(total - z @ z + rnorm ** 2, 0.0), coefficients
+
+def _best_fits(gram, projection, total, subsets, keep):
+    """
+    Branch and bound over a list of subsets: bound them all in batches on the phase pool, then
+    fit in order of their bound until no remaining bound can beat the keep-th best fit.
+    Returns [(squared residual, coefficients, subset), ...] sorted by residual.
+    """
+    batches = [subsets[start:start + BATCH_SIZE] for start in range(0, len(subsets), BATCH_SIZE)]
+    bounds = []
+    for result, error in map_ordered(_lower_bounds, [(gram, projection, total, batch) for batch in batches]):
+        if error is not None:
+            raise error
+        bounds.append(result)
+    bounds = np.concatenate(bounds)
+    fits = []
+    for index in np.argsort(bounds, kind="stable"):
+        if len(fits) >= keep and bounds[index] >= fits[keep - 1][0]:
+            break
+        residual, coefficients = _fit(gram, projection, total, subsets[index])
+        fits.append((residual, coefficients, subsets[index]))
+        fits.sort(key=lambda fit: fit[0])
+        del fits[keep:]
+    return fits
+
+def rank_combinations(two_theta, intensity, profiles, max_phases=3, top=10):
+    """
+    Best combinations of 1..max_phases columns of the profile matrix for the measured
+    intensity, each fitted together with a constant background. Returns {k: [combination, ...]}
+    with each list ranked by residual; a combination is a dict with the phase indices, their
+    non-negative scale factors, the background level and the residual as an R-factor in %.
+    """
+    intensity = np.asarray(intensity, dtype=float)
+    matrix = np.column_stack([np.ones_like(intensity), profiles])
+    norms = np.linalg.norm(matrix, axis=0)
+    norms[norms == 0] = 1
+    matrix = matrix / norms
+    gram = matrix.T @ matrix
+    projection = matrix.T @ intensity
+    total = float(intensity @ intensity) or 1.0
+
+    n_phases = matrix.shape[1] - 1
+    ranked = {}
+    beam = [()]
+    for k in range(1, min(max_phases, n_phases) + 1):
+        if math.comb(n_phases, k) <= MAX_EXHAUSTIVE:
+            subsets = list(itertools.combinations(range(n_phases), k))
+        else:
+            subsets = sorted({tuple(sorted(subset + (index,)))
+                              for subset in beam for index in range(n_phases) if index not in subset})
+        fits = _best_fits(gram, projection, total, subsets, max(top, BEAM_WIDTH))
+        beam = [subset for _, _, subset in fits]
+        ranked[k] = [{
+            "phases": list(subset),
+            "scales": [float(c) for c in coefficients[1:] / norms[[index + 1 for index in subset]]],
+            "background": float(coefficients[0] / norms[0]),
+            "residual": float(100 * np.sqrt(residual / total)),
+        } for residual, coefficients, subset in fits[:top]]
+    return ranked
+
+def search_phases(two_theta, intensity, cif_contents, max_phases=3, top=10, fwhm=0.1, wavelength="CuKa",
+                  lattices=None):
+    """
+    Compute every candidate's pattern (scaled to 100 over the full range) through the shared
+    cache and rank combinations of them against the measurement. Returns (ranked, errors)
+    where errors maps candidate index to the exception of candidates that could not be
+    calculated; those are left out of the search.
+    """
+    lattices = lattices or [None] * len(cif_contents)
+    results = map_ordered(phase_pattern, [
+        (contents, lattice, FULL_TWO_THETA_RANGE, "global", False, wavelength)
+        for contents, lattice in zip(cif_contents, lattices)
+    ])
+    usable = [index for index, (_, error) in enumerate(results) if error is None]
+    errors = {index: error for index, (_, error) in enumerate(results) if error is not None}
+    if not usable:
+        return {}, errors
+
+    profiles = profile_matrix(two_theta, [results[index][0][0] for index in usable], fwhm)
+    ranked = rank_combinations(two_theta, intensity, profiles, max_phases, top)
+    for combinations in ranked.values():
+        for combination in combinations:
+            combination["phases"] = [usable[index] for index in combination["phases"]]
+    return ranked, errors
@@ -0,0 +1,181 @@
+"""
+In-situ and time-series datasets: many scans on a common 2θ grid.
+
+A series is stored on the server as one memory-mapped float32 array of shape (scans, points)
+plus its 2θ grid, under XRD_DATA_DIR and named by content hash, so every worker can open it.
+Series beyond XRD_DATA_MAX_MB are removed least recently opened first. Only the small
+metadata dict travels through the browser. Per-frame operations (normalization,
+range filtering, downsampling) work on the whole stack at once.
+"""
+import glob
+import os
+import re
+import numpy as np
+from cache import content_hash, private_dir
+from config import DATA_DIR, DATA_MAX_MB
+from preprocess import ascending_scan, decode_upload, read_numeric_columns
+
+# Rows written per block while normalizing, to bound memory on long series.
+_BLOCK_ROWS = 256
+# Series ids are content hashes; anything else is rejected before it reaches a path.
+_SERIES_ID = re.compile(r"[0-9a-f]{40}")
+
+def _natural_key(name):
+    return [int(part) if part.isdigit() else part.lower() for part in re.split(r"(\d+)", name)]
+
+def _paths(series_id):
+    if not isinstance(series_id, str) or not _SERIES_ID.fullmatch(series_id):
+        raise ValueError(f"Invalid series id: {series_id!r}")
+    return (os.path.join(DATA_DIR, f"{series_id}_2theta.npy"),
+            os.path.join(DATA_DIR, f"{series_id}.npy"))
+
+def normalize_stack(stack, out=None):
+    """
+    Scale every frame to a maximum of 100, for all frames at once.
+    """
+    peak = stack.max(axis=1, keepdims=True)
+    peak[peak == 0] = 1
+    return np.multiply(stack, 100 / peak, out=out)
+
+def column_window(two_theta, xrange=None):
+    """
+    Column slice of the common grid covering the 2θ range.
+    """
+    if xrange is None:
+        return slice(0, len(two_theta))
+    lo = np.searchsorted(two_theta, min(xrange), side="left")
+    hi = np.searchsorted(two_theta, max(xrange), side="right")
+    return slice(lo, hi)
+
+def create_series(contents_list, filenames):
+    """
+    Parse uploaded scans (ordered by natural filename sort) into a normalized memory-mapped
+    stack on the first scan's 2θ grid; scans on another grid are interpolated onto it.
+    Returns the metadata dict kept in series-store.
+    """
+    order = sorted(range(len(filenames)), key=lambda i: _natural_key(filenames[i]))
+    filenames = [filenames[i] for i in order]
+    contents_list = [contents_list[i] for i in order]
+    series_id = content_hash(*filenames, *contents_list)
+    grid_path, stack_path = _paths(series_id)
+
+    if not (os.path.exists(grid_path) and os.path.exists(stack_path)):
+        private_dir(DATA_DIR)
+        first = ascending_scan(read_numeric_columns(decode_upload(contents_list[0])))
+        two_theta = first[:, 0].copy()
+        tmp_path = f"{stack_path}.{os.getpid()}.tmp"
+        stack = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32,
+                                          shape=(len(contents_list), len(two_theta)))
+        stack[0] = first[:, 1]
+        for row, contents in enumerate(contents_list[1:], start=1):
+            data = ascending_scan(read_numeric_columns(decode_upload(contents)))
+            if len(data) == len(two_theta) and np.allclose(data[:, 0], two_theta):
+                stack[row] = data[:, 1]
+            else:
+                stack[row] = np.interp(two_theta, data[:, 0], data[:, 1])
+        for start in range(0, len(stack), _BLOCK_ROWS):
+            block = stack[start:start + _BLOCK_ROWS]
+            normalize_stack(block, out=block)
+        stack.flush()
+        del stack
+        # Write the grid last: its presence marks the series as complete for other workers.
+        os.replace(tmp_path, stack_path)
+        np.save(f"{grid_path}.{os.getpid()}.tmp.npy", two_theta)
+        os.replace(f"{grid_path}.{os.getpid()}.tmp.npy", grid_path)
+        _evict(keep=series_id)
+    else:
+        two_theta = np.load(grid_path)
+        os.utime(grid_path)
+
+    return {
+        "id": series_id,
+        "n_scans": len(filenames),
+        "n_points": int(len(two_theta)),
+        "filenames": filenames,
+        "two_theta_min": float(two_theta[0]),
+        "two_theta_max": float(two_theta[-1]),
+    }
+
+def _evict(keep=None, max_bytes=int(DATA_MAX_MB * 1024 * 1024)):
+    """
+    Remove the least recently opened series until the stored ones fit in max_bytes; the grid
+    file's mtime is the last use. The series being written (keep) always stays.
+    """
+    series = []
+    for grid_path in glob.glob(os.path.join(DATA_DIR, "*_2theta.npy")):
+        series_id = os.path.basename(grid_path)[:-len("_2theta.npy")]
+        try:
+            stack_path = _paths(series_id)[1]
+            size = os.path.getsize(grid_path) + os.path.getsize(stack_path)
+            series.append((os.path.getmtime(grid_path), size, series_id))
+        except (ValueError, OSError):
+            continue
+    total = sum(size for _, size, _ in series)
+    for _, size, series_id in sorted(series):
+        if total <= max_bytes:
+            break
+        if series_id == keep:
+            continue
+        # The grid goes first, so other workers see the series as missing, not half-deleted.
+        # A worker that already has the stack memory-mapped keeps reading it until it closes.
+        for path in _paths(series_id):
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+        total -= size
+
+def open_series(series_id):
+    """
+    Return (two_theta, stack) with the stack memory-mapped read-only, and mark the series as
+    recently used.
+    """
+    grid_path, stack_path = _paths(series_id)
+    two_theta, stack = np.load(grid_path), np.load(stack_path, mmap_mode="r")
+    try:
+        os.utime(grid_path)
+    except OSError:
+        pass
+    return two_theta, stack
+
+def series_frame(series_id, index, xrange=None):
+    """
+    Return (two_theta, intensity) of one frame, cut to the 2θ range.
+    """
+    two_theta, stack = open_series(series_id)
+    window = column_window(two_theta, xrange)
+    return two_theta[window], np.asarray(stack[index, window], dtype=float)
+
+def _maxpool_columns(block, n_bins):
+    size = -(-block.shape[1] // n_bins)
+    if size <= 1:
+        return block
+    n_full = (block.shape[1] // size) * size
+    pooled = block[:, :n_full].reshape(block.shape[0], -1, size).max(axis=2)
+    if n_full < block.shape[1]:
+        pooled = np.hstack([pooled, block[:, n_full:].max(axis=1, keepdims=True)])
+    return pooled
+
+def _pool_grid(two_theta, n_bins):
+    size = -(-len(two_theta) // n_bins)
+    if size <= 1:
+        return two_theta
+    n_full = (len(two_theta) // size) * size
+    centers = two_theta[:n_full].reshape(-1, size).mean(axis=1)
+    if n_full < len(two_theta):
+        centers = np.append(centers, two_theta[n_full:].mean())
+    return centers
+
+def series_tile(series_id, xrange=None, frame_range=None, max_frames=200, max_points=800):
+    """
+    Downsampled view of the stack for a 2θ window and frame range.
+    Frames are subsampled evenly and columns are max-pooled, so peaks stay visible.
+    Returns (two_theta, frame_indices, z) with z of shape (frames, points).
+    """
+    two_theta, stack = open_series(series_id)
+    window = column_window(two_theta, xrange)
+    first, last = (0, len(stack) - 1) if frame_range is None else (
+        max(0, int(np.floor(min(frame_range)))), min(len(stack) - 1, int(np.ceil(max(frame_range)))))
+    frames = np.unique(np.linspace(first, last, min(max_frames, last - first + 1)).round().astype(int))
+    z = _maxpool_columns(np.asarray(stack[frames, window], dtype=np.float32), max_points)
+    return _pool_grid(two_theta[window], max_points), frames, z
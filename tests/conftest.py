@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app's modules live flat in the repository root. Tests run without the shared cache, so
+# they neither read nor leave entries in a running app's cache.
+os.environ["XRD_CACHE_PATH"] = ""
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,58 @@
+import threading
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.io.cif import CifWriter
+import api
+from cache import shared_cache
+
+NACL = str(CifWriter(Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.64), ["Na", "Cl"],
+                                               [[0, 0, 0], [0.5, 0.5, 0.5]])))
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    # cif_id lookups need the shared cache; give each test its own.
+    monkeypatch.setattr(shared_cache, "path", str(tmp_path / "cache" / "cache.sqlite"))
+    monkeypatch.setattr(shared_cache, "_verified", False)
+    monkeypatch.setattr(shared_cache, "_local", threading.local())
+    return api.server.test_client()
+
+def _register(client):
+    response = client.post("/api/cifs", json={"cifs": [{"name": "NaCl", "cif": NACL}]})
+    assert response.status_code == 200
+    item = response.get_json()["cifs"][0]
+    assert "error" not in item
+    np.testing.assert_allclose(item["lattice"], [5.64, 5.64, 5.64, 90, 90, 90], atol=1e-6)
+    return item["cif_id"]
+
+def test_pattern_by_cif_id(client):
+    cif_id = _register(client)
+    response = client.post("/api/patterns", json={"phases": [{"cif_id": cif_id, "lattice": [5.7, 5.7, 5.7, 90, 90, 90]}],
+                                                  "two_theta_range": [20, 60]})
+    assert response.status_code == 200
+    item = response.get_json()["phases"][0]
+    assert "error" not in item
+    # First reflection is (111) of the requested 5.7 Å cell, not the CIF's own 5.64 Å.
+    d_111 = 5.7 / np.sqrt(3)
+    assert item["d_spacing"][0] == pytest.approx(d_111)
+    assert item["two_theta"][0] == pytest.approx(2 * np.degrees(np.arcsin(1.54184 / (2 * d_111))), abs=1e-3)
+    assert max(item["intensity"]) == pytest.approx(100)
+
+@pytest.mark.parametrize("lattice", [
+    [0, 0, 0, 90, 90, 90],
+    [-1, 4, 4, 90, 90, 90],
+    [4, 4, 4, 200, 90, 90],
+    [4, 4, 4, 120, 120, 120],
+    [4, 4, 4, 90, 90],
+    [4, 4, "a", 90, 90, 90],
+])
+def test_bad_lattice(client, lattice):
+    response = client.post("/api/patterns", json={"phases": [{"cif": NACL, "lattice": lattice}]})
+    assert response.status_code == 400
+    assert "lattice" in response.get_json()["error"]
+
+@pytest.mark.parametrize("wavelength", [0.1, 5, "XKa", True, None])
+def test_bad_wavelength(client, wavelength):
+    response = client.post("/api/patterns", json={"phases": [{"cif": NACL}], "wavelength": wavelength})
+    assert response.status_code == 400
+    assert "wavelength" in response.get_json()["error"]
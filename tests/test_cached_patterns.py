@@ -0,0 +1,67 @@
+import base64
+import threading
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.io.cif import CifWriter
+from cache import shared_cache
+from preprocess import (XRDCalculator, cached_pattern, load_compact_structure, load_lattice_scan, preview_pattern,
+                        provisional_pattern, scan_index, scan_pattern, stored_pattern)
+
+TRICLINIC = Structure(Lattice.from_parameters(4.1, 5.3, 6.2, 82, 95, 101), ["Si", "O", "O"],
+                      [[0.1, 0.2, 0.3], [0.4, 0.1, 0.7], [0.8, 0.6, 0.2]])
+CONTENTS = "data:chemical/x-cif;base64," + base64.b64encode(str(CifWriter(TRICLINIC)).encode()).decode()
+
+@pytest.fixture(autouse=True)
+def cache(tmp_path, monkeypatch):
+    # Lattice scans and stored patterns are only read back from the shared cache.
+    monkeypatch.setattr(shared_cache, "path", str(tmp_path / "cache" / "cache.sqlite"))
+    monkeypatch.setattr(shared_cache, "_verified", False)
+    monkeypatch.setattr(shared_cache, "_local", threading.local())
+
+def test_lattice_scan_row_matches_scaled_cell():
+    scan = load_lattice_scan(CONTENTS)
+    base = scan["lattice"]
+    index = int(np.flatnonzero(scan["percent"] == 3)[0])
+    # The cell as the shift slider writes it, which the scan row is looked up by.
+    lattice_params = tuple(np.round(base[:3] * 1.03, 4)) + tuple(np.round(base[3:], 4))
+    assert scan_index(scan, lattice_params) == index
+
+    row = scan_pattern(scan, index, (10, 90))
+    expected = XRDCalculator().get_pattern(load_compact_structure(CONTENTS).with_lattice(*base[:3] * 1.03, *base[3:]),
+                                           two_theta_range=(10, 90))
+    np.testing.assert_allclose(row.x, expected.x, atol=1e-9)
+    np.testing.assert_allclose(row.y, expected.y, atol=1e-9)
+    np.testing.assert_allclose(row.d_hkls, expected.d_hkls, atol=1e-9)
+    assert row.hkls == expected.hkls
+
+    stored = stored_pattern(CONTENTS, lattice_params, (10, 90))
+    np.testing.assert_array_equal(stored.x, row.x)
+    np.testing.assert_array_equal(stored.y, row.y)
+
+def test_preview_peaks_sit_at_exact_positions():
+    load_lattice_scan(CONTENTS)
+    lattice_params = (4.2, 5.25, 6.3, 83, 94, 102)
+    preview, exact = preview_pattern(CONTENTS, lattice_params, (10, 90))
+    assert not exact
+
+    calculator = XRDCalculator()
+    calculator.SCALED_INTENSITY_TOL = 0
+    expected = calculator.get_pattern(load_compact_structure(CONTENTS).with_lattice(*lattice_params), two_theta_range=(10, 90))
+    # Every preview peak is an exact peak, and no exact peak of any weight is missing.
+    nearest = np.abs(np.subtract.outer(preview.x, expected.x)).min(axis=1)
+    assert nearest.max() < 1e-9
+    strong = expected.x[expected.y > 1]
+    assert np.abs(np.subtract.outer(strong, preview.x)).min(axis=1).max() < 1e-9
+
+def test_provisional_pattern_only_reads_the_cache():
+    lattice_params = (4.2, 5.25, 6.3, 83, 94, 102)
+    assert provisional_pattern(CONTENTS, lattice_params, (10, 90)) == (None, False)
+    # Nothing was calculated for it.
+    assert all(ns["entries"] == 0 for ns in shared_cache.stats()["namespaces"].values())
+
+    # Once a cell has been calculated, other cells fall back to its pattern.
+    calculated = cached_pattern(CONTENTS, None, (10, 90))
+    pattern, exact = provisional_pattern(CONTENTS, lattice_params, (10, 90))
+    assert not exact
+    np.testing.assert_array_equal(pattern.x, calculated.x)
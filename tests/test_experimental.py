@@ -0,0 +1,42 @@
+import numpy as np
+import pytest
+from experimental import KALPHA_DOUBLETS, SNIP_MAX_PASSES, savitzky_golay, snip_background, strip_kalpha2
+
+TWO_THETA = np.arange(20, 80, 0.01)
+PEAKS = [(30, 100), (45, 100), (70, 50)]
+
+def _peaks(centers_heights, fwhm=0.08):
+    return sum(height * np.exp(-4 * np.log(2) * (TWO_THETA - center) ** 2 / fwhm ** 2)
+               for center, height in centers_heights)
+
+def _kalpha2_position(two_theta):
+    lambda1, lambda2, _ = KALPHA_DOUBLETS["CuKa"]
+    return np.degrees(2 * np.arcsin(lambda2 / lambda1 * np.sin(np.radians(two_theta / 2))))
+
+def test_strip_kalpha2_recovers_kalpha1():
+    ratio = KALPHA_DOUBLETS["CuKa"][2]
+    kalpha1 = _peaks(PEAKS)
+    scan = kalpha1 + _peaks([(_kalpha2_position(center), ratio * height) for center, height in PEAKS])
+    stripped = strip_kalpha2(TWO_THETA, scan)
+    assert np.abs(stripped - kalpha1).max() < 1
+
+def test_strip_kalpha2_leaves_the_input_alone():
+    scan = _peaks(PEAKS)
+    before = scan.copy()
+    strip_kalpha2(TWO_THETA, scan)
+    np.testing.assert_array_equal(scan, before)
+
+@pytest.mark.parametrize("half_width", [20, 4 * SNIP_MAX_PASSES], ids=["direct", "pooled"])
+def test_snip_background_follows_the_background(half_width):
+    background = 20 + 0.2 * (TWO_THETA - 20) + 5 * np.sin(TWO_THETA / 10)
+    scan = background + _peaks(PEAKS)
+    estimate = snip_background(scan, half_width)
+    away = np.all([np.abs(TWO_THETA - center) > 1 for center, _ in PEAKS], axis=0)
+    assert np.abs(estimate - background)[away].max() < 0.05 * background.max()
+    assert np.all(estimate <= scan + 1e-3)
+    assert estimate[np.argmin(np.abs(TWO_THETA - 45))] < background.max()
+
+def test_savitzky_golay_keeps_cubics():
+    x = np.linspace(-1, 1, 201)
+    y = 2 * x ** 3 - x ** 2 + 0.5
+    np.testing.assert_allclose(savitzky_golay(y, 11, 3)[5:-5], y[5:-5], atol=1e-9)
@@ -0,0 +1,26 @@
+import numpy as np
+import pytest
+from pymatgen.analysis.diffraction.xrd import XRDCalculator as PymatgenXRDCalculator
+from pymatgen.core import Lattice, Structure
+from preprocess import XRDCalculator
+
+STRUCTURES = {
+    "cubic": Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.64), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]]),
+    "hexagonal": Structure.from_spacegroup("P6_3mc", Lattice.hexagonal(3.25, 5.21), ["Zn", "O"],
+                                           [[1 / 3, 2 / 3, 0], [1 / 3, 2 / 3, 0.382]]),
+    "triclinic": Structure(Lattice.from_parameters(4.1, 5.3, 6.2, 82, 95, 101), ["Si", "O", "O"],
+                           [[0.1, 0.2, 0.3], [0.4, 0.1, 0.7], [0.8, 0.6, 0.2]]),
+    # A mixed Fe/Ni site next to a partly vacant O site.
+    "mixed_occupancy": Structure.from_spacegroup("Fm-3m", Lattice.cubic(4.18), [{"Fe": 0.5, "Ni": 0.5}, {"O": 0.8}],
+                                                 [[0, 0, 0], [0.5, 0.5, 0.5]]),
+}
+
+@pytest.mark.parametrize("name", STRUCTURES)
+def test_get_pattern_matches_pymatgen(name):
+    structure = STRUCTURES[name]
+    expected = PymatgenXRDCalculator().get_pattern(structure, two_theta_range=(10, 90))
+    pattern = XRDCalculator().get_pattern(structure, two_theta_range=(10, 90))
+    np.testing.assert_allclose(pattern.x, expected.x, atol=1e-9)
+    np.testing.assert_allclose(pattern.y, expected.y, atol=1e-9)
+    np.testing.assert_allclose(pattern.d_hkls, expected.d_hkls, atol=1e-9)
+    assert pattern.hkls == expected.hkls
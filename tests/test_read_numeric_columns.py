@@ -0,0 +1,38 @@
+import base64
+import numpy as np
+import pytest
+from preprocess import parse_xy, read_numeric_columns
+
+EXPECTED = [[10, 1], [11, 2], [12, 3]]
+
+@pytest.mark.parametrize("buf", [
+    b"10 1\n11 2\n12 3\n",
+    b"10,1\r\n11,2\r\n12,3",
+    b"3\n10 1\n11 2\n12 3\n",
+    b"\xef\xbb\xbf10 1\n11 2\n12 3\n",
+    b"# scan\n2theta;intensity\n10;1\n11;2\n# gap\n12;3\n",
+    b"10 1 5\n11 2\n12 3 6 7\n",
+], ids=["plain", "csv", "point_count", "bom", "header_and_comment", "ragged"])
+def test_read_numeric_columns(buf):
+    np.testing.assert_array_equal(read_numeric_columns(buf), EXPECTED)
+
+def test_read_numeric_columns_decimal_comma():
+    np.testing.assert_array_equal(read_numeric_columns(b"2theta;intensity\n10,5;100,2\n10,6;120,4\n"),
+                                  [[10.5, 100.2], [10.6, 120.4]])
+
+def test_read_numeric_columns_keeps_every_column():
+    np.testing.assert_array_equal(read_numeric_columns(b"10 1 0.5\n11 2 0.25\n"), [[10, 1, 0.5], [11, 2, 0.25]])
+
+def test_read_numeric_columns_rejects_single_column():
+    with pytest.raises(ValueError):
+        read_numeric_columns(b"1\n2\n3\n")
+
+def test_parse_xy():
+    contents = "data:text/plain;base64," + base64.b64encode(b"10 1 0.1\n11 2 0.2\n").decode()
+    df = parse_xy(contents)
+    assert list(df.columns) == ["2_theta", "intensity"]
+    np.testing.assert_array_equal(df.to_numpy(), [[10, 1], [11, 2]])
+
+def test_parse_xy_sorts_descending_scans():
+    contents = "data:text/plain;base64," + base64.b64encode(b"12 3\n11 2\n10 1\n").decode()
+    np.testing.assert_array_equal(parse_xy(contents).to_numpy(), EXPECTED)
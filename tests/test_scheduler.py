@@ -0,0 +1,89 @@
+import threading
+import time
+from scheduler import FairScheduler
+
+def _wait_for(condition, timeout=5):
+    end = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < end, "timed out"
+        time.sleep(0.001)
+
+class _Requests:
+    """
+    Requests that wait for a slot on their own threads, in the order they are queued.
+    """
+    def __init__(self, scheduler):
+        self.scheduler = scheduler
+        self.granted = []
+        self.results = {}
+        self.threads = []
+
+    def queue(self, name, session, key=None, until=None):
+        queued = self.scheduler.stats()["queued"]
+
+        def run():
+            ok = self.scheduler.acquire(session, key, timeout=5)
+            self.results[name] = ok
+            if ok:
+                self.granted.append(name)
+
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+        _wait_for(until or (lambda: self.scheduler.stats()["queued"] > queued or name in self.results))
+
+    def join(self):
+        for thread in self.threads:
+            thread.join(5)
+
+def test_slots_go_round_robin_over_sessions():
+    scheduler = FairScheduler(limit=1, per_session=1)
+    assert scheduler.acquire("a")
+    requests = _Requests(scheduler)
+    requests.queue("a2", "a")
+    requests.queue("a3", "a")
+    requests.queue("b1", "b")
+    for n, session in enumerate(["a", "a", "b"], start=1):
+        scheduler.release(session)
+        _wait_for(lambda: len(requests.granted) == n)
+    scheduler.release("a")
+    requests.join()
+    assert requests.granted == ["a2", "b1", "a3"]
+
+def test_session_limit_lets_other_sessions_through():
+    scheduler = FairScheduler(limit=2, per_session=1)
+    assert scheduler.acquire("a")
+    requests = _Requests(scheduler)
+    requests.queue("a2", "a")
+    requests.queue("b1", "b")
+    _wait_for(lambda: requests.granted == ["b1"])
+    scheduler.release("a")
+    _wait_for(lambda: requests.granted == ["b1", "a2"])
+    scheduler.release("a")
+    scheduler.release("b")
+    requests.join()
+    assert scheduler.stats()["running"] == 0
+
+def test_newer_request_supersedes_waiting_one():
+    scheduler = FairScheduler(limit=1, per_session=1)
+    assert scheduler.acquire("a")
+    requests = _Requests(scheduler)
+    requests.queue("old", "a", key="xrd-plot.figure")
+    requests.queue("other", "a", key="series-plot.figure")
+    # The older request is superseded as the newer one joins the queue.
+    requests.queue("new", "a", key="xrd-plot.figure", until=lambda: "old" in requests.results)
+    assert requests.results["old"] is False
+    for n in (1, 2):
+        scheduler.release("a")
+        _wait_for(lambda: len(requests.granted) == n)
+    scheduler.release("a")
+    requests.join()
+    assert requests.granted == ["other", "new"]
+    assert scheduler.stats()["counts"] == {"admitted": 3, "superseded": 1}
+
+def test_waiting_request_times_out():
+    scheduler = FairScheduler(limit=1, per_session=1)
+    assert scheduler.acquire("a")
+    assert scheduler.acquire("b", timeout=0.01) is False
+    assert scheduler.stats()["counts"]["timed_out"] == 1
+    assert scheduler.stats()["queued"] == 0
@@ -0,0 +1,73 @@
+import base64
+import itertools
+import numpy as np
+import pytest
+from pymatgen.core import Lattice, Structure
+from pymatgen.io.cif import CifWriter
+from scipy.optimize import nnls
+import search
+from preprocess import FULL_TWO_THETA_RANGE, gaussian_profile, phase_pattern
+from search import profile_matrix, rank_combinations, search_phases
+
+TWO_THETA = np.arange(10, 90, 0.02)
+
+def _profiles(n_phases=9, seed=0):
+    rng = np.random.default_rng(seed)
+    return np.column_stack([gaussian_profile(TWO_THETA, rng.uniform(12, 88, 6), rng.uniform(10, 100, 6), 0.3)
+                            for _ in range(n_phases)])
+
+def _brute_force(intensity, profiles, k):
+    # Every k-subset fitted by scipy's NNLS with a constant background, as R-factors in %.
+    residuals = {}
+    for subset in itertools.combinations(range(profiles.shape[1]), k):
+        _, rnorm = nnls(np.column_stack([np.ones_like(intensity), profiles[:, subset]]), intensity)
+        residuals[subset] = 100 * rnorm / np.linalg.norm(intensity)
+    return residuals
+
+@pytest.mark.parametrize("beam", [False, True], ids=["exhaustive", "beam"])
+def test_rank_combinations_finds_two_phase_mix(monkeypatch, beam):
+    if beam:
+        monkeypatch.setattr(search, "MAX_EXHAUSTIVE", 0)
+    profiles = _profiles()
+    intensity = 2 * profiles[:, 1] + 0.5 * profiles[:, 5] + 3
+    ranked = rank_combinations(TWO_THETA, intensity, profiles, max_phases=3, top=5)
+
+    best = ranked[2][0]
+    assert best["phases"] == [1, 5]
+    np.testing.assert_allclose(best["scales"], [2, 0.5], rtol=1e-6)
+    assert best["background"] == pytest.approx(3, rel=1e-6)
+    assert best["residual"] < 1e-3
+    assert all(1 in combination["phases"] and 5 in combination["phases"] for combination in ranked[3])
+
+@pytest.mark.parametrize("k", [1, 2, 3])
+def test_rank_combinations_exhaustive_matches_brute_force(k):
+    profiles = _profiles(seed=1)
+    rng = np.random.default_rng(2)
+    weights = rng.uniform(0, 1, profiles.shape[1]) * (rng.uniform(size=profiles.shape[1]) < 0.4)
+    intensity = profiles @ weights + 1
+    intensity += rng.normal(0, 0.5, len(intensity))
+    ranked = rank_combinations(TWO_THETA, intensity, profiles, max_phases=k, top=10)[k]
+
+    # Subsets whose extra phase gets a zero scale tie, so compare residuals rather than order.
+    residuals = _brute_force(intensity, profiles, k)
+    np.testing.assert_allclose([c["residual"] for c in ranked], sorted(residuals.values())[:10], rtol=1e-6)
+    np.testing.assert_allclose([c["residual"] for c in ranked], [residuals[tuple(c["phases"])] for c in ranked], rtol=1e-6)
+
+def _cif(structure):
+    return "data:chemical/x-cif;base64," + base64.b64encode(str(CifWriter(structure)).encode()).decode()
+
+def test_search_phases_reports_candidates_by_input_index():
+    candidates = [
+        _cif(Structure.from_spacegroup("Fm-3m", Lattice.cubic(5.64), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.5, 0.5]])),
+        "data:chemical/x-cif;base64," + base64.b64encode(b"not a cif").decode(),
+        _cif(Structure.from_spacegroup("Fm-3m", Lattice.cubic(4.05), ["Al"], [[0, 0, 0]])),
+        _cif(Structure.from_spacegroup("Fd-3m", Lattice.cubic(5.43), ["Si"], [[0, 0, 0]])),
+    ]
+    patterns = [phase_pattern(contents, None, FULL_TWO_THETA_RANGE, "global")[0] for contents in (candidates[0], candidates[3])]
+    intensity = profile_matrix(TWO_THETA, patterns) @ [1.5, 0.7] + 2
+
+    ranked, errors = search_phases(TWO_THETA, intensity, candidates, max_phases=2, top=3)
+    assert list(errors) == [1]
+    assert ranked[2][0]["phases"] == [0, 3]
+    np.testing.assert_allclose(ranked[2][0]["scales"], [1.5, 0.7], rtol=1e-6)
+    assert ranked[2][0]["residual"] < 1e-3
@@ -0,0 +1,25 @@
+import numpy as np
+from pymatgen.core import Lattice, Structure
+from preprocess import XRDCalculator
+
+def test_solid_solution_end_members_are_their_own_patterns():
+    start = Structure(Lattice.orthorhombic(4.0, 5.0, 6.0), ["Na", "Cl"], [[0, 0, 0], [0.5, 0.52, 0.5]])
+    end = Structure(Lattice.orthorhombic(4.3, 4.8, 6.5), ["K", "Cl"], [[0, 0, 0], [0.5, 0.48, 0.5]])
+    calculator = XRDCalculator()
+    series = calculator.get_solid_solution(start, end, [0, 0.5, 1], (10, 90))
+    for peaks, member in ((series["peaks"][0], start), (series["peaks"][2], end)):
+        expected = calculator.get_pattern(member, scaled=False, two_theta_range=(10, 90))
+        np.testing.assert_allclose(peaks["two_theta"], expected.x)
+        np.testing.assert_allclose(peaks["intensity"], expected.y)
+
+def test_solid_solution_labels_hexagonal_peaks_with_four_indices():
+    start = Structure.from_spacegroup("P6_3mc", Lattice.hexagonal(3.25, 5.21), ["Zn", "O"],
+                                      [[1 / 3, 2 / 3, 0], [1 / 3, 2 / 3, 0.382]])
+    end = start.copy()
+    end.replace_species({"Zn": "Mg"})
+    end.scale_lattice(start.volume * 1.03)
+    series = XRDCalculator().get_solid_solution(start, end, [0, 0.5, 1], (10, 90))
+    for peaks in series["peaks"]:
+        hkl = peaks["hkl"]
+        assert hkl.shape[1] == 4
+        np.testing.assert_array_equal(hkl[:, 2], -hkl[:, 0] - hkl[:, 1])
@@ -0,0 +1,87 @@
+"""
+Pool shared by all requests of a worker process, for running independent per-phase work
+(structure lookup, lattice rebuild, pattern calculation) in parallel.
+
+Threads suit gthread gunicorn workers: the NumPy-heavy parts release the GIL and every thread
+shares the process's memory. The process pool sidesteps the GIL entirely at the cost of
+pickling arguments and results; its workers read the same shared cache.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from cache import content_hash
+from config import PHASE_POOL, PHASE_WORKERS
+
+_pool = None
+_pool_pid = None
+_lock = threading.Lock()
+# Calls made with a timeout that are still running, by function and arguments.
+_inflight = {}
+
+def _executor():
+    # One pool per process, created on first use; a pool must not cross a fork.
+    global _pool, _pool_pid
+    with _lock:
+        if _pool is None or _pool_pid != os.getpid():
+            if PHASE_POOL == "process":
+                import multiprocessing
+                _pool = ProcessPoolExecutor(max_workers=PHASE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+            else:
+                _pool = ThreadPoolExecutor(max_workers=PHASE_WORKERS, thread_name_prefix="phase")
+            _pool_pid = os.getpid()
+            _inflight.clear()
+        return _pool
+
+def _submit_shared(executor, fn, args):
+    # A call identical to one still running joins it instead of starting over.
+    key = content_hash(fn.__module__, fn.__qualname__, *args)
+    with _lock:
+        future = _inflight.get(key)
+        if future is None:
+            future = _inflight[key] = executor.submit(fn, *args)
+            submitted = True
+        else:
+            submitted = False
+    if submitted:
+        future.add_done_callback(lambda done: _forget(key, done))
+    return future
+
+def _forget(key, future):
+    with _lock:
+        if _inflight.get(key) is future:
+            del _inflight[key]
+
+def map_ordered(fn, arg_tuples, timeout=None):
+    """
+    Call fn(*args) for every tuple on the shared pool and return a list of
+    (result, exception) pairs in input order. Runs inline when the pool is off
+    or there is only one call.
+
+    With a timeout in seconds, calls unfinished when it expires come back as TimeoutError
+    and keep running; a later identical call with a timeout picks up the running one, so
+    retries wait for it rather than start it again. The pool is used even for one call
+    then, but a timeout cannot be enforced with the pool off.
+    """
+    arg_tuples = list(arg_tuples)
+    if PHASE_POOL == "off" or (timeout is None and (PHASE_WORKERS <= 1 or len(arg_tuples) <= 1)):
+        futures = None
+    elif timeout is None:
+        executor = _executor()
+        futures = [executor.submit(fn, *args) for args in arg_tuples]
+    else:
+        executor = _executor()
+        futures = [_submit_shared(executor, fn, args) for args in arg_tuples]
+    deadline = None if timeout is None else time.monotonic() + timeout
+
+    results = []
+    for index, args in enumerate(arg_tuples):
+        try:
+            if futures is None:
+                result = fn(*args)
+            else:
+                result = futures[index].result(None if deadline is None else max(0.0, deadline - time.monotonic()))
+            results.append((result, None))
+        except Exception as e:
+            results.append((None, e))
+    return results